@@ -0,0 +1,556 @@
+# -*- coding: utf-8 -*-
+"""DCSS message pipeline benchmark.
+
+Runs a real Dhs with a DcssClientConnection against a local fake DCSS server and replays message mixes through it:
+
+registration_storm - What a DHS sees when DCSS (re)starts, bursts of device registrations and configurations mixed
+with broadcasts the DHS has no class for, each burst ends with an operation the DHS completes.
+
+operation_loop - Operations that the DHS answers with a number of operation updates and an operation completed.
+
+motor_flood - Motor moves that the DHS answers with a move started, a number of position updates and a move
+completed.
+
+replay - Messages recorded from a real DCSS, one per line, replayed in bursts like the registration storm.
+
+The fake DCSS runs in its own process so the CPU time measured in this process is the DHS's alone. For every
+scenario, execution mode and framing the results report messages per second through the DHS (messages received from
+and sent to DCSS), the round trip latency of the requests, CPU time per message and allocations per message. They are
+written to a JSON file, pass an earlier file with --compare to see the differences.
+
+Allocations per message are estimated from the garbage collector's generation 0 counter, which counts allocations
+less deallocations of container objects between collections, so they are a lower bound that is mostly useful to
+compare runs.
+
+Example::
+
+    python benchmarks/bench_dcss.py --output after.json --compare before.json
+"""
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import context as _context  # noqa: F401
+from fake_dcss import Request, serve
+from pydhsfw.dcss import (
+    DcssContext,
+    DcssHtoSClientIsHardware,
+    DcssHtoSMotorMoveCompleted,
+    DcssHtoSMotorMoveStarted,
+    DcssHtoSOperationCompleted,
+    DcssHtoSOperationUpdate,
+    DcssHtoSUpdateMotorPosition,
+    DcssStoCSendClientType,
+    DcssStoHConfigureRealMotor,
+    DcssStoHRegisterEncoder,
+    DcssStoHRegisterIonChamber,
+    DcssStoHRegisterOperation,
+    DcssStoHRegisterRealMotor,
+    DcssStoHRegisterShutter,
+    DcssStoHRegisterString,
+    DcssStoHStartMotorMove,
+    DcssStoHStartOperation,
+    register_dcss_start_operation_handler,
+)
+from pydhsfw.dhs import Dhs, DhsContext, DhsStart
+from pydhsfw.processors import register_message_handler
+
+_logger = logging.getLogger(__name__)
+
+CONNECTION_NAME = 'dcss'
+SCENARIOS = ('registration_storm', 'operation_loop', 'motor_flood')
+
+# Settings for the handlers below, set by run_dhs() before the Dhs starts.
+_bench = {}
+
+
+# --------------------------------------------------------------------------
+# DHS side
+
+
+@register_message_handler('dhs_start')
+def dhs_start(message: DhsStart, context: DhsContext):
+    _bench['context'] = context
+    context.create_connection(
+        CONNECTION_NAME, 'dcss', _bench['url'], _bench['connection_config']
+    ).connect()
+
+
+@register_message_handler('stoc_send_client_type')
+def send_client_type(message: DcssStoCSendClientType, context: DcssContext):
+    context.get_connection(CONNECTION_NAME).send(DcssHtoSClientIsHardware('benchdhs'))
+
+
+@register_message_handler('stoh_register_operation')
+def register_operation(message: DcssStoHRegisterOperation, context: DcssContext):
+    _bench['registered'] += 1
+
+
+@register_message_handler('stoh_register_real_motor')
+def register_real_motor(message: DcssStoHRegisterRealMotor, context: DcssContext):
+    _bench['registered'] += 1
+
+
+@register_message_handler('stoh_register_string')
+def register_string(message: DcssStoHRegisterString, context: DcssContext):
+    _bench['registered'] += 1
+
+
+@register_message_handler('stoh_register_shutter')
+def register_shutter(message: DcssStoHRegisterShutter, context: DcssContext):
+    _bench['registered'] += 1
+
+
+@register_message_handler('stoh_register_ion_chamber')
+def register_ion_chamber(message: DcssStoHRegisterIonChamber, context: DcssContext):
+    _bench['registered'] += 1
+
+
+@register_message_handler('stoh_register_encoder')
+def register_encoder(message: DcssStoHRegisterEncoder, context: DcssContext):
+    _bench['registered'] += 1
+
+
+@register_message_handler('stoh_configure_real_motor')
+def configure_real_motor(message: DcssStoHConfigureRealMotor, context: DcssContext):
+    # Read a few typed arguments like a real DHS would.
+    message.motor_position, message.motor_upperLimit, message.motor_lowerLimit
+    _bench['registered'] += 1
+
+
+@register_dcss_start_operation_handler('bench_sync')
+def bench_sync(message: DcssStoHStartOperation, context: DcssContext):
+    context.get_connection(CONNECTION_NAME).send(
+        DcssHtoSOperationCompleted(
+            message.operation_name, message.operation_handle, 'normal', 'synced'
+        )
+    )
+
+
+@register_dcss_start_operation_handler('bench_op')
+def bench_op(message: DcssStoHStartOperation, context: DcssContext):
+    connection = context.get_connection(CONNECTION_NAME)
+    name = message.operation_name
+    handle = message.operation_handle
+    for i in range(int(message.operation_args[0])):
+        connection.send(DcssHtoSOperationUpdate(name, handle, f'progress {i}'))
+    connection.send(DcssHtoSOperationCompleted(name, handle, 'normal', 'done'))
+
+
+@register_message_handler('stoh_start_motor_move')
+def start_motor_move(message: DcssStoHStartMotorMove, context: DcssContext):
+    connection = context.get_connection(CONNECTION_NAME)
+    motor = message.motor_name
+    target = message.motor_position
+    connection.send(DcssHtoSMotorMoveStarted(motor, target))
+    updates = _bench['motor_updates']
+    for i in range(updates):
+        connection.send(
+            DcssHtoSUpdateMotorPosition(
+                motor, target * (i + 1) / (updates + 1), 'normal'
+            )
+        )
+    connection.send(DcssHtoSMotorMoveCompleted(motor, target, 'normal'))
+
+
+# --------------------------------------------------------------------------
+# Message mixes
+
+
+def _sync_request(messages: list, handle: str) -> Request:
+    messages.append(f'stoh_start_operation bench_sync {handle}'.encode('ascii'))
+    return Request(
+        messages, f'htos_operation_completed bench_sync {handle}'.encode('ascii')
+    )
+
+
+def registration_storm(storms: int, devices: int) -> list:
+    requests = []
+    for storm in range(storms):
+        messages = []
+        for i in range(devices):
+            messages += [
+                f'stoh_register_real_motor motor{i} motor{i}',
+                f'stoh_configure_real_motor motor{i} {i}.5 100.0 -100.0 1000.0 500 100 10 1 1 0 1 0',
+                f'stoh_register_operation operation{i} operation{i}',
+                f'stoh_register_string string{i} string{i}',
+                f'stoh_register_shutter shutter{i} closed shutter{i}',
+                f'stoh_register_ion_chamber i{i} i{i} counter{i} timer{i} clock',
+                f'stoh_register_encoder encoder{i} encoder{i}',
+                # Broadcasts for other clients, the DHS has no classes for these.
+                f'stog_configure_string string{i} self {i} value {i}',
+                f'stog_update_motor_position motor{i} {i}.25 normal',
+            ]
+        requests.append(
+            _sync_request([m.encode('ascii') for m in messages], f'2.{storm}')
+        )
+    return requests
+
+
+def operation_loop(count: int, updates: int) -> list:
+    return [
+        Request(
+            [f'stoh_start_operation bench_op 1.{i} {updates}'.encode('ascii')],
+            f'htos_operation_completed bench_op 1.{i}'.encode('ascii'),
+        )
+        for i in range(count)
+    ]
+
+
+def motor_flood(count: int) -> list:
+    # A motor per request so a request is completed by its own move completed message.
+    return [
+        Request(
+            [f'stoh_start_motor_move bench_motor{i} {i % 360}.5'.encode('ascii')],
+            f'htos_motor_move_completed bench_motor{i}'.encode('ascii'),
+        )
+        for i in range(count)
+    ]
+
+
+def replay(path: str, burst: int, repeat: int) -> list:
+    with open(path, 'rb') as f:
+        lines = [
+            line.strip()
+            for line in f
+            if line.strip() and not line.lstrip().startswith(b'#')
+        ]
+    requests = []
+    for r in range(repeat):
+        for start in range(0, len(lines), burst):
+            requests.append(
+                _sync_request(lines[start : start + burst], f'3.{r}.{start}')
+            )
+    return requests
+
+
+def build_requests(scenario: str, args) -> list:
+    if scenario == 'registration_storm':
+        return registration_storm(args.storms, args.devices)
+    if scenario == 'operation_loop':
+        return operation_loop(args.requests, args.updates)
+    if scenario == 'motor_flood':
+        return motor_flood(args.requests)
+    if scenario == 'replay':
+        return replay(args.replay, args.burst, args.repeat)
+    raise ValueError(f'Unknown scenario {scenario}')
+
+
+# --------------------------------------------------------------------------
+# Running
+
+
+def percentile(ordered: list, p: float) -> float:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def latency_summary(latencies: list) -> dict:
+    ordered = sorted(latencies)
+    ms = 1e3
+    return {
+        'count': len(ordered),
+        'mean_ms': sum(ordered) / len(ordered) * ms if ordered else None,
+        'p50_ms': percentile(ordered, 0.5) * ms if ordered else None,
+        'p90_ms': percentile(ordered, 0.9) * ms if ordered else None,
+        'p99_ms': percentile(ordered, 0.99) * ms if ordered else None,
+        'max_ms': ordered[-1] * ms if ordered else None,
+    }
+
+
+class FakeDcssProcess:
+    """Runs the fake DCSS server in a child process."""
+
+    def __init__(self, framing: str, timeout: float = 30.0):
+        self._timeout = timeout
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=serve, args=(child_conn, framing), name='fake dcss', daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        self.port = self._recv()
+
+    def _recv(self, timeout: float = None):
+        if not self._conn.poll(self._timeout if timeout is None else timeout):
+            raise TimeoutError('No reply from the fake DCSS server')
+        reply = self._conn.recv()
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def wait_for_dhs(self) -> str:
+        return self._recv()
+
+    def load(self, requests: list):
+        self._conn.send(('load', requests))
+        self._recv()
+
+    def run(self, window: int, timeout: float) -> dict:
+        self._conn.send(('run', window))
+        return self._recv(timeout)
+
+    def close(self):
+        try:
+            self._conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._conn.close()
+
+
+def _gc_allocations() -> int:
+    """Generation 0 collections times the threshold plus the current count, see the module docstring."""
+    return gc.get_stats()[0]['collections'] * gc.get_threshold()[0] + gc.get_count()[0]
+
+
+def run_scenario(server: FakeDcssProcess, scenario: str, args) -> dict:
+    requests = build_requests(scenario, args)
+    window = args.window if scenario in ('operation_loop', 'motor_flood') else 1
+
+    # Warm up with the start of the mix, caches and lazily compiled dispatch tables are filled in on first use.
+    warmup = requests[: max(1, len(requests) // 10)]
+    server.load(warmup)
+    server.run(window, args.timeout)
+    server.load(requests)
+
+    metrics = _bench['context'].metrics
+    metrics.reset()
+    gc.collect()
+    allocations = _gc_allocations()
+    blocks = sys.getallocatedblocks()
+    cpu = time.process_time()
+
+    result = server.run(window, args.timeout)
+
+    cpu = time.process_time() - cpu
+    allocations = _gc_allocations() - allocations
+    blocks = sys.getallocatedblocks() - blocks
+
+    messages = result['messages_sent'] + result['messages_received']
+    summary = {
+        'scenario': scenario,
+        'requests': result['requests'],
+        'window': window,
+        # Message counts are from the DHS's point of view.
+        'messages_received': result['messages_sent'],
+        'messages_sent': result['messages_received'],
+        'messages': messages,
+        'elapsed': result['elapsed'],
+        'msgs_per_sec': messages / result['elapsed'],
+        'requests_per_sec': result['requests'] / result['elapsed'],
+        'latency': latency_summary(result['latencies']),
+        'cpu_seconds': cpu,
+        'cpu_us_per_msg': cpu / messages * 1e6,
+        'gc_allocations_per_msg': allocations / messages,
+        'retained_blocks_per_msg': blocks / messages,
+    }
+    if metrics.enabled:
+        summary['pipeline_metrics'] = metrics.snapshot()
+    return summary
+
+
+def run_dhs(mode: str, framing: str, scenarios: list, args) -> list:
+    server = FakeDcssProcess(framing)
+    _bench.update(
+        url=f'dcss://127.0.0.1:{server.port}',
+        connection_config=args.connection_config,
+        motor_updates=args.updates,
+        registered=0,
+    )
+    config = dict(args.dhs_config, execution_mode=mode)
+    if args.pipeline_metrics:
+        config['metrics_enabled'] = True
+
+    dhs = Dhs(config)
+    dhs.start()
+    results = []
+    try:
+        server.wait_for_dhs()
+        for scenario in scenarios:
+            result = run_scenario(server, scenario, args)
+            result.update(mode=mode, framing=framing)
+            results.append(result)
+            print_result(result)
+    finally:
+        dhs.shutdown()
+        dhs.wait()
+        server.close()
+    return results
+
+
+# --------------------------------------------------------------------------
+# Reporting
+
+
+def _key(result: dict) -> tuple:
+    return (result['scenario'], result['mode'], result['framing'])
+
+
+def print_result(result: dict):
+    latency = result['latency']
+    print(
+        f'{result["scenario"]:<20} {result["mode"]:<9} {result["framing"]:<3} '
+        f'{result["msgs_per_sec"]:>10.0f} msgs/s  p50 {latency["p50_ms"]:>8.3f} ms  '
+        f'p99 {latency["p99_ms"]:>8.3f} ms  cpu {result["cpu_us_per_msg"]:>7.1f} us/msg  '
+        f'allocs {result["gc_allocations_per_msg"]:>6.1f}/msg',
+        flush=True,
+    )
+
+
+def _change(old: float, new: float) -> str:
+    if not old:
+        return ''
+    return f'{(new - old) / old * 100:+.1f}%'
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {_key(r): r for r in json.load(f)['results']}
+
+    print(f'\nCompared to {baseline_path}')
+    print(
+        f'{"scenario":<20} {"mode":<9} {"fr":<3} {"msgs/s":>16} {"p99 ms":>16} {"cpu us/msg":>16}'
+    )
+    for result in results:
+        old = baseline.get(_key(result))
+        if old is None:
+            continue
+        print(
+            f'{result["scenario"]:<20} {result["mode"]:<9} {result["framing"]:<3} '
+            f'{_change(old["msgs_per_sec"], result["msgs_per_sec"]):>16} '
+            f'{_change(old["latency"]["p99_ms"], result["latency"]["p99_ms"]):>16} '
+            f'{_change(old["cpu_us_per_msg"], result["cpu_us_per_msg"]):>16}'
+        )
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv: list):
+    parser = argparse.ArgumentParser(description='DCSS message pipeline benchmark')
+    parser.add_argument(
+        '--scenarios',
+        nargs='+',
+        choices=SCENARIOS + ('replay',),
+        help='scenarios to run, all built in ones by default, replay when --replay is given',
+    )
+    parser.add_argument(
+        '--modes',
+        nargs='+',
+        choices=('threaded', 'asyncio'),
+        default=['threaded', 'asyncio'],
+    )
+    parser.add_argument(
+        '--framings', nargs='+', choices=('v1', 'v2'), default=['v1', 'v2']
+    )
+    parser.add_argument(
+        '--requests', type=int, default=2000, help='operations or motor moves per run'
+    )
+    parser.add_argument(
+        '--updates',
+        type=int,
+        default=5,
+        help='updates sent per operation or motor move',
+    )
+    parser.add_argument(
+        '--window', type=int, default=8, help='operations or motor moves in flight'
+    )
+    parser.add_argument(
+        '--storms', type=int, default=20, help='registration storms per run'
+    )
+    parser.add_argument(
+        '--devices', type=int, default=50, help='devices registered per storm'
+    )
+    parser.add_argument('--replay', help='file of recorded DCSS messages, one per line')
+    parser.add_argument(
+        '--burst', type=int, default=100, help='replayed messages per burst'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=10, help='times to replay the file'
+    )
+    parser.add_argument(
+        '--dhs-config', type=json.loads, default={}, help='Dhs config as JSON'
+    )
+    parser.add_argument(
+        '--connection-config',
+        type=json.loads,
+        default={},
+        help='DCSS connection config as JSON',
+    )
+    parser.add_argument(
+        '--pipeline-metrics',
+        action='store_true',
+        help='also record the DHS pipeline metrics, this adds some overhead',
+    )
+    parser.add_argument(
+        '--timeout', type=float, default=300.0, help='seconds to wait for a run'
+    )
+    parser.add_argument(
+        '--output', default='dcss_benchmark.json', help='JSON results file'
+    )
+    parser.add_argument('--compare', help='earlier JSON results file to compare with')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args(argv)
+
+    if not args.scenarios:
+        args.scenarios = list(SCENARIOS) + (['replay'] if args.replay else [])
+    if 'replay' in args.scenarios and not args.replay:
+        parser.error('the replay scenario needs --replay')
+    return args
+
+
+def main(argv: list = None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=args.log_level.upper())
+
+    results = []
+    for mode in args.modes:
+        for framing in args.framings:
+            results += run_dhs(mode, framing, args.scenarios, args)
+
+    report = {
+        'benchmark': 'dcss_pipeline',
+        'created': datetime.now(timezone.utc).isoformat(),
+        'commit': _git_commit(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {
+            name: value
+            for name, value in vars(args).items()
+            if name not in ('output', 'compare', 'log_level')
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
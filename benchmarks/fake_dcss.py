@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+
+V1_MSG_SIZE = 200
+V2_HEADER_SIZE = 26
+
+
+def pack_v1(text: bytes) -> bytes:
+    if len(text) > V1_MSG_SIZE:
+        raise ValueError(f'DCS version 1 messages are limited to {V1_MSG_SIZE} bytes')
+    return text.ljust(V1_MSG_SIZE, b'\x00')
+
+
+def pack_v2(text: bytes) -> bytes:
+    text += b'\x00'
+    return b'%12d%13d\x00' % (len(text), 0) + text
+
+
+class Request:
+    """Messages the fake DCSS sends in one go and the reply that completes them.
+
+    done_key - The first words of the DHS reply that completes the request, e.g. b'htos_operation_completed op 1.1'.
+    """
+
+    __slots__ = ('messages', 'done_key')
+
+    def __init__(self, messages: list, done_key: bytes):
+        self.messages = messages
+        self.done_key = done_key
+
+
+class FakeDcssServer:
+    """Stand-in for DCSS that drives a connected DHS with scripted requests and times the replies.
+
+    Like DCSS it greets the DHS with a version 1 stoc_send_client_type message and expects a version 1
+    htos_client_is_hardware reply. From then on it speaks the configured framing, 'v1' for fixed 200 byte messages
+    or 'v2' for messages with a size header, and the DHS answers in kind.
+
+    run() keeps up to window requests in flight, the round trip of a request is the time from sending its messages to
+    receiving the reply that completes it.
+    """
+
+    def __init__(self, framing: str = 'v2', host: str = '127.0.0.1', port: int = 0):
+        if framing not in ('v1', 'v2'):
+            raise ValueError(f'Unknown framing {framing}, use v1 or v2')
+        self._framing = framing
+        self._pack = pack_v1 if framing == 'v1' else pack_v2
+        self._listener = socket.socket()
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, port))
+        self._listener.listen(1)
+        self._sock = None
+        self._reader = None
+        self._dhs_name = None
+
+    @property
+    def port(self) -> int:
+        return self._listener.getsockname()[1]
+
+    @property
+    def dhs_name(self) -> str:
+        return self._dhs_name
+
+    def accept(self, timeout: float = 30.0) -> str:
+        """Wait for the DHS to connect and register, returns the name the DHS registered with."""
+
+        self._listener.settimeout(timeout)
+        self._sock, _ = self._listener.accept()
+        self._sock.settimeout(None)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile('rb')
+
+        self._sock.sendall(pack_v1(b'stoc_send_client_type'))
+        reply = self._read_v1()
+        if not reply.startswith(b'htos_client_is_hardware'):
+            raise ConnectionError(f'Unexpected registration reply {reply}')
+        self._dhs_name = reply.split(b' ')[1].decode('ascii')
+        return self._dhs_name
+
+    def _read_exactly(self, size: int) -> bytes:
+        data = self._reader.read(size)
+        if len(data) < size:
+            raise ConnectionAbortedError('DHS closed the connection')
+        return data
+
+    def _read_v1(self) -> bytes:
+        return self._read_exactly(V1_MSG_SIZE).rstrip(b'\x00\r\n')
+
+    def _read_v2(self) -> bytes:
+        header = self._read_exactly(V2_HEADER_SIZE).rstrip(b'\x00\r\n').split()
+        text = self._read_exactly(int(header[0]))
+        if int(header[1]):
+            self._read_exactly(int(header[1]))
+        return text.rstrip(b'\x00\r\n')
+
+    def run(self, requests: list, window: int = 1, timeout: float = 300.0) -> dict:
+        """Send the requests keeping up to window of them in flight and wait for them all to complete."""
+
+        read = self._read_v1 if self._framing == 'v1' else self._read_v2
+        pack = self._pack
+        slots = threading.Semaphore(max(1, window))
+        outstanding = {}
+        latencies = []
+        received = [0]
+        done = threading.Event()
+        failed = []
+
+        def read_replies():
+            try:
+                while len(latencies) < len(requests):
+                    reply = read()
+                    now = time.perf_counter()
+                    received[0] += 1
+                    words = reply.split(b' ', 3)
+                    for key in (b' '.join(words[:3]), b' '.join(words[:2])):
+                        sent = outstanding.pop(key, None)
+                        if sent is not None:
+                            latencies.append(now - sent)
+                            slots.release()
+                            break
+            except Exception as e:
+                failed.append(e)
+            finally:
+                done.set()
+                # Unblock the sender if the reader gave up.
+                slots.release()
+
+        reader = threading.Thread(target=read_replies, name='fake dcss reader')
+        start = time.perf_counter()
+        reader.start()
+
+        sent = 0
+        for request in requests:
+            slots.acquire()
+            if done.is_set():
+                break
+            buffer = b''.join(map(pack, request.messages))
+            outstanding[request.done_key] = time.perf_counter()
+            self._sock.sendall(buffer)
+            sent += len(request.messages)
+
+        if not done.wait(timeout):
+            failed.append(TimeoutError(f'{len(outstanding)} requests did not complete'))
+        elapsed = time.perf_counter() - start
+
+        if failed:
+            # The reader may still be blocked, closing the connection ends it.
+            self.close()
+            raise failed[0]
+        reader.join()
+
+        return {
+            'requests': len(requests),
+            'messages_sent': sent,
+            'messages_received': received[0],
+            'elapsed': elapsed,
+            'latencies': latencies,
+        }
+
+    def close(self):
+        for closeable in (self._reader, self._sock, self._listener):
+            if closeable is not None:
+                try:
+                    closeable.close()
+                except OSError:
+                    pass
+
+
+def serve(conn, framing: str):
+    """Run a FakeDcssServer controlled over a multiprocessing connection.
+
+    Sends the port, then the registered DHS name once the DHS has connected, then waits for commands:
+    ('load', requests) stores the requests to run, ('run', window) runs them and sends back the results, None exits.
+    Errors are sent back as exceptions.
+    """
+
+    server = FakeDcssServer(framing)
+    try:
+        conn.send(server.port)
+        conn.send(server.accept())
+        requests = []
+        while True:
+            command = conn.recv()
+            if command is None:
+                break
+            try:
+                if command[0] == 'load':
+                    requests = command[1]
+                    conn.send(len(requests))
+                elif command[0] == 'run':
+                    conn.send(server.run(requests, command[1]))
+            except Exception as e:
+                conn.send(e)
+                break
+    except Exception as e:
+        conn.send(e)
+    finally:
+        server.close()
+        conn.close()
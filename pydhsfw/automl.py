@@ -1,46 +1,270 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import base64
+import hashlib
+import io
+import json
 import logging
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from threading import Lock
 from typing import Any
-from dotty_dict import dotty
+import cv2
+import numpy as np
+from requests import Request, Response
 from pydhsfw.messages import (
     IncomingMessageQueue,
     OutgoingMessageQueue,
     MessageFactory,
+    QueueFullError,
     register_message,
 )
-from pydhsfw.connection import ConnectionBase, register_connection
+from pydhsfw.connection import (
+    AsyncConnectionBase,
+    ConnectionBase,
+    ExecutionMode,
+    register_connection,
+)
+from pydhsfw.threads import CancellableThreadPoolExecutor
 from pydhsfw.http import (
-    PostJsonRequestMessage,
+    AsyncHttpClientTransport,
+    Headers,
+    PostStreamingRequestMessage,
     JsonResponseMessage,
     HttpClientTransport,
     MessageResponseReader,
     MessageRequestWriter,
     ResponseMessage,
+    StreamingBody,
+    parse_json,
 )
 
 _logger = logging.getLogger(__name__)
 
 
+class AutoMLPredictBody(StreamingBody):
+    """The json body of a predict request, encoded as it is sent.
+
+    The json is written straight out around the base64 encoded images, a chunk of each image at a time, so the
+    images are neither encoded when the request message is created nor copied into a json string. The images are
+    kept by reference until the request is sent and must not be modified in the meantime.
+
+    instances - A list of (key, image) tuples, image is a bytes-like object, e.g. bytes or a memoryview, or a Future
+    of one, see preprocess.
+    params - The prediction params, anything json serializable.
+    """
+
+    content_type = 'application/json'
+
+    # A multiple of 3 so every chunk but the last one encodes without padding.
+    CHUNK_SIZE = 3 * 2 ** 16
+
+    def __init__(self, instances: list, params: Any = None):
+        self._instances = list(instances)
+        self._params = params
+        self._params_json = json.dumps(params).encode()
+
+    @property
+    def instances(self) -> list:
+        """The (key, image) tuples, waits for any images that are being preprocessed."""
+
+        if any(isinstance(image, Future) for _, image in self._instances):
+            self._instances = [
+                (key, image.result() if isinstance(image, Future) else image)
+                for key, image in self._instances
+            ]
+        return self._instances
+
+    @property
+    def params(self) -> Any:
+        return self._params
+
+    @property
+    def params_json(self) -> bytes:
+        return self._params_json
+
+    @staticmethod
+    def combine(bodies: list):
+        """Returns a body with the instances of all the bodies, all of them must have the same params."""
+        # Images that are still being preprocessed aren't waited for.
+        return AutoMLPredictBody(
+            [i for body in bodies for i in body._instances], bodies[0].params
+        )
+
+    def preprocess(self, preprocessor: 'AutoMLImagePreprocessor'):
+        """Replace the images with preprocessed ones, which are waited for when the body is sent."""
+        self._instances = [
+            (key, preprocessor.submit(image)) for key, image in self._instances
+        ]
+
+    def __iter__(self):
+        # Small pieces of json are sent along with the next chunk of image instead of on their own.
+        head = b'{"instances": ['
+        for n, (key, image) in enumerate(self.instances):
+            image = memoryview(image).cast('B')
+            head += (b', ' if n else b'') + b'{"image_bytes": {"b64": "'
+            for start in range(0, len(image), self.CHUNK_SIZE):
+                yield head + base64.b64encode(image[start : start + self.CHUNK_SIZE])
+                head = b''
+            head += b'"}, "key": ' + json.dumps(key).encode() + b'}'
+        yield head + b'], "params": ' + self._params_json + b'}'
+
+    def __len__(self) -> int:
+        # The json around the instances, then each instance.
+        size = len(b'{"instances": [], "params": }') + len(self._params_json)
+        for n, (key, image) in enumerate(self.instances):
+            size += (2 if n else 0) + len(b'{"image_bytes": {"b64": "')
+            size += (memoryview(image).nbytes + 2) // 3 * 4
+            size += len(b'"}, "key": ') + len(json.dumps(key).encode()) + 1
+        return size
+
+    def __repr__(self):
+        return (
+            f'{type(self).__name__}(keys={[key for key, _ in self._instances]}, '
+            f'params={self._params})'
+        )
+
+
 @register_message('automl_predict_request')
-class AutoMLPredictRequest(PostJsonRequestMessage):
-    """Formats a json data package and sends to the GCP AutoML server for prediction."""
+class AutoMLPredictRequest(PostStreamingRequestMessage):
+    """Formats a json data package and sends to the GCP AutoML server for prediction.
+
+    The image is base64 encoded when the request is sent, see AutoMLPredictBody, not when the message is created.
+    """
 
     def __init__(self, key: str, image: bytes):
+        super().__init__(
+            '/v1/models/default:predict',
+            AutoMLPredictBody([(key, image)], [{'max_bounding_box_count': '10'}]),
+        )
 
-        encoded_image = base64.b64encode(image).decode('utf-8')
 
-        instances = {
-            'instances': [{'image_bytes': {'b64': str(encoded_image)}, 'key': key}],
-            'params': [{'max_bounding_box_count': '10'}],
-        }
+class AutoMLImagePreprocessor:
+    """Shrinks images before they are sent for prediction.
+
+    The model resizes images to its input size anyway, so sending full resolution camera frames only costs upload and
+    decoding time. With automl_image_size set to the model input size, as [width, height] or a single size for
+    square inputs, every image is decoded with OpenCV, scaled down to fit in that size keeping its aspect ratio and
+    re-encoded as a JPEG of automl_image_quality. Images that already fit, or that can't be decoded, are sent as they
+    are.
+
+    Images are scaled as a whole, they aren't cropped or padded, so the normalized detection_boxes of the response
+    apply to the original image as they are. Convert them to pixels with the original width and height, see
+    boxes_to_pixels.
+
+    The images are preprocessed in a pool of automl_preprocess_workers threads, OpenCV releases the GIL while it
+    works, from when the connection writes the request until its body is sent. The cache, see AutoMLInferenceCache,
+    is looked up first and keyed by the original image so cache hits aren't preprocessed.
+    """
+
+    AUTOML_IMAGE_SIZE = 'automl_image_size'
+    AUTOML_IMAGE_QUALITY = 'automl_image_quality'
+    AUTOML_IMAGE_QUALITY_DEFAULT = 90
+    AUTOML_PREPROCESS_WORKERS = 'automl_preprocess_workers'
+    AUTOML_PREPROCESS_WORKERS_DEFAULT = 2
+
+    def __init__(self, connection_name: str, config: dict = {}):
+        size = config.get(self.AUTOML_IMAGE_SIZE)
+        if isinstance(size, (int, float)):
+            size = (size, size)
+        self._size = (int(size[0]), int(size[1])) if size else None
+        self._quality = int(
+            config.get(self.AUTOML_IMAGE_QUALITY, self.AUTOML_IMAGE_QUALITY_DEFAULT)
+        )
+        self._workers = int(
+            config.get(
+                self.AUTOML_PREPROCESS_WORKERS, self.AUTOML_PREPROCESS_WORKERS_DEFAULT
+            )
+        )
+        self._connection_name = connection_name
+        self._executor = None
+        self._lock = Lock()
 
-        super().__init__('/v1/models/default:predict', json=instances)
+    @property
+    def enabled(self) -> bool:
+        return self._size is not None
+
+    def preprocess(self, request: Request):
+        """Start preprocessing the images of request if it is a predict request."""
+
+        if self.enabled and isinstance(request.data, AutoMLPredictBody):
+            request.data.preprocess(self)
+
+    def submit(self, image) -> Future:
+        with self._lock:
+            if self._executor is None:
+                self._executor = CancellableThreadPoolExecutor(
+                    self._workers,
+                    thread_name_prefix=f'{self._connection_name} automl preprocess worker',
+                )
+        return self._executor.submit(self.process, image)
+
+    def process(self, image):
+        """Returns the image shrunk to fit in the image size, or the image itself if it doesn't need to be."""
+
+        try:
+            decoded = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+            if decoded is None:
+                _logger.warning('Could not decode the image, sending it as it is')
+                return image
+
+            height, width = decoded.shape[:2]
+            scale = min(self._size[0] / width, self._size[1] / height)
+            if scale >= 1:
+                return image
+
+            resized = cv2.resize(
+                decoded,
+                (max(1, round(width * scale)), max(1, round(height * scale))),
+                interpolation=cv2.INTER_AREA,
+            )
+            ok, encoded = cv2.imencode(
+                '.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, self._quality]
+            )
+            if not ok:
+                _logger.warning(
+                    'Could not encode the resized image, sending the original'
+                )
+                return image
+            return encoded
+
+        except Exception:
+            _logger.exception('Image preprocessing failed, sending the original image')
+            return image
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown_now()
+
+
+def boxes_to_pixels(boxes, width: int, height: int) -> np.ndarray:
+    """Convert normalized minY, minX, maxY, maxX bounding boxes to pixel coordinates in a width x height image.
+
+    boxes can be a single box or an array of boxes, the result has the same shape.
+    """
+    return np.asarray(boxes, dtype=float) * np.array(
+        (height, width, height, width), dtype=float
+    )
+
+
+def _read_only_array(values, dtype, shape=None) -> np.ndarray:
+    array = np.asarray(values, dtype=dtype)
+    if shape is not None:
+        array = array.reshape(shape)
+    array.setflags(write=False)
+    return array
 
 
 @register_message('automl_predict_response', 'automl')
 class AutoMLPredictResponse(JsonResponseMessage):
-    """Parses the response json file and stores various values the top hit in class properties."""
+    """Parses the response json once and keeps the detections of the first prediction in NumPy arrays.
+
+    The detections are kept in the order of the response and share their index across detection_scores,
+    detection_boxes, detection_classes and detection_classes_as_text, use top_k or top to find the best ones. The
+    arrays are read only, every handler of the message shares them.
+    """
 
     def __init__(self, response):
         super().__init__(response)
@@ -48,19 +272,86 @@ class AutoMLPredictResponse(JsonResponseMessage):
         self._loop_num = None
         # could we assign values to these two variables during __init__ ?
         # if these are "None" when any properties are accessed then we will get an error.
+        self._detections = None
+
+    @property
+    def prediction(self) -> dict:
+        """The first prediction in the response json."""
+        return self.json['predictions'][0]
+
+    def _get_detections(self) -> tuple:
+        if self._detections is None:
+            prediction = self.prediction
+            self._detections = (
+                _read_only_array(prediction.get('detection_scores', ()), float),
+                _read_only_array(prediction.get('detection_boxes', ()), float, (-1, 4)),
+                _read_only_array(prediction.get('detection_classes', ()), int),
+                _read_only_array(prediction.get('detection_classes_as_text', ()), str),
+            )
+        return self._detections
+
+    @property
+    def detection_scores(self) -> np.ndarray:
+        return self._get_detections()[0]
+
+    @property
+    def detection_boxes(self) -> np.ndarray:
+        """Bounding boxes as an N x 4 array of normalized minY, minX, maxY, maxX, see loop_top_bb."""
+        return self._get_detections()[1]
+
+    @property
+    def detection_classes(self) -> np.ndarray:
+        return self._get_detections()[2]
+
+    @property
+    def detection_classes_as_text(self) -> np.ndarray:
+        return self._get_detections()[3]
+
+    def top_k(self, k: int = 1, detection_class=None) -> np.ndarray:
+        """Returns the indices of the k highest scoring detections, best first.
+
+        detection_class limits them to one class, given as text (e.g. 'loop') or as an int.
+        """
+
+        scores = self.detection_scores
+        if detection_class is None:
+            indices = np.arange(len(scores))
+        elif isinstance(detection_class, str):
+            indices = np.flatnonzero(self.detection_classes_as_text == detection_class)
+        else:
+            indices = np.flatnonzero(self.detection_classes == detection_class)
+        return indices[np.argsort(-scores[indices], kind='stable')[:k]]
+
+    def top(self, detection_class=None) -> int:
+        """Returns the index of the highest scoring detection of a class, None if there isn't one."""
+
+        indices = self.top_k(1, detection_class)
+        return int(indices[0]) if len(indices) else None
+
+    def boxes_to_pixels(self, width: int, height: int, indices=None) -> np.ndarray:
+        """Returns the bounding boxes, or just those at indices, in pixel coordinates of a width x height image."""
+
+        boxes = self.detection_boxes
+        if indices is not None:
+            boxes = boxes[indices]
+        return boxes_to_pixels(boxes, width, height)
 
     def get_score(self, n: int) -> float:
         """Returns the AutoML inference score for the Nth object in a sorted results list"""
-        # _logger.info(f'AutoMLPredictResponse function called with {n}')
-        return dotty(self.json)[f'predictions.0.detection_scores.{n}']
+        return float(self.detection_scores[n])
 
     def get_detection_class_as_text(self, n: int) -> str:
         """Returns the AutoML classification (as text) for the Nth object in a sorted results list"""
-        return dotty(self.json)[f'predictions.0.detection_classes_as_text.{n}']
+        return str(self.detection_classes_as_text[n])
 
-    def get_detection_class_as_int(self, n: int) -> str:
+    def get_detection_class_as_int(self, n: int) -> int:
         """Returns the AutoML classification (as int) for the Nth object in a sorted results list"""
-        return dotty(self.json)[f'predictions.0.detection_classes.{n}']
+        return int(self.detection_classes[n])
+
+    def _get_box(self, n: int) -> np.ndarray:
+        if n is None:
+            raise ValueError('Set loop_num or pin_num to a detection index first')
+        return self.detection_boxes[n]
 
     @property
     def pin_num(self):
@@ -80,13 +371,18 @@ class AutoMLPredictResponse(JsonResponseMessage):
 
     @property
     def image_key(self):
-        return dotty(self.json)['predictions.0.key']
+        return self.prediction['key']
+
+    @property
+    def error(self) -> str:
+        """Why there is no prediction for the image, None when the server returned one."""
+        return self.prediction.get('error')
 
     @property
     def loop_top_score(self):
         # might want to do some sort of filtering here?
         # only accept if score if better than 90% or something?
-        return dotty(self.json)[f'predictions.0.detection_scores.{self._loop_num}']
+        return self.get_score(self._loop_num)
 
     @property
     def loop_top_bb(self):
@@ -105,49 +401,47 @@ class AutoMLPredictResponse(JsonResponseMessage):
         (0,1) Y-axis
 
         """
-        return dotty(self.json)[f'predictions.0.detection_boxes.{self._loop_num}']
+        return self._get_box(self._loop_num).tolist()
 
     @property
     def loop_bb_minY(self):
-        return dotty(self.json)[f'predictions.0.detection_boxes.{self._loop_num}.0']
+        return float(self._get_box(self._loop_num)[0])
 
     @property
     def loop_bb_minX(self):
-        return dotty(self.json)[f'predictions.0.detection_boxes.{self._loop_num}.1']
+        return float(self._get_box(self._loop_num)[1])
 
     @property
     def loop_bb_maxY(self):
-        return dotty(self.json)[f'predictions.0.detection_boxes.{self._loop_num}.2']
+        return float(self._get_box(self._loop_num)[2])
 
     @property
     def loop_bb_maxX(self):
-        return dotty(self.json)[f'predictions.0.detection_boxes.{self._loop_num}.3']
+        return float(self._get_box(self._loop_num)[3])
 
     @property
     def pin_bb_minY(self):
-        return dotty(self.json)[f'predictions.0.detection_boxes.{self._pin_num}.0']
+        return float(self._get_box(self._pin_num)[0])
 
     @property
     def pin_bb_minX(self):
-        return dotty(self.json)[f'predictions.0.detection_boxes.{self._pin_num}.1']
+        return float(self._get_box(self._pin_num)[1])
 
     @property
     def pin_bb_maxY(self):
-        return dotty(self.json)[f'predictions.0.detection_boxes.{self._pin_num}.2']
+        return float(self._get_box(self._pin_num)[2])
 
     @property
     def pin_bb_maxX(self):
-        return dotty(self.json)[f'predictions.0.detection_boxes.{self._pin_num}.3']
+        return float(self._get_box(self._pin_num)[3])
 
     @property
     def loop_top_classification(self):
-        return dotty(self.json)[
-            f'predictions.0.detection_classes_as_text.{self._loop_num}'
-        ]
+        return self.get_detection_class_as_text(self._loop_num)
 
     @property
     def pin_base_x(self):
-        return dotty(self.json)[f'predictions.0.detection_boxes.{self._pin_num}.3']
+        return float(self._get_box(self._pin_num)[3])
 
 
 class AutoMLMessageFactory(MessageFactory):
@@ -158,17 +452,419 @@ class AutoMLMessageFactory(MessageFactory):
         return ResponseMessage.parse_type_id(response)
 
 
+class AutoMLRequestWriter(MessageRequestWriter):
+    """Combines predict requests that are written together into multi-image requests.
+
+    The connection writes whatever is on its outgoing queue as a batch, see ConnectionWriteWorker, and this writer
+    turns the predict requests in the batch into requests of up to automl_max_batch_size images each, the server
+    predicts all the images of a request in one go. Set write_linger on the connection to wait for a batch to fill
+    up. The default batch size of 1 sends a request per image.
+
+    The request ids of the combined requests are sent in instance order, comma separated, in the DHS-Request-Id
+    header, AutoMLResponseReader uses them to split the response back up.
+    """
+
+    AUTOML_MAX_BATCH_SIZE = 'automl_max_batch_size'
+    AUTOML_MAX_BATCH_SIZE_DEFAULT = 1
+
+    def __init__(self, config: dict = {}):
+        super().__init__()
+        self._max_batch_size = int(
+            config.get(self.AUTOML_MAX_BATCH_SIZE, self.AUTOML_MAX_BATCH_SIZE_DEFAULT)
+        )
+
+    def write_requests(self, requests: list) -> list:
+        requests = super().write_requests(requests)
+        if self._max_batch_size < 2 or len(requests) < 2:
+            return requests
+
+        # Requests for the same model and params are combined, in order, everything else is passed on as it is.
+        written = []
+        batches = {}
+        for request in requests:
+            if not self._is_predict_request(request):
+                written.append(request)
+                continue
+            batch_key = (request.url, request.data.params_json)
+            batch = batches.get(batch_key)
+            if batch is None or len(batch) == self._max_batch_size:
+                batch = batches[batch_key] = []
+                written.append(batch)
+            batch.append(request)
+
+        return [self._combine(r) if isinstance(r, list) else r for r in written]
+
+    @staticmethod
+    def _is_predict_request(request: Request) -> bool:
+        return isinstance(request.data, AutoMLPredictBody)
+
+    @staticmethod
+    def _combine(batch: list) -> Request:
+        if len(batch) == 1:
+            return batch[0]
+
+        first = batch[0]
+        request = Request(
+            first.method,
+            first.url,
+            headers=dict(first.headers),
+            data=AutoMLPredictBody.combine([r.data for r in batch]),
+        )
+        request.headers[Headers.DHS_REQUEST_ID.value] = ','.join(
+            r.headers[Headers.DHS_REQUEST_ID.value]
+            for r in batch
+            for _ in r.data._instances
+        )
+        return request
+
+
+def _prediction_response(
+    prediction: dict, request, response: Response = None
+) -> Response:
+    """Returns a response to request with just the prediction, like the server's response to a one image request.
+
+    response is the server response the prediction was taken from, None if it didn't come from the server.
+    """
+
+    part = Response()
+    part.status_code = 200
+    if response is not None:
+        part.status_code = response.status_code
+        part.reason = response.reason
+        part.headers = response.headers
+        part.url = response.url
+        part.elapsed = response.elapsed
+    part.encoding = 'utf-8'
+    part.raw = io.BytesIO(json.dumps({'predictions': [prediction]}).encode())
+    part.request = request
+    return part
+
+
+def _prediction_error_response(
+    key: str, error: str, request, response: Response
+) -> Response:
+    """Returns a 502 response to request for an image the server's response has no prediction for.
+
+    The prediction has just the image key and the error, so handlers see a response without any detections.
+    """
+
+    part = _prediction_response({'key': key, 'error': error}, request, response)
+    part.status_code = 502
+    part.reason = 'Bad Gateway'
+    return part
+
+
+class AutoMLInferenceCache:
+    """LRU cache of predictions keyed by the image content, the model path and the prediction params.
+
+    The transport looks up every one image predict request when the connection writes it, before it is preprocessed
+    or sent. On a hit the cached prediction is handed back as the response to the request, with its request id and
+    image key, through the same response path as a response from the server, and nothing is sent. On a miss the
+    prediction in the response is cached once it arrives. This saves a round trip to the server for images that are
+    sent again, e.g. retries or identical frames from a camera while nothing moves.
+
+    automl_cache_size - The number of predictions to keep, the default of 0 disables the cache.
+    automl_cache_ttl - The seconds a prediction is kept for.
+
+    Images are hashed with SHA-256, hardware accelerated on most CPUs, by the thread that writes the request, so
+    message handlers never wait for it. Hits and misses are counted and reported in the automl_cache_hits and
+    automl_cache_misses metrics counters when metrics is set.
+    """
+
+    AUTOML_CACHE_SIZE = 'automl_cache_size'
+    AUTOML_CACHE_SIZE_DEFAULT = 0
+    AUTOML_CACHE_TTL = 'automl_cache_ttl'
+    AUTOML_CACHE_TTL_DEFAULT = 300.0
+
+    CACHE_HITS = 'automl_cache_hits'
+    CACHE_MISSES = 'automl_cache_misses'
+
+    # The most requests to remember the cache key of while waiting for their responses, requests that never get a
+    # response are forgotten.
+    _MAX_PENDING = 1024
+
+    def __init__(self, config: dict = {}):
+        self._max_size = int(
+            config.get(self.AUTOML_CACHE_SIZE, self.AUTOML_CACHE_SIZE_DEFAULT)
+        )
+        self._ttl = float(
+            config.get(self.AUTOML_CACHE_TTL, self.AUTOML_CACHE_TTL_DEFAULT)
+        )
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._pending = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        # The Metrics instance hits and misses are reported to, None when metrics are disabled.
+        self.metrics = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_size > 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+
+    def get(self, request: Request) -> Response:
+        """Returns the response to request if its prediction is cached, otherwise None and the response is cached by put.
+
+        request is a predict request as written by AutoMLPredictRequest, requests for more than one image and
+        anything else are never cached.
+        """
+
+        body = request.data
+        if not isinstance(body, AutoMLPredictBody) or len(body.instances) != 1:
+            return None
+
+        image_key, image = body.instances[0]
+        cache_key = (request.url, body.params_json, hashlib.sha256(image).digest())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] < now:
+                del self._entries[cache_key]
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                request_id = request.headers.get(Headers.DHS_REQUEST_ID.value)
+                if request_id:
+                    self._pending[int(request_id)] = cache_key
+                    if len(self._pending) > self._MAX_PENDING:
+                        self._pending.popitem(last=False)
+                return None
+
+            self._hits += 1
+            self._entries.move_to_end(cache_key)
+            prediction = entry[1]
+
+        return _prediction_response(
+            dict(prediction, key=image_key),
+            MessageRequestWriter().write_request(request),
+        )
+
+    def put(self, response: Response):
+        """Cache the prediction in the response to a one image request that missed the cache."""
+
+        request_id = response.request.headers.get(Headers.DHS_REQUEST_ID.value)
+        with self._lock:
+            cache_key = self._pending.pop(int(request_id), None) if request_id else None
+        if cache_key is None or not response.ok:
+            return
+
+        try:
+            prediction = parse_json(response)['predictions'][0]
+        except (ValueError, LookupError, TypeError):
+            _logger.debug(f'Not caching response without a prediction {response}')
+            return
+
+        with self._lock:
+            self._entries[cache_key] = (time.monotonic() + self._ttl, prediction)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def respond(self, requests: list, queue_response) -> list:
+        """Answer the requests that have a cached prediction, returns the requests that still have to be sent.
+
+        queue_response(response) is called with the response to each request that is answered from the cache and
+        must not block, it returns False if it can't take the response right now and the request is sent instead.
+        """
+
+        if not self.enabled:
+            return requests
+
+        unanswered = []
+        for request in requests:
+            response = self.get(request)
+            if self.metrics is not None:
+                self.metrics.increment(
+                    self.CACHE_MISSES if response is None else self.CACHE_HITS
+                )
+            if response is None:
+                unanswered.append(request)
+            elif not queue_response(response):
+                _logger.debug(
+                    f'No room for the cached response to {request.url}, sending the request'
+                )
+                unanswered.append(request)
+        return unanswered
+
+
+def _answer_and_preprocess(
+    requests: list,
+    cache: AutoMLInferenceCache,
+    preprocessor: AutoMLImagePreprocessor,
+    queue_response,
+) -> list:
+    """Answer the requests the cache has predictions for and start preprocessing the images of the rest.
+
+    Returns the requests that have to be sent, see AutoMLInferenceCache.respond for queue_response.
+    """
+
+    if cache is not None:
+        requests = cache.respond(requests, queue_response)
+    if preprocessor is not None:
+        for request in requests:
+            preprocessor.preprocess(request)
+    return requests
+
+
+class AutoMLResponseReader(MessageResponseReader):
+    """Splits the responses to requests combined by AutoMLRequestWriter into a response per image.
+
+    Each response looks like the response to a single image request, with the request id of the AutoMLPredictRequest
+    it answers and its prediction, which includes the image key. The predictions are added to the cache if there is
+    one.
+
+    Predictions are matched to the images that were sent by their key, not by their position in the response. Every
+    request gets a response: an image the server returned no prediction for, or a response that isn't the json of
+    the predictions, is answered with a 502 response whose prediction has the image key and an error, see
+    AutoMLPredictResponse.error.
+    """
+
+    def __init__(self, cache: AutoMLInferenceCache = None):
+        super().__init__()
+        self._cache = cache
+
+    def read_responses(self, response: Response) -> list:
+        request_ids = response.request.headers.get(Headers.DHS_REQUEST_ID.value, '')
+        if ',' not in request_ids:
+            parts = super().read_responses(response)
+        else:
+            parts = self._split_responses(response, request_ids.split(','))
+
+        if self._cache is not None and self._cache.enabled:
+            for part in parts:
+                self._cache.put(part)
+        return parts
+
+    def _split_responses(self, response: Response, request_ids: list) -> list:
+        keys = [key for key, _ in response.request.body._instances]
+        try:
+            predictions = parse_json(response).get('predictions')
+        except (ValueError, AttributeError):
+            predictions = None
+        error = 'The response has no prediction for the image'
+        if not isinstance(predictions, list):
+            error = 'The response has no predictions'
+            _logger.warning(f'{error} for a request of {len(keys)} images')
+            predictions = None
+
+        # The same image key may have been sent more than once, its predictions are taken in order.
+        by_key = {}
+        for prediction in predictions or ():
+            if isinstance(prediction, dict):
+                by_key.setdefault(prediction.get('key'), deque()).append(prediction)
+
+        parts = []
+        missing = 0
+        for request_id, key in zip(request_ids, keys):
+            request = response.request.copy()
+            request.headers[Headers.DHS_REQUEST_ID.value] = request_id
+            key_predictions = by_key.get(key)
+            if key_predictions:
+                part = _prediction_response(key_predictions.popleft(), request, response)
+            else:
+                part = _prediction_error_response(key, error, request, response)
+                missing += 1
+            parts.append(self.read_response(part))
+
+        if missing and predictions is not None:
+            _logger.warning(
+                f'Got {len(predictions)} predictions for a request of {len(keys)} images, {missing} images have none'
+            )
+        return parts
+
+
 class AutoMLClientTransport(HttpClientTransport):
-    """Overrides HttpClientTransport and handles message reading and writing"""
+    """Overrides HttpClientTransport and handles message reading and writing
+
+    Requests the cache has a prediction for are answered on the response queue instead of being sent, the images of
+    the rest are preprocessed, both on the thread that writes the requests.
+    """
+
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        config: dict = {},
+        cache: AutoMLInferenceCache = None,
+        preprocessor: AutoMLImagePreprocessor = None,
+    ):
+        super().__init__(
+            connection_name,
+            url,
+            AutoMLResponseReader(cache),
+            AutoMLRequestWriter(config),
+            config,
+        )
+        self._cache = cache
+        self._preprocessor = preprocessor
+
+    def _queue_cached_response(self, response: Response) -> bool:
+        # The read worker drains the response queue, don't wait for it to make room.
+        try:
+            self._response_queue.queue(response, 0)
+        except (TimeoutError, QueueFullError):
+            return False
+        return True
+
+    def send_many(self, msgs: list):
+        msgs = _answer_and_preprocess(
+            msgs, self._cache, self._preprocessor, self._queue_cached_response
+        )
+        if msgs:
+            super().send_many(msgs)
+
+
+class AsyncAutoMLClientTransport(AsyncHttpClientTransport):
+    """Overrides AsyncHttpClientTransport, answers requests from the cache and preprocesses images like
+    AutoMLClientTransport"""
 
-    def __init__(self, connection_name: str, url: str, config: dict = {}):
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        loop: asyncio.AbstractEventLoop,
+        config: dict = {},
+        cache: AutoMLInferenceCache = None,
+        preprocessor: AutoMLImagePreprocessor = None,
+    ):
         super().__init__(
             connection_name,
             url,
-            MessageResponseReader(),
-            MessageRequestWriter(),
+            AutoMLResponseReader(cache),
+            AutoMLRequestWriter(config),
+            loop,
             config,
         )
+        self._cache = cache
+        self._preprocessor = preprocessor
+
+    def _queue_cached_response(self, response: Response) -> bool:
+        self._received(response)
+        return True
+
+    def send_many(self, msgs: list):
+        msgs = _answer_and_preprocess(
+            msgs, self._cache, self._preprocessor, self._queue_cached_response
+        )
+        if msgs:
+            super().send_many(msgs)
 
 
 @register_connection('automl')
@@ -183,12 +879,63 @@ class AutoMLClientConnection(ConnectionBase):
         outgoing_message_queue: OutgoingMessageQueue,
         config: dict = {},
     ):
+        self._cache = AutoMLInferenceCache(config)
+        self._cache.metrics = incoming_message_queue.metrics
+        self._preprocessor = AutoMLImagePreprocessor(connection_name, config)
         super().__init__(
             connection_name,
             url,
-            AutoMLClientTransport(connection_name, url, config),
+            AutoMLClientTransport(
+                connection_name, url, config, self._cache, self._preprocessor
+            ),
             incoming_message_queue,
             outgoing_message_queue,
             AutoMLMessageFactory(),
             config,
         )
+
+    @property
+    def cache(self) -> AutoMLInferenceCache:
+        return self._cache
+
+    def shutdown(self):
+        super().shutdown()
+        self._preprocessor.shutdown()
+
+
+@register_connection('automl', ExecutionMode.ASYNCIO)
+class AsyncAutoMLClientConnection(AsyncConnectionBase):
+    """Overrides AsyncConnectionBase and creates a GCP AutoML connection on the DHS event loop"""
+
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        incoming_message_queue: IncomingMessageQueue,
+        outgoing_message_queue: OutgoingMessageQueue,
+        loop: asyncio.AbstractEventLoop,
+        config: dict = {},
+    ):
+        self._cache = AutoMLInferenceCache(config)
+        self._cache.metrics = incoming_message_queue.metrics
+        self._preprocessor = AutoMLImagePreprocessor(connection_name, config)
+        super().__init__(
+            connection_name,
+            url,
+            AsyncAutoMLClientTransport(
+                connection_name, url, loop, config, self._cache, self._preprocessor
+            ),
+            incoming_message_queue,
+            outgoing_message_queue,
+            AutoMLMessageFactory(),
+            loop,
+            config,
+        )
+
+    @property
+    def cache(self) -> AutoMLInferenceCache:
+        return self._cache
+
+    def shutdown(self):
+        super().shutdown()
+        self._preprocessor.shutdown()
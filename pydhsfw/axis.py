@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
 from typing import Any
 from pydhsfw.messages import (
@@ -7,8 +8,14 @@ from pydhsfw.messages import (
     MessageFactory,
     register_message,
 )
-from pydhsfw.connection import ConnectionBase, register_connection
+from pydhsfw.connection import (
+    AsyncConnectionBase,
+    ConnectionBase,
+    ExecutionMode,
+    register_connection,
+)
 from pydhsfw.http import (
+    AsyncHttpClientTransport,
     HttpClientTransport,
     MessageResponseReader,
     MessageRequestWriter,
@@ -74,3 +81,35 @@ class AxisClientConnection(ConnectionBase):
             AxisMessageFactory(),
             config,
         )
+
+
+@register_connection('axis', ExecutionMode.ASYNCIO)
+class AsyncAxisClientConnection(AsyncConnectionBase):
+    """Overrides AsyncConnectionBase and creates an HTTP Axis connection on the DHS event loop"""
+
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        incoming_message_queue: IncomingMessageQueue,
+        outgoing_message_queue: OutgoingMessageQueue,
+        loop: asyncio.AbstractEventLoop,
+        config: dict = {},
+    ):
+        super().__init__(
+            connection_name,
+            url,
+            AsyncHttpClientTransport(
+                connection_name,
+                url,
+                MessageResponseReader(),
+                MessageRequestWriter(),
+                loop,
+                config,
+            ),
+            incoming_message_queue,
+            outgoing_message_queue,
+            AxisMessageFactory(),
+            loop,
+            config,
+        )
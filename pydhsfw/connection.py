@@ -1,20 +1,28 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import time
+from collections import deque
 import verboselogs
-from pydhsfw.threads import AbortableThread
+from enum import Enum
+from pydhsfw.threads import AbortableThread, call_soon, running_on
 from pydhsfw.messages import (
     IncomingMessageQueue,
     OutgoingMessageQueue,
     MessageIn,
     MessageOut,
     MessageFactory,
+    register_message,
 )
-from pydhsfw.transport import Transport
+from pydhsfw.metrics import stamp_message
+from pydhsfw.transport import Transport, AsyncTransport, TransportState
 
 # _logger = logging.getLogger(__name__)
 _logger = verboselogs.VerboseLogger(__name__)
 
 
 class ConnectionMessage(MessageIn):
+    """Connection state messages, msg is the name of the connection."""
+
     def __init__(self, msg):
         super().__init__()
         self._msg = msg
@@ -22,17 +30,24 @@ class ConnectionMessage(MessageIn):
     def get_msg(self):
         return self._msg
 
+    @property
+    def connection_name(self):
+        return self._msg
+
 
+@register_message('connection_connected')
 class ConnectionConnectedMessage(ConnectionMessage):
     def __init__(self, msg):
         super().__init__(msg)
 
 
+@register_message('connection_disconnected')
 class ConnectionDisconnectedMessage(ConnectionMessage):
     def __init__(self, msg):
         super().__init__(msg)
 
 
+@register_message('connection_shutdown')
 class ConnectionShutdownMessage(ConnectionMessage):
     def __init__(self, msg):
         super().__init__(msg)
@@ -55,6 +70,26 @@ class Connection:
     def disconnect(self):
         pass
 
+    def _queue_state_messages(
+        self, transport: Transport, incoming_message_queue: IncomingMessageQueue
+    ):
+        """Queue a ConnectionConnectedMessage or ConnectionDisconnectedMessage when the transport connects or drops."""
+
+        def on_state_changed(old_state: TransportState, new_state: TransportState):
+            if new_state == TransportState.CONNECTED:
+                incoming_message_queue.queue(
+                    ConnectionConnectedMessage(self._connection_name)
+                )
+            elif new_state == TransportState.DISCONNECTED and old_state in (
+                TransportState.CONNECTED,
+                TransportState.DISCONNECTING,
+            ):
+                incoming_message_queue.queue(
+                    ConnectionDisconnectedMessage(self._connection_name)
+                )
+
+        transport.subscribe(on_state_changed)
+
     def send(self, msg: MessageOut):
         """
         DO docstrings show stuff in MS VSCODE When I hover over the command?
@@ -68,28 +103,67 @@ class Connection:
         pass
 
 
+class ExecutionMode(Enum):
+    """How the DHS runs its connections and message dispatcher.
+
+    THREADED - Each connection runs its own read, write and transport worker threads.
+    ASYNCIO - Connections and the dispatcher share a single asyncio event loop.
+    """
+
+    THREADED = 'threaded'
+    ASYNCIO = 'asyncio'
+
+
 class ConnectionRegistry:
 
     _registry = {}
 
     @classmethod
-    def _register_connection(cls, connection_scheme: str, connection_cls: Connection):
-        cls._registry[connection_scheme] = connection_cls
+    def _register_connection(
+        cls,
+        connection_scheme: str,
+        connection_cls: Connection,
+        execution_mode: ExecutionMode = ExecutionMode.THREADED,
+    ):
+        if cls._registry.get(execution_mode) is None:
+            cls._registry[execution_mode] = dict()
+
+        cls._registry[execution_mode][connection_scheme] = connection_cls
 
     @classmethod
-    def _get_connection_class(cls, connection_scheme: str):
-        return cls._registry.get(connection_scheme, None)
+    def _get_connection_class(
+        cls,
+        connection_scheme: str,
+        execution_mode: ExecutionMode = ExecutionMode.THREADED,
+    ):
+        return cls._registry.get(execution_mode, {}).get(connection_scheme, None)
 
     @classmethod
-    def _get_connection_classes(cls):
-        return cls._registry
+    def _get_connection_classes(
+        cls, execution_mode: ExecutionMode = ExecutionMode.THREADED
+    ):
+        return cls._registry.get(execution_mode, {})
+
 
+def register_connection(
+    connection_scheme: str, execution_mode: ExecutionMode = ExecutionMode.THREADED
+):
+    """Registers a Connection class for a url scheme.
+
+    connection_scheme - The scheme that is used to create connections of this class.
+
+    execution_mode - The ExecutionMode the connection class is implemented for. Connection classes registered for
+    ExecutionMode.ASYNCIO take an additional loop argument ahead of config. When a DHS runs in the asyncio mode and
+    a scheme has no asyncio connection class, the threaded class is used instead.
+
+    """
 
-def register_connection(connection_scheme: str):
     def decorator_register_connection(cls):
         cls._scheme = connection_scheme
         if connection_scheme and issubclass(cls, Connection):
-            ConnectionRegistry._register_connection(connection_scheme, cls)
+            ConnectionRegistry._register_connection(
+                connection_scheme, cls, execution_mode
+            )
 
         return cls
 
@@ -121,11 +195,18 @@ class ConnectionReadWorker(AbortableThread):
         try:
             while True:
                 try:
-                    # Blocking call with timeout configured elsewhere. This will timeout to check for control messages, specifically SystemExit.
+                    metrics = self._msg_queue.metrics
+                    if metrics is not None:
+                        read_start = time.perf_counter()
+                    # Blocks until a message arrives, aborting the thread wakes the transport up with ThreadStopped.
                     raw_msg = self._transport.receive()
                     if raw_msg:
                         _logger.debug(f'Received unpacked raw message, {raw_msg}')
+                        if metrics is not None:
+                            read_end = time.perf_counter()
                         msg = self._msg_factory.create_message(raw_msg)
+                        if metrics is not None:
+                            metrics.message_received(msg, read_start, read_end)
                         if msg:
                             _logger.debug(f'Received factory created message: {msg}')
                             self._msg_queue.queue(msg)
@@ -146,6 +227,19 @@ class ConnectionReadWorker(AbortableThread):
 
 
 class ConnectionWriteWorker(AbortableThread):
+    """Writes messages from the outgoing queue to the transport.
+
+    Whatever is queued is written as a batch of up to write_batch_size messages with a single Transport.send_many
+    call, which stream transports turn into one gathered socket write. With write_linger set, the worker waits up to
+    that many seconds for a batch to fill up before writing it, trading latency for fewer writes. The default of 0
+    never delays a message.
+    """
+
+    WRITE_BATCH_SIZE = 'write_batch_size'
+    WRITE_BATCH_SIZE_DEFAULT = 64
+    WRITE_LINGER = 'write_linger'
+    WRITE_LINGER_DEFAULT = 0.0
+
     def __init__(
         self,
         connection_name: str,
@@ -159,6 +253,27 @@ class ConnectionWriteWorker(AbortableThread):
         self._connection_name = connection_name
         self._transport = transport
         self._msg_queue = outgoing_message_queue
+        self._batch_size = int(
+            config.get(self.WRITE_BATCH_SIZE, self.WRITE_BATCH_SIZE_DEFAULT)
+        )
+        self._linger = float(config.get(self.WRITE_LINGER, self.WRITE_LINGER_DEFAULT))
+
+    def _fetch_batch(self) -> list:
+        # Blocks until a message is queued, aborting the thread wakes the fetch up with ThreadStopped.
+        msgs = self._msg_queue.fetch_many(self._batch_size)
+        if self._linger > 0:
+            end_time = time.monotonic() + self._linger
+            while len(msgs) < self._batch_size:
+                remaining = end_time - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    msgs += self._msg_queue.fetch_many(
+                        self._batch_size - len(msgs), remaining
+                    )
+                except TimeoutError:
+                    break
+        return msgs
 
     def run(self):
 
@@ -167,13 +282,28 @@ class ConnectionWriteWorker(AbortableThread):
         try:
             while True:
                 try:
-                    # Blocking call with timeout configured elsewhere. This will timeout to check for control messages, specifically SystemExit.
-                    msg = self._msg_queue.fetch(self._get_blocking_timeout())
-                    if msg:
-                        _logger.spam(f'Sending message: {msg}')
+                    msgs = self._fetch_batch()
+                    metrics = self._msg_queue.metrics
+                    if metrics is not None:
+                        fetch_time = time.perf_counter()
+                    spam = _logger.isEnabledFor(verboselogs.SPAM)
+                    buffers = []
+                    for msg in msgs:
+                        if spam:
+                            _logger.spam(f'Sending message: {msg}')
                         buffer = msg.write()
-                        _logger.spam(f'Sending unpacked raw message: {buffer}')
-                        self._transport.send(buffer)
+                        if spam:
+                            _logger.spam(f'Sending unpacked raw message: {buffer}')
+                        if buffer is not None:
+                            buffers.append(buffer)
+
+                    if len(buffers) == 1:
+                        self._transport.send(buffers[0])
+                    elif buffers:
+                        self._transport.send_many(buffers)
+
+                    if metrics is not None:
+                        metrics.messages_sent(msgs, fetch_time)
 
                 except TimeoutError:
                     # Socket read timed out. This is normal, it just means that no messages have been sent so we can ignore it.
@@ -201,8 +331,9 @@ class ConnectionBase(Connection):
         message_factory: MessageFactory,
         config: dict = {},
     ):
-        super().__init__(url, config)
+        super().__init__(connection_name, url, config)
         self._transport = transport
+        self._queue_state_messages(transport, incoming_message_queue)
         self._read_worker = ConnectionReadWorker(
             connection_name, transport, incoming_message_queue, message_factory, config
         )
@@ -221,6 +352,8 @@ class ConnectionBase(Connection):
         self._transport.disconnect()
 
     def send(self, msg: MessageOut):
+        if self._outgoing_message_queue.metrics is not None:
+            stamp_message(msg)
         self._outgoing_message_queue.queue(msg)
 
     def shutdown(self):
@@ -232,3 +365,199 @@ class ConnectionBase(Connection):
         self._read_worker.join()
         self._write_worker.join()
         self._transport.wait()
+
+
+class AsyncConnectionBase(Connection):
+    """Connection base for the asyncio execution mode.
+
+    Raw messages pushed by the AsyncTransport are turned into messages and queued on the incoming queue directly from
+    the event loop. Outgoing messages still go through the outgoing queue so any queue specific handling is kept, but
+    the queue is drained by a callback on the loop instead of a write worker thread. Like the write worker, it writes
+    batches of up to write_batch_size messages and, with write_linger set, waits up to that many seconds for a batch
+    to fill up.
+
+    Both queues are drained on the loop, so nothing on the loop waits for room in a full queue. When the incoming
+    queue is full the transport's reading is paused until the dispatcher makes room, a bounded incoming queue must be
+    an AsyncIncomingMessageQueue. When the outgoing queue is full a send() on the loop writes out the queued messages
+    straight away, sends from other threads wait for room as usual.
+    """
+
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        transport: AsyncTransport,
+        incoming_message_queue: IncomingMessageQueue,
+        outgoing_message_queue: OutgoingMessageQueue,
+        message_factory: MessageFactory,
+        loop: asyncio.AbstractEventLoop,
+        config: dict = {},
+    ):
+        super().__init__(connection_name, url, config)
+        self._transport = transport
+        self._incoming_message_queue = incoming_message_queue
+        self._outgoing_message_queue = outgoing_message_queue
+        self._msg_factory = message_factory
+        self._loop = loop
+        self._flush_pending = False
+        # Timer that flushes messages the queue holds back once they are ready, kept apart from _flush_pending so
+        # messages that aren't held back are never kept waiting for it.
+        self._held_timer = None
+        self._held_ready_time = None
+        # Messages received while the incoming queue is full, reading is paused until they are queued.
+        self._pending_msgs = deque()
+        self._flush_batch_size = int(
+            config.get(
+                ConnectionWriteWorker.WRITE_BATCH_SIZE,
+                ConnectionWriteWorker.WRITE_BATCH_SIZE_DEFAULT,
+            )
+        )
+        self._linger = float(
+            config.get(
+                ConnectionWriteWorker.WRITE_LINGER,
+                ConnectionWriteWorker.WRITE_LINGER_DEFAULT,
+            )
+        )
+        self._queue_state_messages(transport, incoming_message_queue)
+        self._transport.set_receive_callback(self._receive)
+        self._transport.start()
+
+    def _receive(self, raw_msg):
+        try:
+            _logger.debug(f'Received unpacked raw message, {raw_msg}')
+            metrics = self._incoming_message_queue.metrics
+            if metrics is not None:
+                read_end = time.perf_counter()
+            msg = self._msg_factory.create_message(raw_msg)
+            if metrics is not None:
+                metrics.message_received(msg, None, read_end)
+            if msg:
+                _logger.debug(f'Received factory created message: {msg}')
+                if self._pending_msgs:
+                    # Keep the order behind the messages that are waiting for room.
+                    self._pending_msgs.append(msg)
+                else:
+                    self._queue_incoming(msg)
+        except Exception:
+            _logger.exception(None)
+
+    def _queue_incoming(self, msg: MessageIn):
+        try:
+            self._incoming_message_queue.queue(msg, 0)
+        except TimeoutError:
+            # Full, the dispatcher makes room on this loop so waiting here would block it for good.
+            self._pending_msgs.append(msg)
+            self._transport.pause_reading()
+            self._loop.create_task(self._queue_pending())
+
+    async def _queue_pending(self):
+        queue = self._incoming_message_queue
+        while self._pending_msgs:
+            await queue.wait_not_full_async()
+            try:
+                queue.queue(self._pending_msgs[0], 0)
+            except TimeoutError:
+                continue
+            except Exception:
+                _logger.exception(None)
+            self._pending_msgs.popleft()
+        self._transport.resume_reading()
+
+    def _flush(self, lingered: bool = False):
+        if (
+            self._linger > 0
+            and not lingered
+            and self._outgoing_message_queue.qsize() < self._flush_batch_size
+        ):
+            # Give the batch time to fill up, the flag stays set so sends in the meantime don't schedule flushes.
+            self._loop.call_later(self._linger, self._flush, True)
+            return
+
+        # Clear the flag first, anything queued after this point schedules another flush.
+        self._flush_pending = False
+        while True:
+            try:
+                msgs = self._outgoing_message_queue.fetch_many(
+                    self._flush_batch_size, 0
+                )
+            except TimeoutError:
+                break
+
+            metrics = self._outgoing_message_queue.metrics
+            if metrics is not None:
+                fetch_time = time.perf_counter()
+            spam = _logger.isEnabledFor(verboselogs.SPAM)
+            buffers = []
+            for msg in msgs:
+                try:
+                    if spam:
+                        _logger.spam(f'Sending message: {msg}')
+                    buffer = msg.write()
+                    if spam:
+                        _logger.spam(f'Sending unpacked raw message: {buffer}')
+                    if buffer is not None:
+                        buffers.append(buffer)
+                except Exception:
+                    _logger.exception(None)
+
+            try:
+                if len(buffers) == 1:
+                    self._transport.send(buffers[0])
+                elif buffers:
+                    self._transport.send_many(buffers)
+            except Exception:
+                _logger.exception(None)
+
+            if metrics is not None:
+                metrics.messages_sent(msgs, fetch_time)
+
+        # Messages held back by the queue are not fetched above, poll again once they are ready.
+        ready_time = self._outgoing_message_queue.next_ready_time()
+        if ready_time is not None and (
+            self._held_timer is None or ready_time < self._held_ready_time
+        ):
+            if self._held_timer is not None:
+                self._held_timer.cancel()
+            self._held_ready_time = ready_time
+            self._held_timer = self._loop.call_later(
+                max(0.0, ready_time - time.monotonic()), self._flush_held
+            )
+
+    def _flush_held(self):
+        self._held_timer = None
+        self._held_ready_time = None
+        self._flush(True)
+
+    def connect(self):
+        self._transport.connect()
+
+    def disconnect(self):
+        self._transport.disconnect()
+
+    def send(self, msg: MessageOut):
+        if self._outgoing_message_queue.metrics is not None:
+            stamp_message(msg)
+        if running_on(self._loop):
+            try:
+                self._outgoing_message_queue.queue(msg, 0)
+            except TimeoutError:
+                # Full, the queue is drained on this loop so write out what is queued to make room.
+                self._flush(True)
+                self._outgoing_message_queue.queue(msg, 0)
+        else:
+            self._outgoing_message_queue.queue(msg)
+        if not self._flush_pending:
+            self._flush_pending = True
+            call_soon(self._loop, self._flush)
+        elif (
+            self._linger > 0
+            and self._outgoing_message_queue.qsize() == self._flush_batch_size
+        ):
+            # A full batch doesn't wait for the rest of the linger time.
+            call_soon(self._loop, self._flush, True)
+
+    def shutdown(self):
+        self._transport.shutdown()
+
+    def wait(self):
+        self._transport.wait()
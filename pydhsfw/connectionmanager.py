@@ -1,19 +1,21 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
 from inspect import getmodule, getsourcelines
 from pydhsfw.messages import OutgoingMessageQueue, IncomingMessageQueue
-from pydhsfw.connection import Connection, ConnectionRegistry
+from pydhsfw.connection import Connection, ConnectionRegistry, ExecutionMode
 
 _logger = logging.getLogger(__name__)
 
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
         self._connections = {}
         self._connection_factory = None
+        self._loop = loop
 
     def load_registry(self):
-        self._connection_factory = ConnectionFactory()
+        self._connection_factory = ConnectionFactory(self._loop)
 
     def create_connection(
         self,
@@ -66,15 +68,26 @@ class ConnectionManager:
 
 
 class ConnectionFactory:
-    def __init__(self):
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self._loop = loop
         self._registry = ConnectionRegistry._get_connection_classes()
-        for scheme, conn_cls in self._registry.items():
-            lineno = getsourcelines(conn_cls)[1]
-            module = getmodule(conn_cls)
-            _logger.info(
-                f'Registered connection class: {scheme}, {module.__name__}:{conn_cls.__name__}():{lineno} with connection registry'
+        self._async_registry = {}
+        if loop is not None:
+            self._async_registry = ConnectionRegistry._get_connection_classes(
+                ExecutionMode.ASYNCIO
             )
 
+        for registry, mode in (
+            (self._registry, ExecutionMode.THREADED),
+            (self._async_registry, ExecutionMode.ASYNCIO),
+        ):
+            for scheme, conn_cls in registry.items():
+                lineno = getsourcelines(conn_cls)[1]
+                module = getmodule(conn_cls)
+                _logger.info(
+                    f'Registered connection class: {scheme}, {module.__name__}:{conn_cls.__name__}():{lineno} with {mode.value} connection registry'
+                )
+
     def create_connection(
         self,
         connection_name: str,
@@ -86,14 +99,27 @@ class ConnectionFactory:
     ) -> Connection:
 
         connection = None
-        conn_cls = self._registry.get(scheme)
+
+        # Prefer the event loop implementation when running on an event loop, otherwise fall back to the threaded one.
+        conn_cls = self._async_registry.get(scheme)
         if conn_cls:
             connection = conn_cls(
                 connection_name,
                 url,
                 incoming_message_queue,
                 outgoing_message_queue,
+                self._loop,
                 config,
             )
+        else:
+            conn_cls = self._registry.get(scheme)
+            if conn_cls:
+                connection = conn_cls(
+                    connection_name,
+                    url,
+                    incoming_message_queue,
+                    outgoing_message_queue,
+                    config,
+                )
 
         return connection
@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
+import threading
+import time
 from typing import Any
-from inspect import isfunction, signature, getsourcelines, getmodule
 from pydhsfw.messages import (
     IncomingMessageQueue,
     OutgoingMessageQueue,
     MessageIn,
     MessageOut,
+    MessageCodec,
     MessageFactory,
+    QueueFullPolicy,
     register_message,
 )
 from pydhsfw.transport import (
@@ -16,24 +20,81 @@ from pydhsfw.transport import (
     StreamReader,
     StreamWriter,
 )
-from pydhsfw.connection import ConnectionBase, register_connection
-from pydhsfw.tcpip import TcpipClientTransport
-from pydhsfw.processors import Context, MessageQueueDispatcher
+from pydhsfw.connection import (
+    AsyncConnectionBase,
+    ConnectionBase,
+    ExecutionMode,
+    register_connection,
+)
+from pydhsfw.tcpip import AsyncTcpipClientTransport, TcpipClientTransport
+from pydhsfw.metrics import Metrics
+from pydhsfw.threads import wait_for
+from pydhsfw.processors import (
+    Context,
+    MessageQueueDispatcher,
+    _check_handler_signature,
+    _describe_handler,
+)
 
 _logger = logging.getLogger(__name__)
 
 # --------------------------------------------------------------------------
 # DCSS Message Base Classes
+def dcss_bool(value: str) -> bool:
+    """Convert a DCSS 0/1 flag argument to a bool."""
+    return value != '0'
+
+
+class DcssArg:
+    """Declares a typed DCSS message argument.
+
+    The message schema is declared once in the class body as one DcssArg per argument, with the index of the
+    argument (not counting the command) and the type it is converted to, e.g.::
+
+        motor_position = DcssArg(1, float, 'The scaled position of the motor.')
+
+    The argument is converted the first time it is read and the converted value is cached on the message. With
+    rest=True the argument and all the ones following it are returned as a tuple.
+    """
+
+    def __init__(self, index: int, type=str, doc: str = None, rest: bool = False):
+        self._index = index + 1
+        self._type = type
+        self._rest = rest
+        self._name = None
+        self.__doc__ = doc
+
+    def __set_name__(self, owner, name):
+        self._name = name
+
+    def __get__(self, msg, owner=None):
+        if msg is None:
+            return self
+
+        if self._rest:
+            value = msg._split_msg[self._index :]
+            if self._type is not str:
+                value = tuple(map(self._type, value))
+        else:
+            value = msg._split_msg[self._index]
+            if self._type is not str:
+                value = self._type(value)
+
+        # Only __get__ is defined so the instance attribute takes precedence from now on.
+        msg.__dict__[self._name] = value
+        return value
+
+
 class DcssMessageIn:
-    def __init__(self, split):
+    def __init__(self, split: tuple):
         self._split_msg = split
 
     def __str__(self):
         return ' '.join(self._split_msg)
 
     @staticmethod
-    def _split(buffer: bytes):
-        return buffer.decode('ascii').rstrip('\n\r\x00').split(' ')
+    def _split(buffer: bytes) -> tuple:
+        return tuple(buffer.decode('ascii').rstrip('\n\r\x00').split(' '))
 
     @staticmethod
     def parse_type_id(buffer: bytes):
@@ -51,7 +112,7 @@ class DcssMessageIn:
 
 
 class DcssStoCMessage(MessageIn, DcssMessageIn):
-    def __init__(self, split):
+    def __init__(self, split: tuple):
         DcssMessageIn.__init__(self, split)
 
     def __str__(self):
@@ -69,19 +130,80 @@ class DcssStoCMessage(MessageIn, DcssMessageIn):
         return msg
 
 
+def _format_arg(value, float_precision: int) -> str:
+    """Format an outgoing DCSS message argument, floats with float_precision significant digits."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return '%.*g' % (float_precision, value)
+    return str(value)
+
+
+class DcssPackedMessage(bytearray):
+    """An outgoing DCS message packed as a DCS version 2 message.
+
+    The 26 byte version 2 header is reserved at the front of the buffer while the text is written and backfilled
+    once the text length is known, so a message is serialized into a single buffer that can be sent as is. The text
+    is terminated with ' \\0' as DCSS expects.
+    """
+
+    __slots__ = ()
+
+    HEADER_SIZE = 26
+    TERMINATOR = b' \x00'
+
+    def __init__(self):
+        super().__init__(self.HEADER_SIZE)
+
+    def finish(self):
+        """Terminate the text and backfill the header."""
+        self += self.TERMINATOR
+        self[: self.HEADER_SIZE] = b'%12d%13d ' % (len(self) - self.HEADER_SIZE, 0)
+        return self
+
+    @classmethod
+    def from_text(cls, text: bytes):
+        packed = cls()
+        packed += text
+        return packed.finish()
+
+    @property
+    def text(self) -> memoryview:
+        """The message text without the header and terminator."""
+        return memoryview(self)[self.HEADER_SIZE : -len(self.TERMINATOR)]
+
+
 class DcssMessageOut(MessageOut):
+    """An outgoing DCSS message, _split_msg holds the command and its arguments.
+
+    Arguments are formatted as they are written, bools as 0/1 flags and floats with float_precision significant
+    digits, e.g. 0.1 + 0.2 is sent as 0.3. Set float_precision on a message class, or on DcssMessageOut for every
+    message, to change it.
+    """
+
+    float_precision = 10
+
     def __init__(self):
         super().__init__()
         self._split_msg = None
 
     def __str__(self):
-        return ' '.join(self._split_msg)
+        precision = self.float_precision
+        return ' '.join(_format_arg(arg, precision) for arg in self._split_msg)
 
-    def write(self) -> bytes:
+    def write(self) -> DcssPackedMessage:
         buffer = None
 
         if self._split_msg:
-            buffer = ' '.join(self._split_msg).encode('ascii')
+            precision = self.float_precision
+            buffer = DcssPackedMessage()
+            for i, arg in enumerate(self._split_msg):
+                if i:
+                    buffer += b' '
+                buffer += _format_arg(arg, precision).encode('ascii')
+            buffer.finish()
 
         return buffer
 
@@ -125,15 +247,12 @@ class DcssStoHRegisterOperation(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def operation_name(self):
-        """The name of the operation as it is known in the DCSS database."""
-        return self.args[0]
-
-    @property
-    def operation_hardwareName(self):
-        """The name of the operation as it is known in the DHS code."""
-        return self.args[1]
+    operation_name = DcssArg(
+        0, str, 'The name of the operation as it is known in the DCSS database.'
+    )
+    operation_hardwareName = DcssArg(
+        1, str, 'The name of the operation as it is known in the DHS code.'
+    )
 
 
 @register_message('stoh_register_real_motor', 'dcss')
@@ -146,15 +265,12 @@ class DcssStoHRegisterRealMotor(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def motor_name(self):
-        """The name of the motor as it is known in the DCSS database."""
-        return self.args[0]
-
-    @property
-    def motor_hardwareName(self):
-        """The name of the motor as it is known in the DHS code."""
-        return self.args[1]
+    motor_name = DcssArg(
+        0, str, 'The name of the motor as it is known in the DCSS database.'
+    )
+    motor_hardwareName = DcssArg(
+        1, str, 'The name of the motor as it is known in the DHS code.'
+    )
 
 
 @register_message('stoh_register_pseudo_motor', 'dcss')
@@ -167,13 +283,12 @@ class DcssStoHRegisterPseudoMotor(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    def get_pseudo_motor_name(self):
-        """The name of the motor as it is known in the DCSS database."""
-        return self.args[0]
-
-    def get_pseudo_motor_hardwareName(self):
-        """The name of the motor as it is known in the DHS code."""
-        return self.args[1]
+    pseudo_motor_name = DcssArg(
+        0, str, 'The name of the motor as it is known in the DCSS database.'
+    )
+    pseudo_motor_hardwareName = DcssArg(
+        1, str, 'The name of the motor as it is known in the DHS code.'
+    )
 
 
 @register_message('stoh_register_string', 'dcss')
@@ -186,15 +301,12 @@ class DcssStoHRegisterString(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def string_name(self):
-        """The name of the motor as it is known in the DCSS database."""
-        return self.args[0]
-
-    @property
-    def string_hardwareName(self):
-        """The name of the motor as it is known in the DHS code."""
-        return self.args[1]
+    string_name = DcssArg(
+        0, str, 'The name of the motor as it is known in the DCSS database.'
+    )
+    string_hardwareName = DcssArg(
+        1, str, 'The name of the motor as it is known in the DHS code.'
+    )
 
 
 @register_message('stoh_register_shutter', 'dcss')
@@ -207,20 +319,15 @@ class DcssStoHRegisterShutter(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def shutter_name(self):
-        """The name of the shutter as it is known in the DCSS database."""
-        return self.args[0]
-
-    @property
-    def shutter_status(self):
-        """The state of the shutter (desired state or actual state?)."""
-        return self.args[1]
-
-    @property
-    def shutter_hardwareName(self):
-        """The name of the shutter as it is known in the DHS code."""
-        return self.args[2]
+    shutter_name = DcssArg(
+        0, str, 'The name of the shutter as it is known in the DCSS database.'
+    )
+    shutter_status = DcssArg(
+        1, str, 'The state of the shutter (desired state or actual state?).'
+    )
+    shutter_hardwareName = DcssArg(
+        2, str, 'The name of the shutter as it is known in the DHS code.'
+    )
 
 
 @register_message('stoh_register_ion_chamber', 'dcss')
@@ -233,30 +340,15 @@ class DcssStoHRegisterIonChamber(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def ion_chamber_name(self):
-        """The name of the ion chamber as it is known in the DCSS database.."""
-        return self.args[0]
-
-    @property
-    def ion_chamber_hardwareName(self):
-        """The name of the ion chamber as it is known in the DHS code."""
-        return self.args[1]
-
-    @property
-    def ion_chamber_counterChannel(self):
-        """Ion chamber counter channel."""
-        return self.args[2]
-
-    @property
-    def ion_chamber_timer(self):
-        """Ion chamber timer."""
-        return self.args[3]
-
-    @property
-    def ion_chamber_timerType(self):
-        """Ion chamber timer type."""
-        return self.args[4]
+    ion_chamber_name = DcssArg(
+        0, str, 'The name of the ion chamber as it is known in the DCSS database..'
+    )
+    ion_chamber_hardwareName = DcssArg(
+        1, str, 'The name of the ion chamber as it is known in the DHS code.'
+    )
+    ion_chamber_counterChannel = DcssArg(2, str, 'Ion chamber counter channel.')
+    ion_chamber_timer = DcssArg(3, str, 'Ion chamber timer.')
+    ion_chamber_timerType = DcssArg(4, str, 'Ion chamber timer type.')
 
 
 @register_message('stoh_register_encoder', 'dcss')
@@ -269,15 +361,12 @@ class DcssStoHRegisterEncoder(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def encoder_name(self):
-        """The name of the encoder as it is known in the DCSS database."""
-        return self.args[0]
-
-    @property
-    def encoder_hardwareName(self):
-        """The name of the encoder as it is known in the DHS code."""
-        return self.args[1]
+    encoder_name = DcssArg(
+        0, str, 'The name of the encoder as it is known in the DCSS database.'
+    )
+    encoder_hardwareName = DcssArg(
+        1, str, 'The name of the encoder as it is known in the DHS code.'
+    )
 
 
 @register_message('stoh_register_object', 'dcss')
@@ -290,15 +379,12 @@ class DcssStoHRegisterObject(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def object_name(self):
-        """The name of the object as it is known in the DCSS database."""
-        return self.args[0]
-
-    @property
-    def object_hardwareName(self):
-        """The name of the object as it is known in the DHS code."""
-        return self.args[1]
+    object_name = DcssArg(
+        0, str, 'The name of the object as it is known in the DCSS database.'
+    )
+    object_hardwareName = DcssArg(
+        1, str, 'The name of the object as it is known in the DHS code.'
+    )
 
 
 @register_message('stoh_configure_real_motor', 'dcss')
@@ -311,70 +397,41 @@ class DcssStoHConfigureRealMotor(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def motor_name(self):
-        """The name of the motor to configure."""
-        return self.args[0]
-
-    @property
-    def motor_position(self):
-        """The scaled position of the motor."""
-        return self.args[1]
-
-    @property
-    def motor_upperLimit(self):
-        """The upper limit for the motor in scaled units."""
-        return self.args[2]
-
-    @property
-    def motor_lowerLimit(self):
-        """The lower limit for the motor in scaled units."""
-        return self.args[3]
-
-    @property
-    def motor_scaleFactor(self):
-        """The scale factor relating scaled units to steps for the motor."""
-        return self.args[4]
-
-    @property
-    def motor_speed(self):
-        """The slew rate for the motor in steps/sec."""
-        return self.args[5]
-
-    @property
-    def motor_acceleration(self):
-        """The acceleration time for the motor in seconds."""
-        return self.args[6]
-
-    @property
-    def motor_backlash(self):
-        """The backlash amount for the motor in steps."""
-        return self.args[7]
-
-    @property
-    def motor_lowerLimitOn(self):
-        """A boolean (0 or 1) indicating if the lower limit is enabled."""
-        return self.args[8]
-
-    @property
-    def motor_upperLimitOn(self):
-        """A boolean (0 or 1) indicating if the upper limit is enabled."""
-        return self.args[9]
-
-    @property
-    def motor_motorLockOn(self):
-        """A boolean (0 or 1) indicating if the motor is software locked."""
-        return self.args[10]
-
-    @property
-    def motor_backlashOn(self):
-        """A boolean (0 or 1) indicating if backlash correction is enabled."""
-        return self.args[11]
-
-    @property
-    def motor_reverseOn(self):
-        """A boolean (0 or 1) indicating if the motor direction is reversed."""
-        return self.args[12]
+    motor_name = DcssArg(0, str, 'The name of the motor to configure.')
+    motor_position = DcssArg(1, float, 'The scaled position of the motor.')
+    motor_upperLimit = DcssArg(
+        2, float, 'The upper limit for the motor in scaled units.'
+    )
+    motor_lowerLimit = DcssArg(
+        3, float, 'The lower limit for the motor in scaled units.'
+    )
+    motor_scaleFactor = DcssArg(
+        4, float, 'The scale factor relating scaled units to steps for the motor.'
+    )
+    motor_speed = DcssArg(5, float, 'The slew rate for the motor in steps/sec.')
+    motor_acceleration = DcssArg(
+        6, float, 'The acceleration time for the motor in seconds.'
+    )
+    motor_backlash = DcssArg(7, float, 'The backlash amount for the motor in steps.')
+    motor_lowerLimitOn = DcssArg(
+        8, dcss_bool, 'A boolean (0 or 1) indicating if the lower limit is enabled.'
+    )
+    motor_upperLimitOn = DcssArg(
+        9, dcss_bool, 'A boolean (0 or 1) indicating if the upper limit is enabled.'
+    )
+    motor_motorLockOn = DcssArg(
+        10, dcss_bool, 'A boolean (0 or 1) indicating if the motor is software locked.'
+    )
+    motor_backlashOn = DcssArg(
+        11,
+        dcss_bool,
+        'A boolean (0 or 1) indicating if backlash correction is enabled.',
+    )
+    motor_reverseOn = DcssArg(
+        12,
+        dcss_bool,
+        'A boolean (0 or 1) indicating if the motor direction is reversed.',
+    )
 
 
 @register_message('stoh_configure_pseudo_motor', 'dcss')
@@ -387,40 +444,23 @@ class DcssStoHConfigurePseudoMotor(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def motor_name(self):
-        """The name of the motor to configure."""
-        return self.args[0]
-
-    @property
-    def motor_position(self):
-        """The scaled position of the motor."""
-        return self.args[1]
-
-    @property
-    def motor_upperLimit(self):
-        """The upper limit for the motor in scaled units."""
-        return self.args[2]
-
-    @property
-    def motor_lowerLimit(self):
-        """The lower limit for the motor in scaled units."""
-        return self.args[3]
-
-    @property
-    def motor_lowerLimitOn(self):
-        """A boolean (0 or 1) indicating if the lower limit is enabled."""
-        return self.args[4]
-
-    @property
-    def motor_upperLimitOn(self):
-        """A boolean (0 or 1) indicating if the upper limit is enabled."""
-        return self.args[5]
-
-    @property
-    def motor_motorLockOn(self):
-        """A boolean (0 or 1) indicating if the motor is software locked."""
-        return self.args[6]
+    motor_name = DcssArg(0, str, 'The name of the motor to configure.')
+    motor_position = DcssArg(1, float, 'The scaled position of the motor.')
+    motor_upperLimit = DcssArg(
+        2, float, 'The upper limit for the motor in scaled units.'
+    )
+    motor_lowerLimit = DcssArg(
+        3, float, 'The lower limit for the motor in scaled units.'
+    )
+    motor_lowerLimitOn = DcssArg(
+        4, dcss_bool, 'A boolean (0 or 1) indicating if the lower limit is enabled.'
+    )
+    motor_upperLimitOn = DcssArg(
+        5, dcss_bool, 'A boolean (0 or 1) indicating if the upper limit is enabled.'
+    )
+    motor_motorLockOn = DcssArg(
+        6, dcss_bool, 'A boolean (0 or 1) indicating if the motor is software locked.'
+    )
 
 
 @register_message('stoh_set_motor_position', 'dcss')
@@ -433,15 +473,8 @@ class DcssStoHSetMotorPosition(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def motor_name(self):
-        """The name of the motor to configure."""
-        return self.args[0]
-
-    @property
-    def motor_position(self):
-        """The new scaled position of the motor."""
-        return self.args[1]
+    motor_name = DcssArg(0, str, 'The name of the motor to configure.')
+    motor_position = DcssArg(1, float, 'The new scaled position of the motor.')
 
 
 @register_message('stoh_start_motor_move', 'dcss')
@@ -454,15 +487,8 @@ class DcssStoHStartMotorMove(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def motor_name(self):
-        """The name of the motor to move."""
-        return self.args[0]
-
-    @property
-    def motor_position(self):
-        """The scaled destination of the motor."""
-        return self.args[1]
+    motor_name = DcssArg(0, str, 'The name of the motor to move.')
+    motor_position = DcssArg(1, float, 'The scaled destination of the motor.')
 
 
 @register_message('stoh_abort_all', 'dcss')
@@ -480,10 +506,9 @@ class DcssStoHAbortAll(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def abort_arg(self):
-        """Either 'hard' or 'soft' e.g. htos_abort_all [hard | soft]"""
-        return self.args[0]
+    abort_arg = DcssArg(
+        0, str, "Either 'hard' or 'soft' e.g. htos_abort_all [hard | soft]"
+    )
 
 
 @register_message('stoh_correct_motor_position', 'dcss')
@@ -497,15 +522,10 @@ class DcssStoHCorrectMotorPosition(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def motor_name(self):
-        """The name of the motor."""
-        return self.args[0]
-
-    @property
-    def motor_correction(self):
-        """The correction to be applied to the motor position."""
-        return self.args[1]
+    motor_name = DcssArg(0, str, 'The name of the motor.')
+    motor_correction = DcssArg(
+        1, float, 'The correction to be applied to the motor position.'
+    )
 
 
 @register_message('stoh_set_motor_dependency', 'dcss')
@@ -515,15 +535,10 @@ class DcssStoHSetMotorDependency(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def motor_name(self):
-        """The name of the motor."""
-        return self.args[0]
-
-    @property
-    def motor_dependencies(self):
-        """The name(s) of the dependent motors."""
-        return self.args[1:]
+    motor_name = DcssArg(0, str, 'The name of the motor.')
+    motor_dependencies = DcssArg(
+        1, str, 'The name(s) of the dependent motors.', rest=True
+    )
 
 
 @register_message('stoh_set_motor_children', 'dcss')
@@ -533,15 +548,8 @@ class DcssStoHSetMotorChildren(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def motor_name(self):
-        """The name of the parent motor."""
-        return self.args[0]
-
-    @property
-    def motor_children(self):
-        """The name(s) of the child motors."""
-        return self.args[1:]
+    motor_name = DcssArg(0, str, 'The name of the parent motor.')
+    motor_children = DcssArg(1, str, 'The name(s) of the child motors.', rest=True)
 
 
 @register_message('stoh_set_shutter_state', 'dcss')
@@ -554,15 +562,10 @@ class DcssStoHSetShutterState(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def shutter_name(self):
-        """The name of the shutter."""
-        return self.args[0]
-
-    @property
-    def shutter_state(self):
-        """The desired state of the shutter (open or closed)."""
-        return self.args[1]
+    shutter_name = DcssArg(0, str, 'The name of the shutter.')
+    shutter_state = DcssArg(
+        1, str, 'The desired state of the shutter (open or closed).'
+    )
 
 
 @register_message('stoh_start_operation', 'dcss')
@@ -575,13 +578,10 @@ class DcssStoHStartOperation(DcssStoCMessage):
     def __init__(self, split):
         super().__init__(split)
 
-    @property
-    def operation_name(self):
-        """The name of the operation."""
-        return self.args[0]
-
-    @property
-    def operation_handle(self):
+    operation_name = DcssArg(0, str, 'The name of the operation.')
+    operation_handle = DcssArg(
+        1,
+        str,
         """The operation handle.
         A unique handle currently constructed by calling the create_operation_handle procedure in BLU-ICE.
         This currently creates a handle in the following format::
@@ -591,15 +591,16 @@ class DcssStoHStartOperation(DcssStoCMessage):
         where clientNumber is a unique number provided by DCSS for each connected GUI or Hardware client.
         DCSS will reject an operation message if the clientNumber does not match the client.
         The operationCounter is a number that the client should increment with each new operation that is started.
-        """
-        return self.args[1]
-
-    @property
-    def operation_args(self):
+        """,
+    )
+    operation_args = DcssArg(
+        2,
+        str,
         """The operation arguments.
         It is recommended that the list of arguments continue to follow the general format of the DCS message structure (space separated tokens).
-        However, this requirement can only be enforced by the writer of the operation handlers."""
-        return self.args[2:]
+        However, this requirement can only be enforced by the writer of the operation handlers.""",
+        rest=True,
+    )
 
 
 # --------------------------------------------------------------------------
@@ -1013,14 +1014,36 @@ class DcssHtoSSetMotorMessage(DcssHtoSMessage):
         self._split_msg = [self.get_type_id(), motor_name]
 
 
+class DcssMessageCodec(MessageCodec):
+    """Reads the command of a raw DCSS message without decoding the rest of it.
+
+    DCSS broadcasts many messages a DHS has no class for, those are dropped after looking at no more than the first
+    word. Raw messages can be bytes or a memoryview.
+    """
+
+    def key(self, type_id: str) -> bytes:
+        return type_id.encode('ascii')
+
+    def read_key(self, raw_msg: bytes, max_key_len: int) -> bytes:
+        # A command longer than the longest registered one is unknown, so the scan stops there.
+        scan_len = max_key_len + 1
+        if not isinstance(raw_msg, bytes):
+            raw_msg = bytes(raw_msg[:scan_len])
+        end = raw_msg.find(b' ', 0, scan_len)
+        return raw_msg[: end if end >= 0 else scan_len]
+
+    def decode(self, msg_cls: MessageIn, raw_msg: bytes) -> MessageIn:
+        if not isinstance(raw_msg, bytes):
+            raw_msg = bytes(raw_msg)
+        # The command has already been matched, hand the split straight to the class instead of parse() checking it.
+        return msg_cls(DcssMessageIn._split(raw_msg))
+
+
 class DcssMessageFactory(MessageFactory):
     """Class for parsing the messages from DCSS."""
 
     def __init__(self):
-        super().__init__('dcss')
-
-    def _parse_type_id(self, raw_msg: bytes):
-        return DcssMessageIn.parse_type_id(raw_msg)
+        super().__init__('dcss', DcssMessageCodec())
 
 
 class DcssDhsV1MessageReader(MessageStreamReader):
@@ -1033,9 +1056,9 @@ class DcssDhsV1MessageReader(MessageStreamReader):
         pass
 
     def read_msg(self, stream_reader: StreamReader) -> bytes:
-        packed = stream_reader.read(200)
+        packed = bytes(stream_reader.read(200))
         _logger.debug(f'Received packed raw message: {packed}')
-        return packed.decode('ascii').rstrip('\n\r\x00').encode('ascii')
+        return packed.rstrip(b'\n\r\x00')
 
 
 class DcssDhsV1MessageWriter(MessageStreamWriter):
@@ -1049,8 +1072,10 @@ class DcssDhsV1MessageWriter(MessageStreamWriter):
         pass
 
     def write_msg(self, stream_writer: StreamWriter, msg: bytes):
-        packed = msg.decode('ascii').ljust(200, '\x00').encode('ascii')
-        _logger.debug(f'Sending packed raw message: {packed}')
+        if isinstance(msg, DcssPackedMessage):
+            msg = msg.text
+        packed = bytes(msg).ljust(200, b'\x00')
+        _logger.debug('Sending packed raw message: %s', packed)
         stream_writer.write(packed)
 
 
@@ -1084,44 +1109,44 @@ class DcssDhsV2MessageReaderWriter(MessageStreamReader, MessageStreamWriter):
 
         unpacked = None
 
+        # The stream reader hands back views into its receive buffer, only the text section is copied out.
         header = stream_reader.read(26)
-        packed = header
-        hdr_str = header.decode('ascii').rstrip('\x00\r\n').split()
-        if hdr_str[0].isnumeric():
+        hdr_str = bytes(header).rstrip(b'\x00\r\n').split()
+        if hdr_str[0].isdigit():
             text_size = int(hdr_str[0])
             bin_size = int(hdr_str[1])
             text_buf = stream_reader.read(text_size)
-            packed += text_buf
-            bin_buf = stream_reader.read(bin_size)
-            if bin_buf:
-                packed += bin_buf
-
-            unpacked = text_buf
+            unpacked = bytes(text_buf) if text_buf is not None else b''
+            # Binary section is not used by the DHS but must be consumed from the stream.
+            stream_reader.read(bin_size)
             self._version = 2
         else:
             tailer = stream_reader.read(174)
-            packed += tailer
-            unpacked = packed
+            unpacked = b''.join((header, tailer))
             self._version = 1
 
-        _logger.debug(f'Received packed raw message version {self._version}: {packed}')
+        unpacked = unpacked.rstrip(b'\n\r\x00')
+        _logger.debug(f'Received raw message version {self._version}: {unpacked}')
 
-        return unpacked.decode('ascii').rstrip('\n\r\x00').encode('ascii')
+        return unpacked
 
     def write_msg(self, stream_writer: StreamWriter, msg: bytes):
 
         packed = None
         if self._version == 2:
-            msg_str = msg.decode('ascii').rstrip('\r\n\x00') + ' \x00'
-            msg_text_buf = msg_str.encode('ascii')
-            msg_text_len = len(msg_text_buf)
-            msg_header = str(msg_text_len).rjust(12) + str(0).rjust(13) + ' '
-            msg_hdr_buf = msg_header.encode('ascii')
-            packed = msg_hdr_buf + msg_text_buf
+            if isinstance(msg, DcssPackedMessage):
+                # DcssMessageOut.write() already packed it, header and all.
+                packed = msg
+            else:
+                packed = DcssPackedMessage.from_text(bytes(msg).rstrip(b'\r\n\x00'))
         else:
-            packed = msg.decode('ascii').ljust(200, '\x00').encode('ascii')
+            if isinstance(msg, DcssPackedMessage):
+                msg = msg.text
+            packed = bytes(msg).ljust(200, b'\x00')
 
-        _logger.debug(f'Sending packed raw message version {self._version}: {packed}')
+        _logger.debug(
+            'Sending packed raw message version %s: %s', self._version, packed
+        )
         stream_writer.write(packed)
 
 
@@ -1158,6 +1183,48 @@ class DcssClientConnection(ConnectionBase):
         )
 
 
+class AsyncDcssClientTransport(AsyncTcpipClientTransport):
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        loop: asyncio.AbstractEventLoop,
+        config: dict = {},
+    ):
+        self._msg_reader_writer = DcssDhsV2MessageReaderWriter()
+        super().__init__(
+            connection_name,
+            url,
+            self._msg_reader_writer,
+            self._msg_reader_writer,
+            loop,
+            config,
+        )
+
+
+@register_connection('dcss', ExecutionMode.ASYNCIO)
+class AsyncDcssClientConnection(AsyncConnectionBase):
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        incoming_message_queue: IncomingMessageQueue,
+        outgoing_message_queue: OutgoingMessageQueue,
+        loop: asyncio.AbstractEventLoop,
+        config: dict = {},
+    ):
+        super().__init__(
+            connection_name,
+            url,
+            AsyncDcssClientTransport(connection_name, url, loop, config),
+            incoming_message_queue,
+            outgoing_message_queue,
+            DcssMessageFactory(),
+            loop,
+            config,
+        )
+
+
 class DcssOperationHandlerRegistry:
 
     _default_processor_name = 'default'
@@ -1170,26 +1237,16 @@ class DcssOperationHandlerRegistry:
         if not processor_name:
             processor_name = cls._default_processor_name
 
-        if not isfunction(operation_handler_function):
-            raise TypeError('handler_function must be a function')
-
-        hf_sig = signature(operation_handler_function)
-        msg_param = hf_sig.parameters.get('message')
-        if not issubclass(msg_param.annotation, DcssStoHStartOperation):
-            raise TypeError(
-                'The handler_function must have a named parameter "message" that is of type DcssStoHStartOperation'
-            )
-
-        ctx_param = hf_sig.parameters.get('context')
-        if not issubclass(ctx_param.annotation, DcssContext):
-            raise TypeError(
-                'The handler_function must have a named parameter "context" that is of type DcssContext'
-            )
+        _check_handler_signature(
+            operation_handler_function, DcssStoHStartOperation, DcssContext
+        )
 
         if cls._registry.get(processor_name) is None:
             cls._registry[processor_name] = dict()
 
-        cls._registry[processor_name][operation_name] = operation_handler_function
+        cls._registry[processor_name].setdefault(operation_name, []).append(
+            operation_handler_function
+        )
 
     @classmethod
     def _get_operation_handlers(cls, processor_name: str = None):
@@ -1206,14 +1263,16 @@ def register_dcss_start_operation_handler(
     operation_name - Start operations that match this operation name will be dispatched to this function.
 
     dispatcher_name - Name of the message dispatcher that will be routing the messages to this message handler.
-    Each message dispatcher will run in it's own thread and in the future there may be a requirement
-    to have multiple dispatchers. For now, there is only one dispatcher, so leave this blank or set
-    it to None.
+    Leave this blank or set it to None to use the default dispatcher. A named dispatcher with a worker pool,
+    see register_dispatcher, lets long running operations run without blocking other DCSS messages.
 
     The function signature must match:
 
     def handler(message:DcssStoHStartOperation, context:DcssContext)
 
+    As with register_message_handler, several handlers may be registered for the same operation, any callable with
+    this signature may be registered, and the handler may also be a coroutine function.
+
     """
 
     def decorator_register_start_operation_handler(func):
@@ -1225,6 +1284,20 @@ def register_dcss_start_operation_handler(
     return decorator_register_start_operation_handler
 
 
+def dcss_message_key(message: MessageIn):
+    """Dispatcher key for DCSS messages, see register_dispatcher.
+
+    Start operation messages are keyed by operation handle, other DCSS messages by their first argument which is
+    the motor, shutter, string, etc. device name. Everything else shares a single key.
+    """
+
+    if isinstance(message, DcssStoHStartOperation):
+        return message.operation_handle
+    if isinstance(message, DcssStoCMessage) and message.args:
+        return message.args[0]
+    return None
+
+
 class DcssActiveOperation:
     """Storage class for active operations.
 
@@ -1270,34 +1343,70 @@ class DcssActiveOperation:
 
 
 class DcssActiveOperations:
-    """ Stores a list of active operations that are currently in progress"""
+    """Stores the active operations that are currently in progress.
+
+    Operations are indexed by (operation name, operation handle) with secondary indexes by name and by handle, so
+    adding, removing and looking up operations doesn't scan the whole collection. The dispatcher(s) add operations
+    and the connection write path removes them, so all access is guarded by a lock.
+    """
 
     def __init__(self):
-        self._active_operations = []
+        self._lock = threading.RLock()
+        self._active_operations = {}
+        self._by_name = {}
+        self._by_handle = {}
+
+    @staticmethod
+    def _key(operation: DcssActiveOperation):
+        return (operation.operation_name, operation.operation_handle)
+
+    def __len__(self):
+        return len(self._active_operations)
 
     def add_operation(self, operation: DcssActiveOperation):
-        # replace existing operation if there is one.
-        self.remove_operation(operation)
-        self._active_operations.append(operation)
+        key = self._key(operation)
+        with self._lock:
+            # replace existing operation if there is one.
+            self._remove_key(key)
+            self._active_operations[key] = operation
+            self._by_name.setdefault(operation.operation_name, {})[key] = operation
+            self._by_handle.setdefault(operation.operation_handle, {})[key] = operation
 
     def get_operations(self, operation_name: str = None, operation_handle=None):
-        return list(
-            filter(
-                lambda op: (not operation_name or operation_name == op.operation_name)
-                and (not operation_handle or operation_handle == op.operation_handle),
-                self._active_operations,
-            )
-        )
+        with self._lock:
+            if operation_name and operation_handle:
+                op = self._active_operations.get((operation_name, operation_handle))
+                return [op] if op else []
+            elif operation_name:
+                return list(self._by_name.get(operation_name, {}).values())
+            elif operation_handle:
+                return list(self._by_handle.get(operation_handle, {}).values())
+            else:
+                return list(self._active_operations.values())
+
+    def _remove_key(self, key):
+        if self._active_operations.pop(key, None) is None:
+            return
+
+        operation_name, operation_handle = key
+        for index, index_key in (
+            (self._by_name, operation_name),
+            (self._by_handle, operation_handle),
+        ):
+            ops = index.get(index_key)
+            if ops is not None:
+                ops.pop(key, None)
+                if not ops:
+                    del index[index_key]
 
     def remove_operation(self, operation: DcssActiveOperation):
-        ops = self.get_operations(operation.operation_name, operation.operation_handle)
-        for op in ops:
-            while op in self._active_operations:
-                self._active_operations.remove(op)
+        with self._lock:
+            self._remove_key(self._key(operation))
 
     def remove_operations(self, operations: list):
-        for op in operations:
-            self.remove_operation(op)
+        with self._lock:
+            for op in operations:
+                self._remove_key(self._key(op))
 
 
 class DcssContext(Context):
@@ -1323,13 +1432,55 @@ class DcssContext(Context):
         return self._active_operations.get_operations()
 
 
+class _PendingMotorUpdate:
+    """Queue slot for a motor position update that newer updates for the same motor can replace in place."""
+
+    __slots__ = ('message',)
+
+    def __init__(self, message: DcssHtoSUpdateMotorPosition):
+        self.message = message
+
+
 class DcssOutgoingMessageQueue(OutgoingMessageQueue):
-    def __init__(self, active_operations: DcssActiveOperations):
-        super().__init__()
+    """Outgoing queue for DCSS connections.
+
+    Removes active operations when their operation completed message is queued, and can coalesce motor position
+    updates.
+
+    coalesce_motor_updates - When True, an htos_update_motor_position that is queued while an earlier update for the
+    same motor is still waiting to be sent replaces that update in place, so only the newest position is sent.
+    Updates are never moved across an htos_motor_move_started or htos_motor_move_completed for the same motor.
+
+    motor_update_max_rate - Maximum number of position updates per second that are sent for each motor, 0 for no
+    limit. Updates that come in faster are held back and coalesced, the newest one is sent once the motor's interval
+    has passed. Setting a rate turns coalescing on.
+    """
+
+    def __init__(
+        self,
+        active_operations: DcssActiveOperations,
+        maxsize: int = 0,
+        full_policy: QueueFullPolicy = QueueFullPolicy.BLOCK,
+        coalesce_motor_updates: bool = False,
+        motor_update_max_rate: float = 0,
+    ):
+        super().__init__(maxsize, full_policy)
         self._active_operations = active_operations
+        motor_update_max_rate = float(motor_update_max_rate or 0)
+        self._coalesce = bool(coalesce_motor_updates or motor_update_max_rate)
+        self._min_update_interval = (
+            1.0 / motor_update_max_rate if motor_update_max_rate > 0 else 0.0
+        )
+        # Updates in the queue that can still be replaced, by motor name.
+        self._pending_updates = {}
+        # Updates held back by the rate limit, by motor name: (ready time, message).
+        self._held_updates = {}
+        # When the last update for a motor went into the queue, by motor name.
+        self._update_times = {}
 
-    def queue(self, message: MessageOut):
-        super().queue(message)
+    def queue(self, message: MessageOut, timeout=None):
+        if not (self._coalesce and self._coalesce_update(message)):
+            super().queue(message, timeout)
 
         # Special handling for operation completed messages
         if isinstance(message, DcssHtoSOperationCompleted):
@@ -1338,6 +1489,109 @@ class DcssOutgoingMessageQueue(OutgoingMessageQueue):
             )
             self._active_operations.remove_operations(ops)
 
+    def _coalesce_update(self, message: MessageOut) -> bool:
+        """Replace a pending update or hold the update back, returns False if the update must be queued."""
+
+        if not isinstance(message, DcssHtoSUpdateMotorPosition):
+            return False
+
+        motor_name = message._split_msg[1]
+        with self._lock:
+            pending = self._pending_updates.get(motor_name)
+            if pending is not None:
+                pending.message = message
+                return True
+
+            if self._min_update_interval:
+                held = self._held_updates.get(motor_name)
+                if held is not None:
+                    self._held_updates[motor_name] = (held[0], message)
+                    return True
+
+                last_time = self._update_times.get(motor_name)
+                if last_time is not None:
+                    ready_time = last_time + self._min_update_interval
+                    if ready_time > time.monotonic():
+                        self._held_updates[motor_name] = (ready_time, message)
+                        # Wake the consumer so it waits for the ready time.
+                        self._not_empty.notify()
+                        return True
+
+        return False
+
+    def _put(self, item: MessageOut):
+        if not self._coalesce:
+            return super()._put(item)
+
+        if isinstance(item, DcssHtoSUpdateMotorPosition):
+            motor_name = item._split_msg[1]
+            pending = _PendingMotorUpdate(item)
+            self._pending_updates[motor_name] = pending
+            self._update_times[motor_name] = time.monotonic()
+            self._deque.append(pending)
+            return
+
+        if isinstance(item, (DcssHtoSMotorMoveStarted, DcssHtoSMotorMoveCompleted)):
+            # Send any held back update first and don't let later updates jump ahead of this message.
+            motor_name = item._split_msg[1]
+            held = self._held_updates.pop(motor_name, None)
+            if held is not None:
+                self._deque.append(held[1])
+                self._update_times[motor_name] = time.monotonic()
+            self._pending_updates.pop(motor_name, None)
+
+        self._deque.append(item)
+
+    def _get(self) -> MessageOut:
+        item = self._deque.popleft()
+        if isinstance(item, _PendingMotorUpdate):
+            motor_name = item.message._split_msg[1]
+            if self._pending_updates.get(motor_name) is item:
+                del self._pending_updates[motor_name]
+            item = item.message
+        return item
+
+    def _release_held_updates(self):
+        now = time.monotonic()
+        for motor_name, (ready_time, message) in list(self._held_updates.items()):
+            if ready_time <= now:
+                del self._held_updates[motor_name]
+                self._put(message)
+
+    def _wait_not_empty(self, timeout) -> bool:
+        if not self._min_update_interval:
+            return super()._wait_not_empty(timeout)
+
+        end_time = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._held_updates:
+                self._release_held_updates()
+            if self._deque:
+                return True
+
+            now = time.monotonic()
+            wait = None
+            if self._held_updates:
+                wait = min(held[0] for held in self._held_updates.values()) - now
+            if end_time is not None:
+                remaining = end_time - now
+                if remaining <= 0:
+                    return False
+                wait = remaining if wait is None else min(wait, remaining)
+            wait_for(self._not_empty, lambda: self._deque, wait)
+
+    def next_ready_time(self) -> float:
+        with self._lock:
+            if self._held_updates:
+                return min(held[0] for held in self._held_updates.values())
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._pending_updates.clear()
+            self._held_updates.clear()
+        super().clear()
+
 
 class DcssMessageQueueDispatcher(MessageQueueDispatcher):
     def __init__(
@@ -1347,37 +1601,65 @@ class DcssMessageQueueDispatcher(MessageQueueDispatcher):
         context: Context,
         active_operations: DcssActiveOperations,
         config: dict = {},
+        loop: asyncio.AbstractEventLoop = None,
+        workers: int = 0,
+        key=None,
+        priority_type_ids: tuple = (),
+        metrics: Metrics = None,
     ):
-        super().__init__(name, incoming_message_queue, context, config)
+        super().__init__(
+            name,
+            incoming_message_queue,
+            context,
+            config,
+            loop,
+            workers,
+            key,
+            priority_type_ids,
+            metrics,
+        )
         self._active_operations = active_operations
         self._operation_handler_map = (
-            DcssOperationHandlerRegistry._get_operation_handlers()
+            DcssOperationHandlerRegistry._get_operation_handlers(name)
         )
+        self._operation_dispatch_table = {}
+
+    def _log_handlers(self):
+        super()._log_handlers()
+        for op_name, funcs in self._operation_handler_map.items():
+            for func in funcs:
+                _logger.debug(
+                    f'Registered start operation handler: {op_name}, {_describe_handler(func)} with {self._disp_name} dispatcher'
+                )
 
-    def start(self):
-        super().start()
-        for op_name, func in self._operation_handler_map.items():
-            lineno = getsourcelines(func)[1]
-            module = getmodule(func)
-            _logger.debug(
-                f'Registered start operation handler: {op_name}, {module.__name__}:{func.__name__}():{lineno} with {self._disp_name} dispatcher'
-            )
-
-    def process_message(self, message: MessageIn):
-        # Send to parent dispatcher to handle messages.
-        super().process_message(message)
-
-        # Special handling for start operation messages.
-        if isinstance(message, DcssStoHStartOperation):
-            handler = self._operation_handler_map.get(message.operation_name)
-            if isfunction(handler):
-                self._active_operations.add_operation(
-                    DcssActiveOperation(
-                        message.operation_name, message.operation_handle, message
-                    )
+    def _compile_dispatch_table(self):
+        self._operation_dispatch_table = {
+            op_name: tuple(self._bind_handler(func) for func in funcs)
+            for op_name, funcs in self._operation_handler_map.items()
+        }
+        super()._compile_dispatch_table()
+
+    def _compile_handlers(self, msg_cls: type) -> tuple:
+        handlers = super()._compile_handlers(msg_cls)
+
+        # Start operation messages are also routed to the handlers registered for their operation name.
+        if self._operation_dispatch_table and issubclass(
+            msg_cls, DcssStoHStartOperation
+        ):
+            handlers += (self._dispatch_start_operation,)
+
+        return handlers
+
+    def _dispatch_start_operation(self, message: DcssStoHStartOperation):
+        op_dispatch = self._operation_dispatch_table.get(message.operation_name)
+        if op_dispatch:
+            self._active_operations.add_operation(
+                DcssActiveOperation(
+                    message.operation_name, message.operation_handle, message
                 )
-                handler(message, self._context)
+            )
+            for handler in op_dispatch:
+                handler(message)
 
     def process_message_now(self, message: MessageIn):
-        # Send to parent dispatcher to handle messages.
-        super().process_message(message)
+        self.process_message(message)
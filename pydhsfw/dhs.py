@@ -1,16 +1,20 @@
 # -*- coding: utf-8 -*-
 import argparse
+import asyncio
 import sys
 import logging
 import signal
 from typing import Any
 from pydhsfw.messages import (
+    AsyncIncomingMessageQueue,
     IncomingMessageQueue,
     OutgoingMessageQueue,
     MessageIn,
+    QueueFullPolicy,
     register_message,
 )
-from pydhsfw.connection import Connection
+from pydhsfw.threads import EventLoopWorker, call_soon
+from pydhsfw.connection import Connection, ExecutionMode
 from pydhsfw.connectionmanager import ConnectionManager
 from pydhsfw.dcss import (
     DcssClientConnection,
@@ -18,7 +22,10 @@ from pydhsfw.dcss import (
     DcssActiveOperations,
     DcssOutgoingMessageQueue,
     DcssMessageQueueDispatcher,
+    DcssOperationHandlerRegistry,
 )
+from pydhsfw.metrics import Metrics
+from pydhsfw.processors import DispatcherRegistry, MessageHandlerRegistry
 
 _logger = logging.getLogger(__name__)
 
@@ -33,10 +40,12 @@ class DhsContext(DcssContext):
         active_operations: DcssActiveOperations,
         connection_mgr: ConnectionManager,
         incoming_message_queue: IncomingMessageQueue,
+        metrics: Metrics = None,
     ):
         super().__init__(active_operations)
         self._conn_mgr = connection_mgr
         self._incoming_msg_queue = incoming_message_queue
+        self._metrics = metrics or Metrics()
         self._state = None
         self._config = None
 
@@ -45,10 +54,24 @@ class DhsContext(DcssContext):
     ) -> Connection:
 
         outgoing_msg_queue = None
+        maxsize = config.get('outgoing_queue_maxsize', 0)
+        full_policy = config.get('outgoing_queue_full_policy', QueueFullPolicy.BLOCK)
         if scheme == DcssClientConnection._scheme:
-            outgoing_msg_queue = DcssOutgoingMessageQueue(self._active_operations)
+            outgoing_msg_queue = DcssOutgoingMessageQueue(
+                self._active_operations,
+                maxsize,
+                full_policy,
+                config.get('coalesce_motor_updates', False),
+                config.get('motor_update_max_rate', 0),
+            )
         else:
-            outgoing_msg_queue = OutgoingMessageQueue()
+            outgoing_msg_queue = OutgoingMessageQueue(maxsize, full_policy)
+
+        if self._metrics.enabled:
+            outgoing_msg_queue.metrics = self._metrics
+            self._metrics.register_gauge(
+                f'{connection_name} outgoing queue depth', outgoing_msg_queue.qsize
+            )
 
         conn = self._conn_mgr.create_connection(
             connection_name,
@@ -66,6 +89,16 @@ class DhsContext(DcssContext):
     def get_connection(self, connection_name: str) -> Connection:
         return self._conn_mgr.get_connection(connection_name)
 
+    @property
+    def metrics(self) -> Metrics:
+        """
+        Latency histograms, counters and queue depth gauges for the message pipeline, see Metrics.
+
+        Metrics are only collected when metrics_enabled is set in the Dhs config, e.g. print(context.metrics.to_text())
+        or context.metrics.to_json().
+        """
+        return self._metrics
+
     @property
     def config(self) -> Any:
         """
@@ -128,14 +161,46 @@ class DhsStart(MessageIn):
 class Dhs:
     """
     Main DHS class
+
+    Set the execution_mode config value to 'asyncio' to run the dispatcher and all connections that support it on a
+    single event loop thread instead of a set of worker threads per connection.
+
+    Besides the default dispatcher, a dispatcher is created for every dispatcher name used when registering handlers
+    or configured with register_dispatcher. The default dispatcher reads the incoming message queue and forwards
+    messages to the named dispatchers that handle them.
     """
 
     def __init__(self, config: dict = {}):
-        self._conn_mgr = ConnectionManager()
+        self._execution_mode = ExecutionMode(
+            config.get('execution_mode', ExecutionMode.THREADED)
+        )
+        self._loop = None
+        self._loop_worker = None
+        maxsize = config.get('incoming_queue_maxsize', 0)
+        full_policy = config.get('incoming_queue_full_policy', QueueFullPolicy.BLOCK)
+        if self._execution_mode == ExecutionMode.ASYNCIO:
+            self._loop = asyncio.new_event_loop()
+            self._loop_worker = EventLoopWorker('dhs', self._loop, config)
+            # Never blocks the loop when it's full, connections on the loop pause reading instead, see
+            # AsyncConnectionBase.
+            self._incoming_msg_queue = AsyncIncomingMessageQueue(
+                self._loop, maxsize, full_policy
+            )
+        else:
+            self._incoming_msg_queue = IncomingMessageQueue(maxsize, full_policy)
+
+        self._metrics = Metrics(config)
+        # Only hand the metrics to the pipeline when enabled so it doesn't pay for timing otherwise.
+        pipeline_metrics = self._metrics if self._metrics.enabled else None
+        self._incoming_msg_queue.metrics = pipeline_metrics
+
+        self._conn_mgr = ConnectionManager(self._loop)
         self._active_operations = DcssActiveOperations()
-        self._incoming_msg_queue = IncomingMessageQueue()
         self._context = DhsContext(
-            self._active_operations, self._conn_mgr, self._incoming_msg_queue
+            self._active_operations,
+            self._conn_mgr,
+            self._incoming_msg_queue,
+            self._metrics,
         )
         self._msg_disp = DcssMessageQueueDispatcher(
             'default',
@@ -143,7 +208,35 @@ class Dhs:
             self._context,
             self._active_operations,
             config,
+            self._loop,
+            metrics=pipeline_metrics,
+            **DispatcherRegistry._get_dispatcher_settings('default'),
         )
+        self._named_disps = []
+        for name in sorted(
+            (
+                MessageHandlerRegistry._registry.keys()
+                | DcssOperationHandlerRegistry._registry.keys()
+                | DispatcherRegistry._get_dispatcher_names()
+            )
+            - {'default'}
+        ):
+            disp = DcssMessageQueueDispatcher(
+                name,
+                IncomingMessageQueue(),
+                self._context,
+                self._active_operations,
+                config,
+                metrics=pipeline_metrics,
+                **DispatcherRegistry._get_dispatcher_settings(name),
+            )
+            self._msg_disp.add_route(disp)
+            self._named_disps.append(disp)
+
+        if pipeline_metrics:
+            # The default dispatcher's queue is the incoming message queue.
+            for disp in [self._msg_disp] + self._named_disps:
+                disp.register_gauges(pipeline_metrics)
         self._init()
         self._conn_mgr.load_registry()
 
@@ -161,15 +254,33 @@ class Dhs:
         """
         Starts the DHS context and reads in the arg parser
         """
-        self._msg_disp.start()
-        self._msg_disp.process_message(DhsStart())
+        # Named dispatchers first so they are ready for messages routed from the default dispatcher.
+        for disp in self._named_disps:
+            disp.start()
+
+        if self._loop_worker:
+            self._loop_worker.start()
+            self._msg_disp.start_async()
+            # All handlers run on the event loop in this mode, including dhs_start.
+            call_soon(self._loop, self._msg_disp.process_message, DhsStart())
+        else:
+            self._msg_disp.start()
+            self._msg_disp.process_message(DhsStart())
 
     def shutdown(self):
         """
         Shuts down the DHS
         """
-        self._msg_disp.abort()
-        self._conn_mgr.shutdown_connections()
+        if self._loop_worker:
+            self._conn_mgr.shutdown_connections()
+            self._msg_disp.abort()
+            self._loop_worker.abort()
+        else:
+            self._msg_disp.abort()
+            self._conn_mgr.shutdown_connections()
+
+        for disp in self._named_disps:
+            disp.abort()
 
     def wait(self, signal_set: set = None):
         """
@@ -191,5 +302,9 @@ class Dhs:
             for sig in signal_set:
                 signal.signal(sig, handler)
 
+        if self._loop_worker:
+            self._loop_worker.join()
         self._msg_disp.join()
+        for disp in self._named_disps:
+            disp.join()
         self._conn_mgr.wait_connections()
@@ -1,15 +1,30 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import itertools
 import threading
 import time
 import logging
 from socket import gaierror, gethostbyname
-from requests import Response, Request, Session, Timeout, exceptions, request
+from requests import Response, Request, Session, Timeout, exceptions
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urljoin, urlparse
 from typing import Any
 from enum import Enum
-from pydhsfw.threads import AbortableThread
-from pydhsfw.messages import BlockingQueue, MessageOut, MessageIn
-from pydhsfw.transport import Transport, TransportState
+from pydhsfw.threads import AbortableThread, CancellableThreadPoolExecutor, wait_for
+from pydhsfw.messages import BlockingQueue, MessageOut, MessageIn, QueueFullPolicy
+from pydhsfw.transport import (
+    AsyncTransport,
+    ReconnectPolicy,
+    Transport,
+    TransportState,
+    TransportStateMachine,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 _logger = logging.getLogger(__name__)
 
@@ -27,6 +42,7 @@ class ContentType(Enum):
 class Headers(Enum):
     DHS_REQUEST_TYPE_ID = 'DHS-Request-Type-Id'
     DHS_RESPONSE_TYPE_ID = 'DHS-Response-Type-Id'
+    DHS_REQUEST_ID = 'DHS-Request-Id'
     CONTENT_TYPE = 'Content-Type'
     CONTENT_LENGTH = 'Content-Length'
 
@@ -36,6 +52,12 @@ class ResponseMessage(MessageIn):
         super().__init__()
         self._response = response
 
+    @property
+    def request_id(self) -> int:
+        """The request_id of the RequestMessage this is a response to."""
+        request_id = self._response.request.headers.get(Headers.DHS_REQUEST_ID.value)
+        return int(request_id) if request_id else None
+
     @staticmethod
     def parse_type_id(response: Response):
         return response.request.headers.get(Headers.DHS_RESPONSE_TYPE_ID.value)
@@ -52,13 +74,36 @@ class ResponseMessage(MessageIn):
         return msg
 
 
+def parse_json(response: Response) -> Any:
+    """Parse the JSON body of a response, with orjson when it's installed."""
+
+    if orjson is not None:
+        try:
+            return orjson.loads(response.content)
+        except orjson.JSONDecodeError:
+            # Not UTF-8 or not JSON, let requests guess the encoding and raise its usual error.
+            pass
+    return response.json()
+
+
 class JsonResponseMessage(ResponseMessage):
+    """A response with a JSON body.
+
+    The body is parsed the first time json is read and the result is kept, so reading several values from a large
+    response only parses it once. Treat the result as read only, every handler of the message shares it.
+    """
+
+    _NOT_PARSED = object()
+
     def __init__(self, response):
         super().__init__(response)
+        self._json = self._NOT_PARSED
 
     @property
     def json(self):
-        return self._response.json()
+        if self._json is self._NOT_PARSED:
+            self._json = parse_json(self._response)
+        return self._json
 
 
 class FileResponseMessage(ResponseMessage):
@@ -74,17 +119,92 @@ class FileResponseMessage(ResponseMessage):
         return int(self._response.headers[Headers.CONTENT_LENGTH.value])
 
 
+class ServerRequest:
+    """An immutable http request received by a server transport.
+
+    Server transports queue these instead of requests.Request objects. The body is kept as the buffer it was read
+    into (bytes or a memoryview of it), the headers are kept as they were parsed and nothing is copied when the
+    request is handed on, which matters at video frame rates. Treat the body as read only, every handler of the
+    message shares it.
+    """
+
+    __slots__ = ('_method', '_path', '_headers', '_data', '_timestamp', '_type_id')
+
+    def __init__(
+        self,
+        method: str,
+        path: str,
+        headers,
+        data=b'',
+        timestamp: float = None,
+        type_id: str = None,
+    ):
+        self._method = method
+        self._path = path
+        self._headers = headers
+        self._data = data
+        self._timestamp = time.time() if timestamp is None else timestamp
+        self._type_id = type_id
+
+    @property
+    def method(self) -> str:
+        return self._method
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def headers(self):
+        """The request headers, a mapping with case insensitive get()."""
+        return self._headers
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def timestamp(self) -> float:
+        """The time the request was received, from time.time()."""
+        return self._timestamp
+
+    @property
+    def type_id(self) -> str:
+        """The message type id, set by the request reader or taken from the DHS-Request-Type-Id header."""
+        if self._type_id is not None:
+            return self._type_id
+        return self._headers.get(Headers.DHS_REQUEST_TYPE_ID.value)
+
+    def with_type_id(self, type_id: str):
+        """Returns a copy of this request with the message type id set, the body and headers are shared."""
+        return ServerRequest(
+            self._method,
+            self._path,
+            self._headers,
+            self._data,
+            self._timestamp,
+            type_id,
+        )
+
+    def __str__(self):
+        return f'{self._method} {self._path} {len(self._data)} bytes'
+
+
 class ServerRequestMessage(MessageIn):
     def __init__(self, request):
         super().__init__()
         self._request = request
 
     @staticmethod
-    def parse_type_id(request: Request):
-        return request.headers.get(Headers.DHS_REQUEST_TYPE_ID.value)
+    def parse_type_id(request: ServerRequest):
+        return request.type_id
+
+    @property
+    def timestamp(self) -> float:
+        return self._request.timestamp
 
     @classmethod
-    def parse(cls, request: Request) -> Any:
+    def parse(cls, request: ServerRequest) -> Any:
 
         msg = None
 
@@ -101,34 +221,64 @@ class FileServerRequestMessage(ServerRequestMessage):
 
     @property
     def file(self):
+        """The request body, bytes or a memoryview, treat it as read only."""
         return self._request.data
 
+    @property
+    def file_length(self):
+        return len(self._request.data)
 
-class GetRequestMessage(MessageOut):
-    def __init__(self, path: str, params: dict = None):
+
+class RequestMessage(MessageOut):
+    """Base class for http request messages.
+
+    Every request message gets a unique request_id that is sent along with the DHS-Request-Type-Id header and is
+    available on the ResponseMessage created from its response. HTTP connections can have several requests in flight
+    at once, so responses can arrive out of order and request_id is how they are matched back to their requests.
+    """
+
+    _request_ids = itertools.count(1)
+
+    def __init__(self, path: str):
         super().__init__()
         self._path = path
-        self._params = params
+        self._request_id = next(RequestMessage._request_ids)
 
-    def write(self) -> Request:
-        request = Request(RequestVerb.GET.value, self._path, params=self._params)
+    @property
+    def request_id(self) -> int:
+        return self._request_id
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _create_request(self, verb: RequestVerb, **kwargs) -> Request:
+        request = Request(verb.value, self._path, **kwargs)
         request.headers[Headers.DHS_REQUEST_TYPE_ID.value] = self.get_type_id()
+        request.headers[Headers.DHS_REQUEST_ID.value] = str(self._request_id)
         return request
 
+
+class GetRequestMessage(RequestMessage):
+    def __init__(self, path: str, params: dict = None):
+        super().__init__(path)
+        self._params = params
+
+    def write(self) -> Request:
+        return self._create_request(RequestVerb.GET, params=self._params)
+
     def __str__(self):
         return f'{super().__str__()} {self._path} {self._params}'
 
 
-class PostRequestMessage(MessageOut):
+class PostRequestMessage(RequestMessage):
     def __init__(self, path: str, json: dict = None, data: dict = None):
-        super().__init__()
-        self._path = path
+        super().__init__(path)
         self._data = data
         self._json = json
 
-    def write(self) -> bytes:
-        request = Request(RequestVerb.POST.value, self._path)
-        request.headers[Headers.DHS_REQUEST_TYPE_ID.value] = self.get_type_id()
+    def write(self) -> Request:
+        request = self._create_request(RequestVerb.POST)
         if self._json:
             request.json = self._json
         elif self._data:
@@ -150,6 +300,138 @@ class PostFormRequestMessage(PostRequestMessage):
         super().__init__(path, data=data)
 
 
+class StreamingBody:
+    """A request body that is encoded while it is sent instead of when the message is created.
+
+    requests sends a body that is an iterable a chunk at a time as it iterates it, so the encoding work is done by
+    the thread that sends the request and the encoded body is never held in memory as a whole. Implementations must
+    be iterable more than once, so the request can be retried, and know their encoded length up front so the request
+    has a Content-Length instead of being chunked.
+    """
+
+    content_type = 'application/octet-stream'
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __bytes__(self):
+        return b''.join(self)
+
+
+class PostStreamingRequestMessage(RequestMessage):
+    def __init__(self, path: str, body: StreamingBody):
+        super().__init__(path)
+        self._body = body
+
+    @property
+    def body(self) -> StreamingBody:
+        return self._body
+
+    def write(self) -> Request:
+        request = self._create_request(RequestVerb.POST, data=self._body)
+        request.headers[Headers.CONTENT_TYPE.value] = self._body.content_type
+        return request
+
+    def __str__(self):
+        return f'{super().__str__()} {self._path} {self._body!r}'
+
+
+class PooledSession(Session):
+    """A long lived requests session with a configurable connection pool.
+
+    One session is shared by everything a transport sends, including the heartbeat, so connections to the server
+    are kept alive and reused instead of paying for TCP (and TLS) setup on every request. The pool size, retry
+    policy and default request timeouts are taken from the connection config.
+
+    timeout - The default timeout of requests sent without one, in seconds. http_connect_timeout and
+    http_read_timeout override it for their phase of the request, a phase that isn't configured keeps this
+    timeout, or thread_blocking_timeout's default if there isn't one, so no phase waits forever.
+    """
+
+    HTTP_POOL_CONNECTIONS = 'http_pool_connections'
+    HTTP_POOL_CONNECTIONS_DEFAULT = 1
+    HTTP_POOL_MAXSIZE = 'http_pool_maxsize'
+    HTTP_POOL_MAXSIZE_DEFAULT = 10
+    HTTP_MAX_RETRIES = 'http_max_retries'
+    HTTP_MAX_RETRIES_DEFAULT = 0
+    HTTP_RETRY_BACKOFF_FACTOR = 'http_retry_backoff_factor'
+    HTTP_RETRY_BACKOFF_FACTOR_DEFAULT = 0
+    HTTP_RETRY_STATUS_FORCELIST = 'http_retry_status_forcelist'
+    HTTP_CONNECT_TIMEOUT = 'http_connect_timeout'
+    HTTP_READ_TIMEOUT = 'http_read_timeout'
+
+    def __init__(self, config: dict = {}, timeout=None):
+        super().__init__()
+
+        max_retries = int(
+            config.get(self.HTTP_MAX_RETRIES, self.HTTP_MAX_RETRIES_DEFAULT)
+        )
+        if max_retries:
+            max_retries = Retry(
+                total=max_retries,
+                backoff_factor=float(
+                    config.get(
+                        self.HTTP_RETRY_BACKOFF_FACTOR,
+                        self.HTTP_RETRY_BACKOFF_FACTOR_DEFAULT,
+                    )
+                ),
+                status_forcelist=config.get(self.HTTP_RETRY_STATUS_FORCELIST),
+                raise_on_status=False,
+            )
+
+        adapter = HTTPAdapter(
+            pool_connections=int(
+                config.get(
+                    self.HTTP_POOL_CONNECTIONS, self.HTTP_POOL_CONNECTIONS_DEFAULT
+                )
+            ),
+            pool_maxsize=int(
+                config.get(self.HTTP_POOL_MAXSIZE, self.HTTP_POOL_MAXSIZE_DEFAULT)
+            ),
+            max_retries=max_retries,
+        )
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+        connect_timeout = config.get(self.HTTP_CONNECT_TIMEOUT)
+        read_timeout = config.get(self.HTTP_READ_TIMEOUT)
+        self._timeout = timeout
+        if connect_timeout is not None or read_timeout is not None:
+            if timeout is None:
+                timeout = AbortableThread.THREAD_BLOCKING_TIMEOUT_DEFAULT
+            default_connect, default_read = (
+                timeout if isinstance(timeout, tuple) else (timeout, timeout)
+            )
+            self._timeout = (
+                float(default_connect if connect_timeout is None else connect_timeout),
+                float(default_read if read_timeout is None else read_timeout),
+            )
+
+    @property
+    def timeout(self):
+        """The default timeout, a number of seconds or a (connect, read) tuple."""
+        return self._timeout
+
+    def send(self, request, **kwargs):
+        # Session.request always passes a timeout, so fill in the default when it is None.
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self._timeout
+        return super().send(request, **kwargs)
+
+    def send_request(self, request: Request) -> Response:
+        """Prepare and send a request with the same environment settings that Session.request uses.
+
+        Sending a prepared request with different settings (e.g. verify) than the heartbeat would put it in a
+        different connection pool.
+        """
+        p = self.prepare_request(request)
+        settings = self.merge_environment_settings(p.url, {}, None, None, None)
+        return self.send(p, **settings)
+
+
 class MessageResponseReader:
     def __init__(self):
         pass
@@ -158,6 +440,13 @@ class MessageResponseReader:
         """Read the http response and convert it into an object that the message factory can read and convert to a message."""
         return response
 
+    def read_responses(self, response: Response) -> list:
+        """Read an http response that may answer several messages, returns an object for the message factory per message.
+
+        Readers for requests that combine several messages, see MessageRequestWriter.write_requests, override this.
+        """
+        return [self.read_response(response)]
+
 
 class MessageRequestWriter:
     def __init__(self):
@@ -178,46 +467,55 @@ class MessageRequestWriter:
 
         return request
 
+    def write_requests(self, requests: list) -> list:
+        """Create the http requests for a batch of message requests.
+
+        Writers for servers that can answer several messages with one request override this to combine them, the
+        default writes a request per message.
+        """
+        return [self.write_request(request) for request in requests]
+
 
 class ServerMessageRequestReader:
     def __init__(self):
         pass
 
-    def read_request(self, request: Request) -> Request:
+    def read_request(self, request: ServerRequest) -> ServerRequest:
         """Read the http request and convert it into an object that the message factory can read and convert to a message."""
         return request
 
 
 class HttpClientTransportConnectionWorker(AbortableThread):
-    def __init__(self, connection_name: str, url: str, config: dict = {}):
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        session: Session,
+        state_machine: TransportStateMachine,
+        reconnect_policy: ReconnectPolicy,
+        config: dict = {},
+    ):
         super().__init__(
             name=f'{connection_name} http client transport connection worker',
             config=config,
         )
         self._connection_name = connection_name
         self._url = url
+        self._session = session
         self._hearbeat_path = config.get('heartbeat_path')
         self._config = config
-        self._state = TransportState.DISCONNECTED
-        self._desired_state = TransportState.DISCONNECTED
-        self._state_change_event = threading.Event()
+        self._state_machine = state_machine
+        self._reconnect_policy = reconnect_policy
         self._next_heatbeat = None
 
     def connect(self):
-        self._set_desired_state(TransportState.CONNECTED)
+        self._state_machine.request(TransportState.CONNECTED)
 
     def reconnect(self):
-        self._stream_reader._connected = False
-        self._set_desired_state(TransportState.RECONNECTED)
+        self._state_machine.request(TransportState.RECONNECTED)
 
     def disconnect(self):
-        self._stream_reader._connected = False
-        self._set_desired_state(TransportState.DISCONNECTED)
-
-    def _set_desired_state(self, state: TransportState):
-        if self._desired_state != state:
-            self._desired_state = state
-            self._state_change_event.set()
+        self._state_machine.request(TransportState.DISCONNECTED)
 
     def run(self):
 
@@ -228,36 +526,44 @@ class HttpClientTransportConnectionWorker(AbortableThread):
             url = self._get_heartbeat_url()
             while True:
                 try:
-                    if self._state_change_event.wait(self._get_blocking_timeout()):
-                        # Can't wait forever in blocking call, need to enter loop to check for control messages, specifically SystemExit.
-
-                        if self._desired_state == TransportState.CONNECTED:
+                    # Only wake up on our own for the next heartbeat. Aborting the thread wakes the wait up with
+                    # ThreadStopped.
+                    timeout = None
+                    if self.state == TransportState.CONNECTED and self._next_heatbeat:
+                        timeout = max(0.0, self._next_heatbeat - time.time())
+
+                    desired_state = self._state_machine.wait_for_request(timeout)
+                    if desired_state is not None:
+                        if desired_state == TransportState.CONNECTED:
                             self._connect()
-                        elif self._desired_state == TransportState.DISCONNECTED:
+                        elif desired_state == TransportState.DISCONNECTED:
+                            self._reconnect_policy.reset()
                             self._disconnect()
-                        elif self._desired_state == TransportState.RECONNECTED:
+                        elif desired_state == TransportState.RECONNECTED:
                             self._reconnect()
 
-                        self._state_change_event.clear()
-
-                    elif self._state == TransportState.CONNECTED:
+                    elif self.state == TransportState.CONNECTED:
                         if self._next_heatbeat and time.time() > self._next_heatbeat:
                             _logger.info(f'Sending heartbeat to {url}')
-                            state = self._heartbeat(url, self._get_blocking_timeout())
-                            if state != TransportState.CONNECTED:
-                                _logger.warning(
-                                    f'Heartbeat failed: cannot connect to {url}'
+                            try:
+                                state = self._heartbeat(
+                                    url, self._get_blocking_timeout()
                                 )
-                                self._set_state(state)
+                                reason = 'Heartbeat failed'
+                            except Timeout:
+                                state = TransportState.DISCONNECTED
+                                reason = 'Heartbeat timeout'
+                            except gaierror as e:
+                                state = TransportState.DISCONNECTED
+                                reason = f'Connection error {e}, could not resolve hostname {urlparse(url).hostname}'
+                            except exceptions.ConnectionError as e:
+                                state = TransportState.DISCONNECTED
+                                reason = f'Connection error {e}'
+                            if state != TransportState.CONNECTED:
+                                _logger.warning(f'{reason}: cannot connect to {url}')
+                                self._set_state(TransportState.DISCONNECTED)
+                                self._retry_connect()
 
-                except gaierror as e:
-                    _logger.error(
-                        f'Connection error {e}, could not resolve hostname {urlparse(url).hostname}'
-                    )
-                    self._set_state(TransportState.DISCONNECTED)
-                except exceptions.ConnectionError as e:
-                    _logger.error(f'Connection error {e}, could not connect to {url}')
-                    self._set_state(TransportState.DISCONNECTED)
                 except Exception:
                     # Send all other exceptions to the log so we can analyse them to determine if
                     # they need special handling or possibly ignoring them.
@@ -268,13 +574,14 @@ class HttpClientTransportConnectionWorker(AbortableThread):
             _logger.info(f'Shutdown signal received, exiting {self.name}')
         finally:
             try:
+                self._state_machine.desired_state = TransportState.DISCONNECTED
                 self._disconnect()
             except Exception:
                 pass
 
     @property
     def state(self):
-        return self._state
+        return self._state_machine.state
 
     def _get_url(self):
         return self._url
@@ -283,85 +590,96 @@ class HttpClientTransportConnectionWorker(AbortableThread):
         return urljoin(self._url, self._hearbeat_path)
 
     def _set_state(self, state: TransportState):
-        self._state = state
-        _logger.info(f'Connection state: {state}, url: {self._get_url()}')
-        if state in (TransportState.CONNECTED, TransportState.DISCONNECTED):
-            # TODO[Giles]: Add ConnectionConnectedMessage or ConnectionDisconnectedMessage to the queue.
-            pass
+        # Subscribers, e.g. the connection that queues ConnectionConnectedMessage and ConnectionDisconnectedMessage,
+        # are notified by the state machine.
+        self._state_machine.set_state(state)
 
     def _connect(self):
 
-        if self._desired_state == TransportState.CONNECTED:
+        if self._state_machine.desired_state == TransportState.CONNECTED:
 
             if self.state == TransportState.DISCONNECTED:
 
                 wait_timeout = self._get_blocking_timeout()
                 connect_timeout = self._config.get('connect_timeout', None)
-                connect_retry_delay = self._config.get('connect_retry_delay', 10)
                 url = self._get_heartbeat_url()
 
                 self._set_state(TransportState.CONNECTING)
 
                 end_time = time.time() + float(connect_timeout or 0.0)
-                end_delay_time = time.time()
 
-                while self._desired_state == TransportState.CONNECTED and (
-                    connect_timeout is None or time.time() < end_time
-                ):
-                    try:
-                        if time.time() >= end_delay_time:
+                try:
+                    while (
+                        self._state_machine.desired_state == TransportState.CONNECTED
+                        and (connect_timeout is None or time.time() < end_time)
+                    ):
+                        try:
                             _logger.info(f'Connecting to {url}')
                             state = self._heartbeat(url, wait_timeout)
                             if state == TransportState.CONNECTED:
+                                self._reconnect_policy.connected()
                                 self._set_state(TransportState.CONNECTED)
                                 break
-                        else:
-                            time.sleep(wait_timeout)
-
-                    except Timeout:
-                        if self._desired_state == TransportState.CONNECTED:
-                            _logger.info(
-                                f'Connection timeout: cannot connect to {url}, trying again in {connect_retry_delay} seconds'
-                            )
-                            end_delay_time = time.time() + connect_retry_delay
-                    except gaierror as e:
-                        _logger.error(
-                            f'Connection error {e}, could not resolve hostname {urlparse(url).hostname}'
-                        )
-                        self._set_state(TransportState.DISCONNECTED)
-                        end_delay_time = time.time() + connect_retry_delay
-                    except exceptions.ConnectionError as e:
-                        _logger.error(
-                            f'Connection error {e}, could not connect to {url}'
-                        )
-                        self._set_state(TransportState.DISCONNECTED)
-                        end_delay_time = time.time() + connect_retry_delay
-                    except Exception:
-                        _logger.exception(None)
+                            reason = 'Heartbeat failed'
+                        except Timeout:
+                            reason = 'Connection timeout'
+                        except gaierror as e:
+                            reason = f'Connection error {e}, could not resolve hostname {urlparse(url).hostname}'
+                        except exceptions.ConnectionError as e:
+                            reason = f'Connection error {e}'
+
+                        self._wait_to_retry(reason, url, connect_timeout, end_time)
+                finally:
+                    # Gave up, e.g. the connect timeout expired or the desired state changed.
+                    if self.state == TransportState.CONNECTING:
                         self._set_state(TransportState.DISCONNECTED)
-                        raise
             else:
                 _logger.debug('Already connected, ignoring connection request')
 
+    def _wait_to_retry(self, reason: str, url: str, connect_timeout, end_time: float):
+        """Wait for the reconnect policy's delay, returns early if the desired state changes."""
+
+        if self._state_machine.desired_state != TransportState.CONNECTED:
+            return
+
+        delay = self._reconnect_policy.failed()
+        if connect_timeout is not None:
+            delay = min(delay, max(0.0, end_time - time.time()))
+        _logger.info(
+            f'{reason}: cannot connect to {url}, trying again in {delay:.1f} seconds'
+        )
+        if delay:
+            self._state_machine.wait_while_desired(TransportState.CONNECTED, delay)
+
+    def _retry_connect(self):
+        """Connect again after the connection was lost, the first retry is immediate."""
+
+        delay = self._reconnect_policy.failed()
+        if delay:
+            _logger.info(f'Reconnecting to {self._get_url()} in {delay:.1f} seconds')
+            if self._state_machine.wait_while_desired(TransportState.CONNECTED, delay):
+                return
+        self._connect()
+
     def _disconnect(self):
 
-        if self._desired_state == TransportState.DISCONNECTED:
+        if self._state_machine.desired_state == TransportState.DISCONNECTED:
             # Only disconnect if we are connected
             if self.state == TransportState.CONNECTED:
                 self._set_state(TransportState.DISCONNECTING)
+                # Drop the pooled keep-alive connections, the session itself stays usable.
+                self._session.close()
                 self._set_state(TransportState.DISCONNECTED)
             else:
                 _logger.debug('Not connected, ignoring disconnect request')
 
     def _reconnect(self):
 
-        if self._desired_state == TransportState.RECONNECTED:
-            self._desired_state = TransportState.DISCONNECTED
-            self._state = TransportState.CONNECTED
+        if self._state_machine.desired_state == TransportState.RECONNECTED:
+            self._state_machine.desired_state = TransportState.DISCONNECTED
             self._disconnect()
-            time.sleep(self._get_blocking_timeout())
-            self._desired_state = TransportState.CONNECTED
-            self._connect()
+            self._state_machine.desired_state = TransportState.CONNECTED
+            self._retry_connect()
 
     def _heartbeat(self, url, timeout) -> TransportState:
         state = TransportState.DISCONNECTED
@@ -370,7 +688,7 @@ class HttpClientTransportConnectionWorker(AbortableThread):
         gethostbyname(urlparse(url).hostname)
         hearbeat_delay = self._config.get('heartbeat_delay', 30)
         self._next_heatbeat = time.time() + hearbeat_delay
-        response = request('GET', url, timeout=timeout)
+        response = self._session.get(url, timeout=timeout)
         if response.ok:
             state = TransportState.CONNECTED
 
@@ -378,17 +696,33 @@ class HttpClientTransportConnectionWorker(AbortableThread):
 
 
 class RequestQueue(BlockingQueue[Request]):
-    def __init__(self):
-        super().__init__()
+    def __init__(
+        self, maxsize: int = 0, full_policy: QueueFullPolicy = QueueFullPolicy.BLOCK
+    ):
+        super().__init__(maxsize, full_policy)
 
 
 class ResponseQueue(BlockingQueue[Response]):
-    def __init__(self):
-        super().__init__()
+    def __init__(
+        self, maxsize: int = 0, full_policy: QueueFullPolicy = QueueFullPolicy.BLOCK
+    ):
+        super().__init__(maxsize, full_policy)
 
 
 class HttpClientTransport(Transport):
-    """ Http client transport """
+    """Http client transport
+
+    Up to http_max_concurrency requests are sent at the same time from a pool of request workers. Responses are
+    queued as they complete, so with more than one request in flight they can arrive out of order and should be
+    matched to their requests with ResponseMessage.request_id. The default of 1 sends requests one at a time, in
+    order.
+
+    The connection write worker only waits for a free request worker, it never blocks in a request itself, so
+    aborting it stops it straight away. Requests in progress are bounded by the session timeout, see PooledSession.
+    """
+
+    HTTP_MAX_CONCURRENCY = 'http_max_concurrency'
+    HTTP_MAX_CONCURRENCY_DEFAULT = 1
 
     def __init__(
         self,
@@ -401,33 +735,83 @@ class HttpClientTransport(Transport):
         super().__init__(connection_name, url, config)
         self._message_reader = message_reader
         self._message_writer = message_writer
+        # Bound requests like the heartbeat so a hung server can't block a request worker forever.
+        self._session = PooledSession(
+            config,
+            config.get(
+                AbortableThread.THREAD_BLOCKING_TIMEOUT,
+                AbortableThread.THREAD_BLOCKING_TIMEOUT_DEFAULT,
+            ),
+        )
         self._connection_worker = HttpClientTransportConnectionWorker(
-            connection_name, url, config
+            connection_name,
+            url,
+            self._session,
+            self._state_machine,
+            self._reconnect_policy,
+            config,
+        )
+        self._response_queue = ResponseQueue(
+            config.get('response_queue_maxsize', 0),
+            config.get('response_queue_full_policy', QueueFullPolicy.BLOCK),
+        )
+        self._max_concurrency = int(
+            config.get(self.HTTP_MAX_CONCURRENCY, self.HTTP_MAX_CONCURRENCY_DEFAULT)
+        )
+        self._requests_in_flight = 0
+        self._request_slots = threading.Condition()
+        self._request_executor = CancellableThreadPoolExecutor(
+            self._max_concurrency,
+            thread_name_prefix=f'{connection_name} http client request worker',
         )
-        self._response_queue = ResponseQueue()
 
     def _send(self, request: Request) -> Response:
         response = None
-        if self._connection_worker._state == TransportState.CONNECTED:
-            with Session() as s:
-                p = s.prepare_request(request)
-                response = s.send(p)
+        if self.state == TransportState.CONNECTED:
+            response = self._session.send_request(request)
         return response
 
+    def _send_and_queue(self, request: Request):
+        response = self._send(request)
+        if response is None:
+            _logger.warning(f'Send failed, not connected {request.url}')
+        elif response.ok:
+            for raw_msg in self._message_reader.read_responses(response):
+                self._response_queue.queue(raw_msg)
+        else:
+            _logger.warning(f'Bad response {response.status_code}')
+
+    def _send_concurrent(self, request: Request):
+        try:
+            self._send_and_queue(request)
+        except Exception:
+            _logger.exception(None)
+        finally:
+            with self._request_slots:
+                self._requests_in_flight -= 1
+                self._request_slots.notify()
+
     def send(self, msg: Request):
+        self.send_many([msg])
+
+    def send_many(self, msgs: list):
         try:
-            if self._connection_worker._state == TransportState.CONNECTED:
-                request = self._message_writer.write_request(msg)
-                # Add the path to the base url.
-                request.url = urljoin(self._url, request.url)
-                response = self._send(request)
-                if response.ok:
-                    self._response_queue.queue(response)
-                else:
-                    _logger.warning(f'Bad response {response.status_code}')
+            if self.state == TransportState.CONNECTED:
+                for request in self._message_writer.write_requests(msgs):
+                    # Add the path to the base url.
+                    request.url = urljoin(self._url, request.url)
+                    # Wait for a free slot so requests beyond the concurrency limit stay on the outgoing queue.
+                    # Aborting the write worker wakes the wait up with ThreadStopped.
+                    with self._request_slots:
+                        wait_for(
+                            self._request_slots,
+                            lambda: self._requests_in_flight < self._max_concurrency,
+                        )
+                        self._requests_in_flight += 1
+                    self._request_executor.submit(self._send_concurrent, request)
 
             else:
-                _logger.warning(f'Send failed, not connected {msg}')
+                _logger.warning(f'Send failed, not connected {msgs}')
 
         except Exception:
             # Connection is lost because the socket was closed, probably from the other side.
@@ -438,11 +822,10 @@ class HttpClientTransport(Transport):
 
     def receive(self) -> Response:
         try:
-            response = self._response_queue.fetch(
-                self._connection_worker._get_blocking_timeout()
-            )
+            # Responses are read by the message reader before they are queued.
+            response = self._response_queue.fetch()
             if response:
-                return self._message_reader.read_response(response)
+                return response
         except TimeoutError:
             # Read timed out. This is normal, it just means that no messages have been sent so we can ignore it.
             pass
@@ -466,7 +849,173 @@ class HttpClientTransport(Transport):
         self._connection_worker.start()
 
     def shutdown(self):
+        self._request_executor.shutdown_now()
         self._connection_worker.abort()
 
     def wait(self):
         self._connection_worker.join()
+        self._request_executor.shutdown()
+        self._session.close()
+
+
+class AsyncHttpClientTransport(AsyncTransport):
+    """Http client transport for the asyncio execution mode.
+
+    The connection and heartbeat state machine runs as a task on the event loop so the connection needs no worker
+    threads of its own. There is no asyncio http client among the dependencies, so the blocking requests calls are
+    run in an executor of http_max_concurrency threads and their responses are handed back on the loop as they
+    complete.
+    """
+
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        message_reader: MessageResponseReader,
+        message_writer: MessageRequestWriter,
+        loop: asyncio.AbstractEventLoop,
+        config: dict = {},
+    ):
+        super().__init__(connection_name, url, loop, config)
+        self._message_reader = message_reader
+        self._message_writer = message_writer
+        self._hearbeat_path = config.get('heartbeat_path')
+        self._timeout = config.get(
+            AbortableThread.THREAD_BLOCKING_TIMEOUT,
+            AbortableThread.THREAD_BLOCKING_TIMEOUT_DEFAULT,
+        )
+        self._connect_task = None
+        self._session = PooledSession(config, self._timeout)
+        self._request_executor = CancellableThreadPoolExecutor(
+            int(
+                config.get(
+                    HttpClientTransport.HTTP_MAX_CONCURRENCY,
+                    HttpClientTransport.HTTP_MAX_CONCURRENCY_DEFAULT,
+                )
+            ),
+            thread_name_prefix=f'{connection_name} http client request worker',
+        )
+
+    def _get_heartbeat_url(self):
+        return urljoin(self._url, self._hearbeat_path)
+
+    def _connect(self, delay: float = 0.0):
+        self._desired_state = TransportState.CONNECTED
+        if self._connect_task is None:
+            self._connect_task = self._loop.create_task(self._connect_async(delay))
+        else:
+            _logger.debug('Already connected, ignoring connection request')
+
+    async def _connect_async(self, delay: float):
+
+        hearbeat_delay = self._config.get('heartbeat_delay', 30)
+        url = self._get_heartbeat_url()
+
+        try:
+            if delay:
+                _logger.info(f'Reconnecting to {url} in {delay:.1f} seconds')
+                await asyncio.sleep(delay)
+
+            while self._desired_state == TransportState.CONNECTED:
+                if self.state != TransportState.CONNECTED:
+                    self._set_state(TransportState.CONNECTING)
+                    _logger.info(f'Connecting to {url}')
+                elif self._hearbeat_path:
+                    _logger.info(f'Sending heartbeat to {url}')
+
+                try:
+                    state = await self._loop.run_in_executor(
+                        None, self._heartbeat, url, self._timeout
+                    )
+                    reason = 'Heartbeat failed'
+                except Timeout:
+                    state = TransportState.DISCONNECTED
+                    reason = 'Connection timeout'
+                except gaierror as e:
+                    state = TransportState.DISCONNECTED
+                    reason = f'Connection error {e}, could not resolve hostname {urlparse(url).hostname}'
+                except exceptions.ConnectionError as e:
+                    state = TransportState.DISCONNECTED
+                    reason = f'Connection error {e}'
+
+                if state == TransportState.CONNECTED and self.state != state:
+                    self._reconnect_policy.connected()
+                if state != self.state:
+                    self._set_state(state)
+
+                if state == TransportState.CONNECTED:
+                    await asyncio.sleep(hearbeat_delay)
+                else:
+                    delay = self._reconnect_policy.failed()
+                    _logger.info(
+                        f'{reason}: cannot connect to {url}, trying again in {delay:.1f} seconds'
+                    )
+                    await asyncio.sleep(delay)
+        finally:
+            if self._connect_task is asyncio.current_task():
+                self._connect_task = None
+
+    def _heartbeat(self, url, timeout) -> TransportState:
+        state = TransportState.DISCONNECTED
+
+        # Use DNS lookup to resolve hostname since the request call below takes a long time.
+        gethostbyname(urlparse(url).hostname)
+        response = self._session.get(url, timeout=timeout)
+        if response.ok:
+            state = TransportState.CONNECTED
+
+        return state
+
+    def _disconnect(self):
+        self._desired_state = TransportState.DISCONNECTED
+        self._reconnect_policy.reset()
+        if self._connect_task:
+            self._connect_task.cancel()
+            self._connect_task = None
+        if self.state != TransportState.DISCONNECTED:
+            self._set_state(TransportState.DISCONNECTING)
+            self._session.close()
+            self._set_state(TransportState.DISCONNECTED)
+        else:
+            _logger.debug('Not connected, ignoring disconnect request')
+
+    def _reconnect(self):
+        self._disconnect()
+        self._connect()
+
+    def _send(self, request: Request) -> Response:
+        return self._session.send_request(request)
+
+    def _response_done(self, future: asyncio.Future):
+        try:
+            response = future.result()
+            if response.ok:
+                for raw_msg in self._message_reader.read_responses(response):
+                    self._received(raw_msg)
+            else:
+                _logger.warning(f'Bad response {response.status_code}')
+        except Exception:
+            _logger.exception(None)
+
+    def send(self, msg: Request):
+        self.send_many([msg])
+
+    def send_many(self, msgs: list):
+        if self.state == TransportState.CONNECTED:
+            for request in self._message_writer.write_requests(msgs):
+                # Add the path to the base url.
+                request.url = urljoin(self._url, request.url)
+                future = self._loop.run_in_executor(
+                    self._request_executor, self._send, request
+                )
+                future.add_done_callback(self._response_done)
+        else:
+            _logger.warning(f'Send failed, not connected {msgs}')
+
+    def shutdown(self):
+        super().shutdown()
+        self._request_executor.shutdown_now()
+
+    def wait(self):
+        self._request_executor.shutdown()
+        self._session.close()
@@ -1,23 +1,36 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import threading
 import logging
-import time
 import selectors
+import socket
 import http.server
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
 from functools import partial
 from urllib.parse import urlparse
 from pydhsfw.threads import AbortableThread
-from pydhsfw.transport import Transport, TransportState
+from pydhsfw.transport import (
+    AsyncTransport,
+    Transport,
+    TransportState,
+    TransportStateMachine,
+)
 from typing import Any
-from requests import Request
+from requests.structures import CaseInsensitiveDict
 from pydhsfw.messages import (
     IncomingMessageQueue,
     OutgoingMessageQueue,
     MessageFactory,
+    QueueFullPolicy,
     register_message,
 )
-from pydhsfw.connection import ConnectionBase, register_connection
+from pydhsfw.connection import (
+    AsyncConnectionBase,
+    ConnectionBase,
+    ExecutionMode,
+    register_connection,
+)
 from pydhsfw.http import (
     ContentType,
     FileServerRequestMessage,
@@ -25,6 +38,7 @@ from pydhsfw.http import (
     RequestQueue,
     RequestVerb,
     ServerMessageRequestReader,
+    ServerRequest,
     ServerRequestMessage,
 )
 
@@ -35,22 +49,37 @@ class JpegReceiverMessageRequestReader(ServerMessageRequestReader):
     def __init__(self):
         pass
 
-    def read_request(self, request: Request) -> Request:
+    def read_request(self, request: ServerRequest) -> ServerRequest:
         if request.method == RequestVerb.POST.value:
             content_type = request.headers.get(Headers.CONTENT_TYPE.value)
             if content_type in (ContentType.JPEG.value, ContentType.PNG.value):
-                request.headers[
-                    Headers.DHS_REQUEST_TYPE_ID.value
-                ] = 'jpeg_receiver_image_post_request'
+                request = request.with_type_id('jpeg_receiver_image_post_request')
         elif request.method == RequestVerb.GET:
             pass
 
         return request
 
 
+def parse_content_length(value: str) -> int:
+    """The body length in a Content-Length header value, None if it isn't a non-negative integer."""
+
+    value = value.strip()
+    if value.isascii() and value.isdigit():
+        return int(value)
+    return None
+
+
 class JpegReceiverRequestHandler(http.server.BaseHTTPRequestHandler):
-    def __init__(self, request_queue: RequestQueue, *args, **kwargs):
+    MAX_REQUEST_SIZE = 'max_request_size'
+    MAX_REQUEST_SIZE_DEFAULT = 32 * 1024 * 1024
+    MAX_CONNECTIONS = 'max_connections'
+    MAX_CONNECTIONS_DEFAULT = 8
+
+    def __init__(
+        self, request_queue: RequestQueue, max_request_size: int, *args, **kwargs
+    ):
         self._request_queue = request_queue
+        self._max_request_size = max_request_size
         super().__init__(*args, **kwargs)
 
     protocol_version = 'HTTP/1.1'
@@ -59,31 +88,58 @@ class JpegReceiverRequestHandler(http.server.BaseHTTPRequestHandler):
     def do_POST(self):
 
         data_len_hdr = self.headers.get(Headers.CONTENT_LENGTH.value)
-        data_len = int(data_len_hdr)
-
-        remainingbytes = data_len
-
-        data = bytes()
-        while remainingbytes > 0:
-            chunk = self.rfile.read(remainingbytes)
-            if chunk == b'':
+        if data_len_hdr is None:
+            self.send_error(HTTPStatus.LENGTH_REQUIRED)
+            return
+
+        data_len = parse_content_length(data_len_hdr)
+        if data_len is None:
+            self.send_error(
+                HTTPStatus.BAD_REQUEST, f'Invalid Content-Length {data_len_hdr!r}'
+            )
+            return
+
+        if data_len > self._max_request_size:
+            # Don't read the body, send_error closes the connection.
+            self.send_error(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                f'Request body of {data_len} bytes exceeds {self._max_request_size} bytes',
+            )
+            return
+
+        # Read the body straight into a preallocated buffer.
+        data = bytearray(data_len)
+        view = memoryview(data)
+        read_len = 0
+        while read_len < data_len:
+            n = self.rfile.readinto(view[read_len:])
+            if not n:
                 break
-            data += chunk
-            remainingbytes -= len(chunk)
+            read_len += n
+
+        if read_len < data_len:
+            # The client went away before sending the whole body, don't pass a truncated image on.
+            self.send_error(
+                HTTPStatus.BAD_REQUEST,
+                f'Request body of {read_len} bytes is shorter than its Content-Length of {data_len} bytes',
+            )
+            return
 
         self.send_response(HTTPStatus.OK)
-        self.send_header('Connection', 'close')
+        self.send_header(Headers.CONTENT_LENGTH.value, '0')
         self.end_headers()
 
-        request = Request(
-            method='POST', url=self.path, headers=dict(self.headers), data=data
-        )
-        self._request_queue.queue(request)
+        # The whole buffer was read into, pass it on without copying it.
+        self._request_queue.queue(ServerRequest('POST', self.path, self.headers, view))
 
     def log_message(self, format: str, *args: Any) -> None:
         _logger.debug('%s - %s' % (self.address_string(), format % args))
 
     def log_error(self, format: str, *args: Any) -> None:
+        if format.startswith('Request timed out'):
+            # An idle keep-alive connection timed out, this is normal.
+            _logger.debug('%s - %s' % (self.address_string(), format % args))
+            return
         _logger.error('%s - %s' % (self.address_string(), format % args))
 
     def handle_expect_100(self):
@@ -102,43 +158,81 @@ else:
 
 
 class HttpAbortableServer(http.server.HTTPServer):
-    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True):
-        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+    """HTTPServer that handles connections concurrently in a bounded pool of request workers.
+
+    serve_forever() can be stopped from another thread with shutdown_trigger() without waiting for it. A socket pair
+    is registered with the selector next to the listening socket, so a shutdown wakes the serve loop up immediately
+    instead of being noticed at the next poll.
+
+    Connections beyond max_workers wait for a free worker. server_close() shuts down the open connections, so workers
+    waiting on idle keep-alive connections finish straight away instead of at the handler timeout.
+    """
+
+    def __init__(
+        self,
+        server_address,
+        RequestHandlerClass,
+        bind_and_activate=True,
+        max_workers: int = 8,
+        thread_name_prefix: str = '',
+    ):
+        # Created before binding, a failed bind calls server_close() before the base class __init__ returns.
         self._ab_is_shut_down = threading.Event()
         self._ab_shutdown_request = False
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._request_executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix=thread_name_prefix
+        )
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
 
     # We would like to tell the server to shutdown, but then wait for it in another area.
     # The default implementation is to trigger the shutdown and wait for it in the same call.
     def shutdown_trigger(self):
         self._ab_shutdown_request = True
+        try:
+            self._wakeup_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Either a wakeup is already pending or the server has been closed.
+            pass
+
+    def _clear_wakeup(self):
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
 
     def serve_forever(self, poll_interval=0.5):
-        """Handle one request at a time until shutdown.
+        """Handle requests until shutdown.
 
-        Polls for shutdown every poll_interval seconds. Ignores
-        self.timeout. If you need to do periodic tasks, do them in
-        another thread.
+        Wakes up immediately when shutdown_trigger() is called. With a poll_interval the select also times out every
+        poll_interval seconds to call service_actions(), None waits indefinitely. Ignores self.timeout.
         """
         self._ab_is_shut_down.clear()
         try:
-            # XXX: Consider using another file descriptor or connecting to the
-            # socket to wake this up instead of polling. Polling reduces our
-            # responsiveness to a shutdown request and wastes cpu at all other
-            # times.
             with _Selector() as selector:
                 selector.register(self, selectors.EVENT_READ)
+                selector.register(self._wakeup_reader, selectors.EVENT_READ)
 
                 while not self._ab_shutdown_request:
                     ready = selector.select(poll_interval)
                     # bpo-35017: shutdown() called during select(), exit immediately.
                     if self._ab_shutdown_request:
                         break
-                    if ready:
-                        self._handle_request_noblock()
+                    for key, _ in ready:
+                        if key.fileobj is self._wakeup_reader:
+                            self._clear_wakeup()
+                        else:
+                            self._handle_request_noblock()
 
                     self.service_actions()
         finally:
             self._ab_shutdown_request = False
+            self._clear_wakeup()
             self._ab_is_shut_down.set()
 
     def shutdown(self):
@@ -148,9 +242,40 @@ class HttpAbortableServer(http.server.HTTPServer):
         serve_forever() is running in another thread, or it will
         deadlock.
         """
-        self._ab_shutdown_request = True
+        self.shutdown_trigger()
         self._ab_is_shut_down.wait()
 
+    def process_request(self, request, client_address):
+        """Hand the connection to a request worker, keep-alive connections hold their worker until they close."""
+        with self._connections_lock:
+            self._connections.add(request)
+        self._request_executor.submit(
+            self._process_request_worker, request, client_address
+        )
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self._connections_lock:
+                self._connections.discard(request)
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._request_executor.shutdown(wait=False)
+        # Wake up the workers of open connections, they close them once they notice.
+        with self._connections_lock:
+            for request in self._connections:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
 
 class JpegReceiverTransportConnectionWorker(AbortableThread):
     def __init__(
@@ -158,6 +283,7 @@ class JpegReceiverTransportConnectionWorker(AbortableThread):
         connection_name: str,
         url: str,
         request_queue: RequestQueue,
+        state_machine: TransportStateMachine,
         config: dict = {},
     ):
         super().__init__(
@@ -167,29 +293,47 @@ class JpegReceiverTransportConnectionWorker(AbortableThread):
         self._connection_name = connection_name
         self._url = url
         self._config = config
-        self._state = TransportState.DISCONNECTED
-        self._desired_state = TransportState.DISCONNECTED
-        self._state_change_event = threading.Event()
+        self._state_machine = state_machine
         self._request_queue = request_queue
-        request_hander = partial(JpegReceiverRequestHandler, self._request_queue)
+        request_hander = partial(
+            JpegReceiverRequestHandler,
+            self._request_queue,
+            int(
+                config.get(
+                    JpegReceiverRequestHandler.MAX_REQUEST_SIZE,
+                    JpegReceiverRequestHandler.MAX_REQUEST_SIZE_DEFAULT,
+                )
+            ),
+        )
         self._http_server = HttpAbortableServer(
-            ('', urlparse(url).port), request_hander
+            ('', urlparse(url).port),
+            request_hander,
+            max_workers=int(
+                config.get(
+                    JpegReceiverRequestHandler.MAX_CONNECTIONS,
+                    JpegReceiverRequestHandler.MAX_CONNECTIONS_DEFAULT,
+                )
+            ),
+            thread_name_prefix=f'{connection_name} jpeg receiver request worker',
         )
+        # Aborting the thread stops the server, the stop token check in _connect() then ends the serve loop.
+        self.stop_token.add_callback(self._http_server.shutdown_trigger)
 
     def connect(self):
-        self._set_desired_state(TransportState.CONNECTED)
+        self._state_machine.request(TransportState.CONNECTED)
 
     def reconnect(self):
-        self._set_desired_state(TransportState.RECONNECTED)
+        self._state_machine.request(TransportState.RECONNECTED)
+        # Wake the server up so the worker sees the new desired state.
+        self._http_server.shutdown_trigger()
 
     def disconnect(self):
-        self._set_desired_state(TransportState.DISCONNECTED)
+        self._state_machine.request(TransportState.DISCONNECTED)
         self._disconnect()
 
-    def _set_desired_state(self, state: TransportState):
-        if self._desired_state != state:
-            self._desired_state = state
-            self._state_change_event.set()
+    @property
+    def state(self):
+        return self._state_machine.state
 
     def run(self):
 
@@ -197,17 +341,16 @@ class JpegReceiverTransportConnectionWorker(AbortableThread):
 
             while True:
                 try:
-                    if self._state_change_event.wait(self._get_blocking_timeout()):
-                        # Can't wait forever in blocking call, need to enter loop to check for control messages, specifically SystemExit.
-
-                        if self._desired_state == TransportState.CONNECTED:
-                            self._connect()
-                        elif self._desired_state == TransportState.DISCONNECTED:
-                            self._disconnect()
-                        elif self._desired_state == TransportState.RECONNECTED:
-                            self._reconnect()
+                    # _connect() serves until the desired state changes again. Aborting the thread wakes the wait up
+                    # with ThreadStopped.
+                    desired_state = self._state_machine.wait_for_request()
 
-                        self._state_change_event.clear()
+                    if desired_state == TransportState.CONNECTED:
+                        self._connect()
+                    elif desired_state == TransportState.DISCONNECTED:
+                        self._disconnect()
+                    elif desired_state == TransportState.RECONNECTED:
+                        self._reconnect()
 
                 except Exception:
                     # Send all other exceptions to the log so we can analyse them to determine if
@@ -220,26 +363,33 @@ class JpegReceiverTransportConnectionWorker(AbortableThread):
         finally:
             try:
                 self._disconnect()
+                self._http_server.server_close()
             except Exception:
                 _logger.exception(None)
                 raise
 
     def _connect(self):
+        self._state_machine.set_state(TransportState.CONNECTED)
         try:
-            self._http_server.serve_forever(self._get_blocking_timeout())
+            # A stale shutdown trigger from an earlier disconnect ends serve_forever straight away, so keep serving
+            # until the desired state actually changes.
+            while self._state_machine.desired_state == TransportState.CONNECTED:
+                self.stop_token.check()
+                self._http_server.serve_forever(None)
         except KeyboardInterrupt:
             _logger.exception(None)
             raise
         except Exception:
             _logger.exception(None)
             raise
+        finally:
+            self._state_machine.set_state(TransportState.DISCONNECTED)
 
     def _disconnect(self):
         self._http_server.shutdown_trigger()
 
     def _reconnect(self):
-        self._http_server.shutdown()
-        time.sleep(self._get_blocking_timeout())
+        self._state_machine.desired_state = TransportState.CONNECTED
         self._connect()
 
 
@@ -254,22 +404,21 @@ class JpegReceiverServerTransport(Transport):
         config: dict = {},
     ):
         super().__init__(connection_name, url, config)
-        self._poll_timeout = config.get(
-            AbortableThread.THREAD_BLOCKING_TIMEOUT,
-            AbortableThread.THREAD_BLOCKING_TIMEOUT_DEFAULT,
-        )
         self._message_reader = message_reader
-        self._request_queue = RequestQueue()
+        self._request_queue = RequestQueue(
+            config.get('request_queue_maxsize', 0),
+            config.get('request_queue_full_policy', QueueFullPolicy.DROP_OLDEST),
+        )
         self._connection_worker = JpegReceiverTransportConnectionWorker(
-            connection_name, url, self._request_queue, config
+            connection_name, url, self._request_queue, self._state_machine, config
         )
 
     def send(self, msg: Any):
         raise NotImplementedError
 
-    def receive(self) -> Request:
+    def receive(self) -> ServerRequest:
         try:
-            request = self._request_queue.fetch(self._poll_timeout)
+            request = self._request_queue.fetch()
             if request:
                 return self._message_reader.read_request(request)
         except TimeoutError:
@@ -302,6 +451,172 @@ class JpegReceiverServerTransport(Transport):
         self._connection_worker.join()
 
 
+class AsyncJpegReceiverServerTransport(AsyncTransport):
+    """Http server transport for the asyncio execution mode.
+
+    Serves image posts with asyncio streams on the event loop. Each client connection is handled by its own task and
+    HTTP/1.1 keep-alive is supported, so a camera can post a stream of images over a single connection.
+    """
+
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        message_reader: JpegReceiverMessageRequestReader,
+        loop: asyncio.AbstractEventLoop,
+        config: dict = {},
+    ):
+        super().__init__(connection_name, url, loop, config)
+        self._message_reader = message_reader
+        self._server = None
+        self._server_task = None
+        # Set while requests are read, created on the loop the first time reading is paused.
+        self._reading = None
+        self._keep_alive_timeout = JpegReceiverRequestHandler.timeout
+        self._max_request_size = int(
+            config.get(
+                JpegReceiverRequestHandler.MAX_REQUEST_SIZE,
+                JpegReceiverRequestHandler.MAX_REQUEST_SIZE_DEFAULT,
+            )
+        )
+
+    def _connect(self):
+        self._desired_state = TransportState.CONNECTED
+        if self._server is None and self._server_task is None:
+            self._set_state(TransportState.CONNECTING)
+            self._server_task = self._loop.create_task(self._start_server())
+
+    async def _start_server(self):
+        try:
+            self._server = await asyncio.start_server(
+                self._handle_client, port=urlparse(self._url).port
+            )
+            self._set_state(TransportState.CONNECTED)
+        except Exception:
+            _logger.exception(None)
+            self._set_state(TransportState.DISCONNECTED)
+        finally:
+            self._server_task = None
+
+    def _disconnect(self):
+        self._desired_state = TransportState.DISCONNECTED
+        if self._server:
+            self._set_state(TransportState.DISCONNECTING)
+            self._server.close()
+            self._server = None
+            self._set_state(TransportState.DISCONNECTED)
+
+    def _reconnect(self):
+        self._disconnect()
+        self._connect()
+
+    def send(self, msg: Any):
+        raise NotImplementedError
+
+    def pause_reading(self):
+        if self._reading is None:
+            self._reading = asyncio.Event()
+        self._reading.clear()
+
+    def resume_reading(self):
+        if self._reading is not None:
+            self._reading.set()
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            keep_alive = True
+            while keep_alive:
+                if self._reading is not None:
+                    # Clients wait while the incoming queue is full, they are held back by TCP flow control.
+                    await self._reading.wait()
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b'\r\n\r\n'), self._keep_alive_timeout
+                    )
+                except (
+                    asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError,
+                    asyncio.TimeoutError,
+                ):
+                    break
+
+                request_line, *header_lines = head.decode('iso-8859-1').split('\r\n')
+                method, path, version = request_line.split(' ', 2)
+                headers = CaseInsensitiveDict()
+                for line in header_lines:
+                    if line:
+                        name, _, value = line.partition(':')
+                        headers[name.strip()] = value.strip()
+
+                data_len = parse_content_length(
+                    headers.get(Headers.CONTENT_LENGTH.value, '0')
+                )
+                if data_len is None:
+                    _logger.error(
+                        f'Invalid Content-Length {headers[Headers.CONTENT_LENGTH.value]!r}'
+                    )
+                    writer.write(
+                        b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n'
+                        b'Connection: close\r\n\r\n'
+                    )
+                    await writer.drain()
+                    break
+
+                if data_len > self._max_request_size:
+                    # Don't read the body, just refuse it and close the connection.
+                    _logger.error(
+                        f'Request body of {data_len} bytes exceeds {self._max_request_size} bytes'
+                    )
+                    writer.write(
+                        b'HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\n'
+                        b'Connection: close\r\n\r\n'
+                    )
+                    await writer.drain()
+                    break
+
+                if headers.get('expect', '').lower() == '100-continue':
+                    writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+                try:
+                    data = await reader.readexactly(data_len)
+                except asyncio.IncompleteReadError as e:
+                    # The client stopped sending before the end of the body, refuse the truncated image.
+                    _logger.error(
+                        f'Request body of {len(e.partial)} bytes is shorter than its Content-Length of {data_len} bytes'
+                    )
+                    writer.write(
+                        b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n'
+                        b'Connection: close\r\n\r\n'
+                    )
+                    await writer.drain()
+                    break
+
+                keep_alive = (
+                    version == 'HTTP/1.1'
+                    and headers.get('connection', '').lower() != 'close'
+                )
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n'
+                    + (b'' if keep_alive else b'Connection: close\r\n')
+                    + b'\r\n'
+                )
+                await writer.drain()
+
+                if method == RequestVerb.POST.value:
+                    request = ServerRequest(method, path, headers, data)
+                    self._received(self._message_reader.read_request(request))
+
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            # Client went away or the server is shutting down.
+            pass
+        except Exception:
+            _logger.exception(None)
+        finally:
+            writer.close()
+
+
 @register_message('jpeg_receiver_image_post_request', 'jpeg_receiver')
 class JpegReceiverImagePostRequestMessage(FileServerRequestMessage):
     def __init__(self, request):
@@ -342,3 +657,28 @@ class JpegReceiverServerConnection(ConnectionBase):
             JpegReceiverServerMessageFactory(),
             config,
         )
+
+
+@register_connection('jpeg_receiver', ExecutionMode.ASYNCIO)
+class AsyncJpegReceiverServerConnection(AsyncConnectionBase):
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        incoming_message_queue: IncomingMessageQueue,
+        outgoing_message_queue: OutgoingMessageQueue,
+        loop: asyncio.AbstractEventLoop,
+        config: dict = {},
+    ):
+        super().__init__(
+            connection_name,
+            url,
+            AsyncJpegReceiverServerTransport(
+                connection_name, url, JpegReceiverMessageRequestReader(), loop, config
+            ),
+            incoming_message_queue,
+            outgoing_message_queue,
+            JpegReceiverServerMessageFactory(),
+            loop,
+            config,
+        )
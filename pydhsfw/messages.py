@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
-from threading import Event
+import asyncio
+from threading import Condition, Lock
 from collections import deque
+from enum import Enum
 from typing import Any, TypeVar, Generic
+from pydhsfw.threads import call_soon, running_on, wait_for
 
 
 class MessageIn:
@@ -75,28 +78,68 @@ def register_message(msg_type_id: str, factory_name: str = None):
     return decorator_register_message
 
 
+class MessageCodec:
+    """Reads raw messages for a MessageFactory.
+
+    The factory keeps its message classes in a map keyed by key(type_id) and looks up every raw message by the key
+    read_key() returns, so a codec can drop messages it has no class for without decoding them. Only messages with a
+    registered class are passed on to decode().
+    """
+
+    def key(self, type_id: str) -> Any:
+        """The class map key for a message type id, e.g. the type id encoded to bytes."""
+        return type_id
+
+    def read_key(self, raw_msg: Any, max_key_len: int) -> Any:
+        """Read the class map key from a raw message.
+
+        max_key_len - Length of the longest registered key, anything longer is unknown and needn't be read in full.
+        """
+        return NotImplemented
+
+    def decode(self, msg_cls: MessageIn, raw_msg: Any) -> MessageIn:
+        return msg_cls.parse(raw_msg)
+
+
 class MessageFactory:
-    def __init__(self, name: str = None):
+    """Converts raw messages into instances of the MessageIn classes registered with the factory's name.
+
+    Subclasses either implement _parse_type_id() or pass a MessageCodec. Raw messages with a type id the factory has
+    no class for are counted in unknown_type_ids and dropped.
+    """
+
+    def __init__(self, name: str = None, codec: MessageCodec = None):
         self._name = name
+        self._codec = codec
         self._msg_map = {}
+        self._max_key_len = 0
+        self._unknown_type_ids = {}
         self._register_messages()
 
     def _get_msg_cls(self, type_id):
         return self._msg_map.get(type_id)
 
     def _register_message(self, msg_cls: MessageIn):
-        self._msg_map[msg_cls.get_type_id()] = msg_cls
+        key = msg_cls.get_type_id()
+        if self._codec is not None:
+            key = self._codec.key(key)
+            self._max_key_len = max(self._max_key_len, len(key))
+        self._msg_map[key] = msg_cls
 
     def _register_messages(self):
         for msg_cls in MessageRegistry._get_factory_messages(self.name):
             if issubclass(msg_cls, MessageIn):
                 self._register_message(msg_cls)
 
+    def _unknown_message(self, type_id):
+        self._unknown_type_ids[type_id] = self._unknown_type_ids.get(type_id, 0) + 1
+
     def _create_message(self, type_id, raw_msg: Any):
 
         msg_cls = self._get_msg_cls(type_id)
         if msg_cls:
             return msg_cls.parse(raw_msg)
+        self._unknown_message(type_id)
 
     def _parse_type_id(self, raw_msg: Any) -> Any:
         return NotImplemented
@@ -105,8 +148,30 @@ class MessageFactory:
     def name(self):
         return self._name
 
+    @property
+    def codec(self) -> MessageCodec:
+        return self._codec
+
+    @property
+    def unknown_type_ids(self) -> dict:
+        """Number of dropped messages by type id, or by codec key when the factory has a codec."""
+        return dict(self._unknown_type_ids)
+
+    @property
+    def unknown_message_count(self) -> int:
+        return sum(self._unknown_type_ids.values())
+
     def create_message(self, raw_msg: bytes) -> MessageIn:
-        """Convert a raw message to a MessageIn subclass"""
+        """Convert a raw message to a MessageIn subclass, None if the factory has no class for its type id."""
+
+        codec = self._codec
+        if codec is not None:
+            key = codec.read_key(raw_msg, self._max_key_len)
+            msg_cls = self._msg_map.get(key)
+            if msg_cls is None:
+                self._unknown_message(key)
+                return None
+            return codec.decode(msg_cls, raw_msg)
 
         type_id = self._parse_type_id(raw_msg)
         return self._create_message(type_id, raw_msg)
@@ -115,57 +180,235 @@ class MessageFactory:
 T = TypeVar('T')
 
 
+class QueueFullPolicy(Enum):
+    """What a bounded queue does when an item is queued and the queue is full.
+
+    BLOCK - Wait for a consumer to make room, raise TimeoutError if the timeout expires first.
+    DROP_OLDEST - Discard the oldest queued item to make room for the new one.
+    DROP_NEWEST - Discard the new item and keep the queued ones.
+    RAISE - Raise QueueFullError immediately.
+    """
+
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    RAISE = 'raise'
+
+
+class QueueFullError(Exception):
+    """Raised when queueing to a full queue that uses the QueueFullPolicy.RAISE policy."""
+
+    pass
+
+
 class Queue(Generic[T]):
     def __init__(self):
-        pass
+        # The Metrics instance that connections using this queue report to, None when metrics are disabled.
+        self.metrics = None
 
-    def queue(self, item: T):
+    def queue(self, item: T, timeout=None):
         pass
 
     def fetch(self, timeout=None) -> T:
         pass
 
+    def fetch_many(self, max_items: int, timeout=None) -> list:
+        pass
+
+    def qsize(self) -> int:
+        pass
+
     def clear(self):
         pass
 
+    def next_ready_time(self) -> float:
+        """The time.monotonic() time at which items that are being held back become available to fetch.
+
+        None if no items are held back. Consumers that poll without blocking use this to schedule their next poll.
+        """
+        return None
+
 
 class BlockingQueue(Queue[T]):
-    def __init__(self):
+    """Thread safe FIFO queue that blocks consumers until items are available.
+
+    maxsize - Maximum number of queued items, 0 or None for an unbounded queue.
+
+    full_policy - QueueFullPolicy (or its string value) that is applied when queueing to a full queue.
+
+    Blocking calls made from an AbortableThread raise ThreadStopped as soon as the thread is aborted, so threads can
+    wait without a timeout.
+    """
+
+    def __init__(
+        self, maxsize: int = 0, full_policy: QueueFullPolicy = QueueFullPolicy.BLOCK
+    ):
         super().__init__()
         self._deque = deque()
-        self._deque_event = Event()
-
-    def queue(self, item: T):
-        # Append message and unblock
-        self._deque.append(item)
-        self._deque_event.set()
+        self._maxsize = int(maxsize or 0)
+        self._full_policy = QueueFullPolicy(full_policy)
+        self._lock = Lock()
+        self._not_empty = Condition(self._lock)
+        self._not_full = Condition(self._lock)
+
+    def _is_full(self) -> bool:
+        return 0 < self._maxsize <= len(self._deque)
+
+    def queue(self, item: T, timeout=None):
+        with self._not_full:
+            if self._is_full():
+                if self._full_policy == QueueFullPolicy.DROP_OLDEST:
+                    self._get()
+                elif self._full_policy == QueueFullPolicy.DROP_NEWEST:
+                    return
+                elif self._full_policy == QueueFullPolicy.RAISE:
+                    raise QueueFullError
+                elif not wait_for(self._not_full, lambda: not self._is_full(), timeout):
+                    raise TimeoutError
+
+            # Append message and unblock one consumer
+            self._put(item)
+            self._not_empty.notify()
 
     def fetch(self, timeout=None) -> T:
 
-        item = None
+        with self._not_empty:
+            # Block until items are available
+            if not self._wait_not_empty(timeout):
+                raise TimeoutError
 
-        # Block until items are available
-        if not self._deque_event.wait(timeout):
-            raise TimeoutError
+            item = self._get()
+            self._not_full.notify()
+            return item
 
-        elif self._deque:
-            item = self._deque.popleft()
+    def fetch_many(self, max_items: int, timeout=None) -> list:
+        """Block until at least one item is available then return up to max_items items in queue order."""
 
-        # If there are no more items, start blocking again
-        if not self._deque:
-            self._deque_event.clear()
-        return item
+        with self._not_empty:
+            if not self._wait_not_empty(timeout):
+                raise TimeoutError
+
+            count = min(max_items, len(self._deque))
+            items = [self._get() for _ in range(count)]
+            self._not_full.notify(count)
+            return items
+
+    # Derived queues can override these to change how items are stored, they are always called with the lock held.
+    def _put(self, item: T):
+        self._deque.append(item)
+
+    def _get(self) -> T:
+        return self._deque.popleft()
+
+    def _wait_not_empty(self, timeout) -> bool:
+        return wait_for(self._not_empty, lambda: self._deque, timeout)
+
+    def qsize(self) -> int:
+        return len(self._deque)
 
     def clear(self):
-        self._deque_event.clear()
-        self._deque.clear()
+        with self._lock:
+            self._deque.clear()
+            self._not_full.notify_all()
 
 
 class IncomingMessageQueue(BlockingQueue[MessageIn]):
-    def __init__(self):
-        super().__init__()
+    def __init__(
+        self, maxsize: int = 0, full_policy: QueueFullPolicy = QueueFullPolicy.BLOCK
+    ):
+        super().__init__(maxsize, full_policy)
 
 
 class OutgoingMessageQueue(BlockingQueue[MessageOut]):
-    def __init__(self):
-        super().__init__()
+    def __init__(
+        self, maxsize: int = 0, full_policy: QueueFullPolicy = QueueFullPolicy.BLOCK
+    ):
+        super().__init__(maxsize, full_policy)
+
+
+class AsyncIncomingMessageQueue(IncomingMessageQueue):
+    """Incoming message queue that can also be consumed by a coroutine on an asyncio event loop.
+
+    Producers can still queue from any thread, each queue() call wakes the consuming coroutine on the loop.
+
+    The consumer runs on the loop, so with the BLOCK policy a queue() call made on the loop thread never waits for
+    room, that would stop the consumer for good. It raises TimeoutError when the queue is full instead, the producer
+    can await wait_not_full_async() and try again, see AsyncConnectionBase. Producers on other threads block as usual.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        maxsize: int = 0,
+        full_policy: QueueFullPolicy = QueueFullPolicy.BLOCK,
+    ):
+        super().__init__(maxsize, full_policy)
+        self._loop = loop
+        self._ready_event = None
+        self._not_full_event = None
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def _set_ready(self):
+        if self._ready_event:
+            self._ready_event.set()
+
+    def _set_not_full(self):
+        if self._not_full_event:
+            self._not_full_event.set()
+
+    def queue(self, item: MessageIn, timeout=None):
+        if self._full_policy == QueueFullPolicy.BLOCK and running_on(self._loop):
+            timeout = 0
+        super().queue(item, timeout)
+        if not self._loop.is_closed():
+            call_soon(self._loop, self._set_ready)
+
+    def fetch(self, timeout=None) -> MessageIn:
+        item = super().fetch(timeout)
+        self._wake_not_full()
+        return item
+
+    def fetch_many(self, max_items: int, timeout=None) -> list:
+        items = super().fetch_many(max_items, timeout)
+        self._wake_not_full()
+        return items
+
+    def clear(self):
+        super().clear()
+        self._wake_not_full()
+
+    def _wake_not_full(self):
+        if self._not_full_event is not None and not self._loop.is_closed():
+            call_soon(self._loop, self._set_not_full)
+
+    async def wait_not_full_async(self):
+        """Wait on the event loop until the queue has room."""
+
+        if self._not_full_event is None:
+            self._not_full_event = asyncio.Event()
+
+        while self._is_full():
+            self._not_full_event.clear()
+            # Room may have been made before the clear, check again before waiting.
+            if self._is_full():
+                await self._not_full_event.wait()
+
+    async def fetch_many_async(self, max_items: int) -> list:
+        """Wait on the event loop until at least one item is available then return up to max_items items."""
+
+        if self._ready_event is None:
+            self._ready_event = asyncio.Event()
+
+        while True:
+            try:
+                return self.fetch_many(max_items, 0)
+            except TimeoutError:
+                pass
+
+            self._ready_event.clear()
+            # An item may have been queued before the clear, check again before waiting.
+            if not self.qsize():
+                await self._ready_event.wait()
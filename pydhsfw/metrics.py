@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from typing import Any
+
+_logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """Latency histogram in seconds with fixed 1-2-5 buckets from 1 microsecond to 10 seconds.
+
+    Percentiles are estimated as the upper bound of the bucket the percentile falls in, capped at the largest value
+    observed.
+    """
+
+    BUCKETS = tuple(
+        m * 10.0 ** e for e in range(-6, 2) for m in (1, 2, 5) if m * 10.0 ** e <= 10
+    )
+
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        # The last count is for values larger than the last bucket.
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p: float) -> float:
+        if not self.count:
+            return None
+
+        rank = p * self.count
+        cumulative = 0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else None
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.mean,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': {
+                str(bound): count
+                for bound, count in zip(self.BUCKETS + ('inf',), self.counts)
+                if count
+            },
+        }
+
+
+class Metrics:
+    """Latency histograms, counters and gauges for the DHS message pipeline.
+
+    Every message that goes through the pipeline is timed at each stage and the latency is recorded in a histogram per
+    stage and message type id:
+
+    transport_read - Time spent in Transport.receive() for calls that return a message. This includes waiting for the
+    peer to send the message, so on a quiet connection it mostly measures idle time. Not recorded for asyncio
+    transports, they push messages as they arrive.
+
+    factory_create - Time the message factory takes to turn the raw message into a message.
+
+    incoming_queue_wait - Time from queueing the message on the incoming queue until its first handler starts,
+    including any routing to named dispatchers and their worker pools.
+
+    handler - Time each handler takes to run. Handlers that take longer than handler_deadline seconds are counted in
+    the handler_deadline_exceeded counter and logged.
+
+    outgoing_queue_wait - Time from Connection.send() until the write worker takes the message off the outgoing
+    queue, this includes any time motor updates are held back by rate limiting.
+
+    transport_write - Time to serialize and write the message. Messages written in a batch share the batch time
+    equally.
+
+    Gauges are functions, e.g. a queue's qsize, that are only called when a snapshot is taken.
+
+    The Dhs creates an instance from its config and it's available from DhsContext.metrics. When metrics are disabled,
+    which is the default, the pipeline doesn't call into this class at all. Enable them in the Dhs config with
+    metrics_enabled.
+    """
+
+    METRICS_ENABLED = 'metrics_enabled'
+    METRICS_ENABLED_DEFAULT = False
+    HANDLER_DEADLINE = 'handler_deadline'
+    HANDLER_DEADLINE_DEFAULT = 1.0
+
+    TRANSPORT_READ = 'transport_read'
+    FACTORY_CREATE = 'factory_create'
+    INCOMING_QUEUE_WAIT = 'incoming_queue_wait'
+    HANDLER = 'handler'
+    OUTGOING_QUEUE_WAIT = 'outgoing_queue_wait'
+    TRANSPORT_WRITE = 'transport_write'
+    STAGES = (
+        TRANSPORT_READ,
+        FACTORY_CREATE,
+        INCOMING_QUEUE_WAIT,
+        HANDLER,
+        OUTGOING_QUEUE_WAIT,
+        TRANSPORT_WRITE,
+    )
+
+    MESSAGES_RECEIVED = 'messages_received'
+    MESSAGES_UNKNOWN = 'messages_unknown'
+    MESSAGES_HANDLED = 'messages_handled'
+    MESSAGES_SENT = 'messages_sent'
+    HANDLER_ERRORS = 'handler_errors'
+    HANDLER_DEADLINE_EXCEEDED = 'handler_deadline_exceeded'
+
+    def __init__(self, config: dict = {}):
+        self._enabled = bool(
+            config.get(self.METRICS_ENABLED, self.METRICS_ENABLED_DEFAULT)
+        )
+        self._handler_deadline = float(
+            config.get(self.HANDLER_DEADLINE, self.HANDLER_DEADLINE_DEFAULT)
+        )
+        self._lock = Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._start_time = perf_counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @property
+    def handler_deadline(self) -> float:
+        return self._handler_deadline
+
+    def observe(self, stage: str, type_id: Any, seconds: float):
+        """Record the latency of a pipeline stage for a message type."""
+
+        key = (stage, type_id)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name: str, type_id: Any = None, count: int = 1):
+        key = (name, type_id)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + count
+
+    def register_gauge(self, name: str, func):
+        """Register a function that returns the current value of the gauge, e.g. a queue's qsize method."""
+        self._gauges[name] = func
+
+    def unregister_gauge(self, name: str):
+        self._gauges.pop(name, None)
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+            self._start_time = perf_counter()
+
+    def get_histogram(self, stage: str, type_id: Any) -> Histogram:
+        return self._histograms.get((stage, type_id))
+
+    def get_counter(self, name: str, type_id: Any = None) -> int:
+        return self._counters.get((name, type_id), 0)
+
+    # Pipeline hooks, these are only called when metrics are enabled.
+
+    def message_received(self, msg, read_start: float, read_end: float):
+        """Called once the factory has created msg from a raw message that was read between read_start and read_end.
+
+        read_start is None when the read wasn't timed.
+        """
+
+        now = perf_counter()
+        if msg is None:
+            self.increment(self.MESSAGES_UNKNOWN)
+            return
+
+        type_id = msg.get_type_id()
+        if read_start is not None:
+            self.observe(self.TRANSPORT_READ, type_id, read_end - read_start)
+        self.observe(self.FACTORY_CREATE, type_id, now - read_end)
+        self.increment(self.MESSAGES_RECEIVED, type_id)
+        stamp_message(msg, now)
+
+    def handler_started(self, msg) -> float:
+        """Called when a handler starts, returns the start time to pass to handler_finished."""
+
+        now = perf_counter()
+        queued = take_message_stamp(msg)
+        if queued is not None:
+            self.observe(self.INCOMING_QUEUE_WAIT, msg.get_type_id(), now - queued)
+        return now
+
+    def handler_finished(self, msg, start: float, failed: bool = False) -> float:
+        """Called when a handler has finished, returns how long it ran."""
+
+        elapsed = perf_counter() - start
+        type_id = msg.get_type_id()
+        self.observe(self.HANDLER, type_id, elapsed)
+        self.increment(
+            self.HANDLER_ERRORS if failed else self.MESSAGES_HANDLED, type_id
+        )
+        if elapsed > self._handler_deadline:
+            self.increment(self.HANDLER_DEADLINE_EXCEEDED, type_id)
+        return elapsed
+
+    def messages_sent(self, msgs: list, fetch_time: float):
+        """Called after msgs, which were fetched from an outgoing queue at fetch_time, have been written."""
+
+        now = perf_counter()
+        write_time = (now - fetch_time) / len(msgs) if msgs else 0.0
+        for msg in msgs:
+            type_id = msg.get_type_id()
+            queued = take_message_stamp(msg)
+            if queued is not None:
+                self.observe(self.OUTGOING_QUEUE_WAIT, type_id, fetch_time - queued)
+            self.observe(self.TRANSPORT_WRITE, type_id, write_time)
+            self.increment(self.MESSAGES_SENT, type_id)
+
+    # Reporting
+
+    def snapshot(self) -> dict:
+        """Returns a copy of all the metrics as a dictionary of plain types that can be serialized to JSON."""
+
+        with self._lock:
+            histograms = sorted(
+                self._histograms.items(), key=lambda i: (i[0][0], str(i[0][1]))
+            )
+            counters = sorted(
+                self._counters.items(), key=lambda i: (i[0][0], str(i[0][1]))
+            )
+            stages = {}
+            for (stage, type_id), histogram in histograms:
+                stages.setdefault(stage, {})[str(type_id)] = histogram.to_dict()
+            counter_values = {}
+            for (name, type_id), value in counters:
+                if type_id is None:
+                    counter_values.setdefault(name, {})['total'] = value
+                else:
+                    counter_values.setdefault(name, {})[str(type_id)] = value
+            elapsed = perf_counter() - self._start_time
+
+        gauges = {}
+        for name, func in list(self._gauges.items()):
+            try:
+                gauges[name] = func()
+            except Exception:
+                _logger.exception(f'Failed to read gauge {name}')
+
+        return {
+            'enabled': self._enabled,
+            'elapsed': elapsed,
+            'stages': stages,
+            'counters': counter_values,
+            'gauges': gauges,
+        }
+
+    def to_json(self, **kwargs) -> str:
+        """Returns the snapshot as JSON, kwargs are passed to json.dumps."""
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_text(self) -> str:
+        """Returns the snapshot as a human readable table with latencies in milliseconds."""
+
+        snapshot = self.snapshot()
+        lines = [
+            f'Metrics {"enabled" if snapshot["enabled"] else "disabled"}, collected over {snapshot["elapsed"]:.1f}s'
+        ]
+
+        lines.append(
+            f'{"stage":<20} {"type_id":<36} {"count":>9} {"mean ms":>9} {"p50 ms":>9} {"p99 ms":>9} {"max ms":>9}'
+        )
+        for stage in sorted(
+            snapshot['stages'],
+            key=lambda s: self.STAGES.index(s)
+            if s in self.STAGES
+            else len(self.STAGES),
+        ):
+            for type_id, h in snapshot['stages'][stage].items():
+                lines.append(
+                    f'{stage:<20} {type_id:<36} {h["count"]:>9} {h["mean"] * 1e3:>9.3f} {h["p50"] * 1e3:>9.3f} '
+                    f'{h["p99"] * 1e3:>9.3f} {h["max"] * 1e3:>9.3f}'
+                )
+
+        for name, values in snapshot['counters'].items():
+            for type_id, value in values.items():
+                lines.append(f'counter {name:<28} {type_id:<36} {value:>9}')
+
+        for name, value in snapshot['gauges'].items():
+            lines.append(f'gauge {name:<66} {value:>9}')
+
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.to_text()
+
+
+_STAMP = '_metrics_time'
+
+
+def stamp_message(msg, timestamp: float = None):
+    """Record the time a message was queued, take_message_stamp returns it when the message is taken off a queue."""
+
+    try:
+        setattr(msg, _STAMP, perf_counter() if timestamp is None else timestamp)
+    except AttributeError:
+        # Messages with __slots__ can't be stamped, they just aren't timed while queued.
+        pass
+
+
+def take_message_stamp(msg) -> float:
+    """Return and clear the time the message was queued, None if it wasn't stamped."""
+
+    return getattr(msg, '__dict__', {}).pop(_STAMP, None)
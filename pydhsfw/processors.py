@@ -1,9 +1,24 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
-from inspect import isfunction, signature, getsourcelines, getmodule
+from functools import partial
+from inspect import (
+    iscoroutinefunction,
+    isclass,
+    signature,
+    getsourcelines,
+    getmodule,
+    unwrap,
+)
 from pydhsfw.threads import AbortableThread
-from pydhsfw.messages import IncomingMessageQueue, MessageIn
+from pydhsfw.messages import (
+    AsyncIncomingMessageQueue,
+    IncomingMessageQueue,
+    MessageIn,
+    MessageRegistry,
+)
 from pydhsfw.connection import Connection
+from pydhsfw.metrics import Metrics
 
 _logger = logging.getLogger(__name__)
 
@@ -16,6 +31,53 @@ class Context:
         pass
 
 
+def _check_handler_signature(handler, message_type: type, context_type: type):
+    """Raise a TypeError if the handler can't be called as handler(message, context).
+
+    Any callable is accepted, plain and coroutine functions, bound methods, functools.partial objects, etc.
+    """
+
+    if not callable(handler):
+        raise TypeError('handler_function must be callable')
+
+    hf_sig = signature(handler)
+    msg_param = hf_sig.parameters.get('message')
+    if (
+        msg_param is None
+        or not isclass(msg_param.annotation)
+        or not issubclass(msg_param.annotation, message_type)
+    ):
+        raise TypeError(
+            f'The handler_function must have a named parameter "message" that is of type {message_type.__name__}'
+        )
+
+    ctx_param = hf_sig.parameters.get('context')
+    if (
+        ctx_param is None
+        or not isclass(ctx_param.annotation)
+        or not issubclass(ctx_param.annotation, context_type)
+    ):
+        raise TypeError(
+            f'The handler_function must have a named parameter "context" that is of type {context_type.__name__}'
+        )
+
+
+def _describe_handler(handler) -> str:
+    """Returns module:name():lineno for logging a handler, works for partials and bound methods too."""
+
+    func = handler
+    while isinstance(func, partial):
+        func = func.func
+    func = unwrap(getattr(func, '__func__', func))
+    name = getattr(func, '__qualname__', repr(func))
+    module = getmodule(func)
+    try:
+        lineno = getsourcelines(func)[1]
+    except (OSError, TypeError):
+        lineno = '?'
+    return f'{module.__name__ if module else "?"}:{name}():{lineno}'
+
+
 class MessageHandlerRegistry:
 
     _default_processor_name = 'default'
@@ -28,26 +90,15 @@ class MessageHandlerRegistry:
         if not processor_name:
             processor_name = cls._default_processor_name
 
-        if not isfunction(msg_handler_function):
-            raise TypeError('handler_function must be a function')
-
-        hf_sig = signature(msg_handler_function)
-        msg_param = hf_sig.parameters.get('message')
-        if not issubclass(msg_param.annotation, MessageIn):
-            raise TypeError(
-                'The handler_function must have a named parameter "message" that is of type MessageIn'
-            )
-
-        ctx_param = hf_sig.parameters.get('context')
-        if not issubclass(ctx_param.annotation, Context):
-            raise TypeError(
-                'The handler_function must have a named parameter "context" that is of type Context'
-            )
+        _check_handler_signature(msg_handler_function, MessageIn, Context)
 
         if cls._registry.get(processor_name) is None:
             cls._registry[processor_name] = dict()
 
-        cls._registry[processor_name][msg_type_id] = msg_handler_function
+        # Several handlers can be registered for the same message type, they are called in registration order.
+        cls._registry[processor_name].setdefault(msg_type_id, []).append(
+            msg_handler_function
+        )
 
     @classmethod
     def _get_message_handlers(cls, processor_name: str = None):
@@ -56,20 +107,82 @@ class MessageHandlerRegistry:
         return cls._registry.get(processor_name, {})
 
 
+class DispatcherRegistry:
+
+    _registry = {}
+
+    @classmethod
+    def _register_dispatcher(cls, dispatcher_name: str, **settings):
+        cls._registry[dispatcher_name] = settings
+
+    @classmethod
+    def _get_dispatcher_settings(cls, dispatcher_name: str) -> dict:
+        return cls._registry.get(dispatcher_name, {})
+
+    @classmethod
+    def _get_dispatcher_names(cls):
+        return set(cls._registry.keys())
+
+
+def register_dispatcher(
+    dispatcher_name: str,
+    workers: int = 0,
+    key=None,
+    priority_type_ids: tuple = (),
+):
+    """Configures how a named message dispatcher runs its handlers.
+
+    dispatcher_name - Name used with register_message_handler and register_dcss_start_operation_handler.
+
+    workers - Number of worker threads. With 0 handlers run on the dispatcher's own thread. Otherwise each
+    message is handed to one of the workers and the dispatcher's own thread only routes messages.
+
+    key - Function that takes a message and returns a hashable key. Messages with the same key always go to the
+    same worker so they are handled in order, messages with different keys may be handled concurrently.
+    Defaults to a single key for all messages.
+
+    priority_type_ids - Message type ids that bypass the worker pool and are handled straight away on the
+    dispatcher's own thread, e.g. stoh_abort_all, so they are not stuck behind long running handlers.
+
+    Dispatcher names used by handler registrations that are never configured here get a dispatcher with no
+    worker pool.
+
+    To run DCSS operations concurrently while keeping each operation's messages in order:
+
+    register_dispatcher('operations', workers=4, key=dcss_message_key, priority_type_ids=('stoh_abort_all',))
+
+    """
+
+    DispatcherRegistry._register_dispatcher(
+        dispatcher_name,
+        workers=workers,
+        key=key,
+        priority_type_ids=tuple(priority_type_ids),
+    )
+
+
 def register_message_handler(msg_type_id: str, dispatcher_name: str = None):
     """Registers a function to handle message instances of the specified type id.
 
     msg_type_id - This message handler will receive all messages that are of this message type.
 
     dispatcher_name - Name of the message dispatcher that will be routing the messages to the handler.
-    Each message dispatcher will run in it's own thread and in the future there may be a requirement
-    to have multiple dispatchers. For now, there is only one dispatcher, so leave this blank or set
-    it to None.
+    Leave this blank or set it to None to use the default dispatcher. Each named dispatcher runs in its own
+    thread(s) so slow handlers registered with it don't hold up messages in other dispatchers. Use
+    register_dispatcher to give a dispatcher a worker pool.
 
     The function signature must match:
 
     def handler(message:MessageIn, context:Context)
 
+    Several handlers may be registered for the same message type id, each one receives every message. Any callable with
+    this signature can be registered by calling the decorator directly, e.g. register_message_handler('dhs_start')(obj.on_start)
+    for a bound method or a functools.partial.
+
+    Handlers may also be coroutine functions, async def handler(message:MessageIn, context:Context). In the asyncio
+    execution mode they are scheduled as tasks on the DHS event loop, in the threaded mode the dispatcher runs them to
+    completion before processing the next message.
+
     To register a dcss server to client send client type message:
 
     @register_message_handler('stoc_send_client_type')
@@ -101,8 +214,8 @@ class MessageQueueWorker(AbortableThread):
         try:
             while True:
                 try:
-                    # Can't wait forever in blocking call, need to enter loop to check for control messages, specifically SystemExit.
-                    msg = self._msg_queue.fetch(self._get_blocking_timeout())
+                    # Waits until a message arrives, aborting the thread wakes the fetch up with ThreadStopped.
+                    msg = self._msg_queue.fetch()
                     if msg:
                         _logger.debug(f'Processing message: {msg}')
                         self.process_message(msg)
@@ -120,33 +233,273 @@ class MessageQueueWorker(AbortableThread):
         finally:
             pass
 
+    async def run_async(self):
+        """Coroutine equivalent of run() for the asyncio execution mode.
+
+        The incoming message queue must be an AsyncIncomingMessageQueue on the same event loop.
+        """
+
+        queue: AsyncIncomingMessageQueue = self._msg_queue
+        while True:
+            for msg in await queue.fetch_many_async(64):
+                try:
+                    _logger.debug(f'Processing message: {msg}')
+                    self.process_message(msg)
+                except Exception:
+                    # Log here for monitoring, an exception in one handler shouldn't stop the loop.
+                    _logger.exception(None)
+
+
+class MessageQueueDispatcherWorker(MessageQueueWorker):
+    """Pool worker that runs a dispatcher's handlers for the messages routed to it.
+
+    A handler that raises is logged and the worker carries on, the dispatcher keeps routing the same keys to this
+    worker so it has to outlive a failed message.
+    """
+
+    def __init__(self, name: str, dispatcher, config: dict = {}):
+        super().__init__(name, IncomingMessageQueue(), config)
+        self._dispatcher = dispatcher
+
+    def queue(self, message: MessageIn):
+        self._msg_queue.queue(message)
+
+    def process_message(self, message: MessageIn):
+        for handler in self._dispatcher._get_handlers(message.__class__):
+            try:
+                handler(message)
+            except Exception:
+                _logger.exception(f'Message handler failed on {self.name}')
+
 
 class MessageQueueDispatcher(MessageQueueWorker):
+    """Routes incoming messages to their registered message handlers.
+
+    Handlers are resolved once per message class into a dispatch table of callables that already have the context
+    bound, so process_message does a single dict lookup per message. The table is compiled when the dispatcher starts
+    and entries for message classes that show up later are compiled the first time they are seen.
+
+    A dispatcher can forward messages to other named dispatchers with add_route(), and can hand its own handler calls
+    to a pool of workers, see register_dispatcher for the workers, key and priority_type_ids arguments.
+    """
+
     def __init__(
         self,
         name: str,
         incoming_message_queue: IncomingMessageQueue,
         context: Context,
         config: dict = {},
+        loop: asyncio.AbstractEventLoop = None,
+        workers: int = 0,
+        key=None,
+        priority_type_ids: tuple = (),
+        metrics: Metrics = None,
     ):
         super().__init__(
             f'{name} dhs message dispatcher', incoming_message_queue, config
         )
         self._disp_name = name
-        self._handler_map = MessageHandlerRegistry._get_message_handlers()
+        self._metrics = metrics
+        self._handler_map = MessageHandlerRegistry._get_message_handlers(name)
         self._context = context
+        self._loop = loop
+        self._key = key
+        self._priority_type_ids = frozenset(priority_type_ids)
+        self._pool = tuple(
+            MessageQueueDispatcherWorker(
+                f'{name} dhs message dispatcher worker {n}', self, config
+            )
+            for n in range(workers)
+        )
+        self._routes = []
+        self._handler_table = {}
+        self._dispatch_table = {}
+
+    @property
+    def dispatcher_name(self):
+        return self._disp_name
+
+    def add_route(self, dispatcher: 'MessageQueueDispatcher'):
+        """Forward messages that the other dispatcher has handlers for to its queue."""
+        self._routes.append(dispatcher)
+
+    def register_gauges(self, metrics: Metrics):
+        """Register the depth of this dispatcher's queue and its worker queues as gauges."""
+
+        metrics.register_gauge(
+            f'{self._disp_name} dispatcher queue depth', self._msg_queue.qsize
+        )
+        for n, worker in enumerate(self._pool):
+            metrics.register_gauge(
+                f'{self._disp_name} dispatcher worker {n} queue depth',
+                worker._msg_queue.qsize,
+            )
+
+    def _log_handlers(self):
+        for type, funcs in self._handler_map.items():
+            for func in funcs:
+                _logger.info(
+                    f'Registered message handler: {type}, {_describe_handler(func)} with {self._disp_name} dispatcher'
+                )
+
+    def _bind_handler(self, handler):
+        """Returns a callable that takes only the message and runs the handler with this dispatcher's context."""
+
+        if self._metrics is not None:
+            return self._bind_timed_handler(handler)
+
+        if iscoroutinefunction(handler):
+            context = self._context
+
+            def call_async_handler(message: MessageIn):
+                self._run_coroutine(handler(message, context))
+
+            return call_async_handler
+
+        return partial(handler, context=self._context)
+
+    def _bind_timed_handler(self, handler):
+        """Same as _bind_handler but records the handler's queue wait and run time with the dispatcher's metrics."""
+
+        context = self._context
+        metrics = self._metrics
+
+        def finished(message: MessageIn, start: float, failed: bool):
+            elapsed = metrics.handler_finished(message, start, failed)
+            if elapsed > metrics.handler_deadline:
+                _logger.warning(
+                    f'Message handler {_describe_handler(handler)} took {elapsed:.3f}s to handle {message.get_type_id()}, '
+                    f'longer than the {metrics.handler_deadline}s deadline'
+                )
+
+        if iscoroutinefunction(handler):
+
+            async def timed_coroutine(message: MessageIn):
+                start = metrics.handler_started(message)
+                failed = True
+                try:
+                    await handler(message, context)
+                    failed = False
+                finally:
+                    finished(message, start, failed)
+
+            def call_async_handler(message: MessageIn):
+                self._run_coroutine(timed_coroutine(message))
+
+            return call_async_handler
+
+        def call_handler(message: MessageIn):
+            start = metrics.handler_started(message)
+            failed = True
+            try:
+                handler(message, context=context)
+                failed = False
+            finally:
+                finished(message, start, failed)
+
+        return call_handler
+
+    def _compile_handlers(self, msg_cls: type) -> tuple:
+        """Build the tuple of bound handlers that are called for messages of msg_cls."""
+
+        return tuple(
+            self._bind_handler(handler)
+            for handler in self._handler_map.get(msg_cls.get_type_id(), ())
+        )
+
+    def _get_handlers(self, msg_cls: type) -> tuple:
+        handlers = self._handler_table.get(msg_cls)
+        if handlers is None:
+            handlers = self._compile_handlers(msg_cls)
+            self._handler_table[msg_cls] = handlers
+        return handlers
+
+    def _compile_message_class(self, msg_cls: type) -> tuple:
+        """Build and cache the tuple of callables that messages of msg_cls are dispatched to.
+
+        These are either the handlers themselves or a hand off to the worker pool, followed by the queues of any
+        routed dispatchers that handle msg_cls.
+        """
+
+        handlers = self._get_handlers(msg_cls)
+        if (
+            handlers
+            and self._pool
+            and msg_cls.get_type_id() not in self._priority_type_ids
+        ):
+            dispatch = (self._queue_to_worker,)
+        else:
+            dispatch = handlers
+
+        dispatch += tuple(
+            route.queue for route in self._routes if route._get_handlers(msg_cls)
+        )
+        self._dispatch_table[msg_cls] = dispatch
+        return dispatch
+
+    def _compile_dispatch_table(self):
+        self._handler_table = {}
+        self._dispatch_table = {}
+        for factory_messages in MessageRegistry._registry.values():
+            for msg_cls in factory_messages:
+                self._compile_message_class(msg_cls)
+
+    def _queue_to_worker(self, message: MessageIn):
+        key = self._key(message) if self._key else None
+        self._pool[hash(key) % len(self._pool)].queue(message)
+
+    def queue(self, message: MessageIn):
+        """Queue a message for this dispatcher, used when routing from another dispatcher."""
+        self._msg_queue.queue(message)
 
     def start(self):
+        self._compile_dispatch_table()
         super().start()
-        for type, func in self._handler_map.items():
-            lineno = getsourcelines(func)[1]
-            module = getmodule(func)
-            _logger.info(
-                f'Registered message handler: {type}, {module.__name__}:{func.__name__}():{lineno} with {self._disp_name} dispatcher'
-            )
+        for worker in self._pool:
+            worker.start()
+        self._log_handlers()
+
+    def start_async(self):
+        """Start dispatching on the event loop instead of the dispatcher thread."""
+        self._compile_dispatch_table()
+        for worker in self._pool:
+            worker.start()
+        self._log_handlers()
+        return asyncio.run_coroutine_threadsafe(self.run_async(), self._loop)
+
+    def abort(self):
+        for worker in self._pool:
+            worker.abort()
+        if self.is_alive():
+            super().abort()
+
+    def join(self, timeout=None):
+        if self.is_alive():
+            super().join(timeout)
+        for worker in self._pool:
+            worker.join(timeout)
+
+    def _handler_task_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            _logger.error('Message handler failed', exc_info=task.exception())
+
+    def _run_coroutine(self, coro):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is not None:
+            # Running on the event loop, let the handler run alongside everything else.
+            task = loop.create_task(coro)
+            task.add_done_callback(self._handler_task_done)
+        else:
+            asyncio.run(coro)
 
     def process_message(self, message: MessageIn):
-        type_id = message.get_type_id()
-        handler = self._handler_map.get(type_id)
-        if isfunction(handler):
-            handler(message, self._context)
+        dispatch = self._dispatch_table.get(message.__class__)
+        if dispatch is None:
+            dispatch = self._compile_message_class(message.__class__)
+
+        for handler in dispatch:
+            handler(message)
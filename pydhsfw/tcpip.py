@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import threading
 import time
 import logging
+import os
+import select
 import socket
 import errno
 from urllib.parse import urlparse
-from pydhsfw.threads import AbortableThread
+from pydhsfw.threads import AbortableThread, current_stop_token, wait_for
 from pydhsfw.transport import (
+    AsyncTransport,
+    BatchStreamWriter,
+    BufferStreamReader,
+    ReconnectPolicy,
     TransportStream,
     TransportState,
+    TransportStateMachine,
     StreamReader,
     StreamWriter,
     MessageStreamReader,
@@ -17,15 +25,49 @@ from pydhsfw.transport import (
 
 _logger = logging.getLogger(__name__)
 
+# Lets a blocking socket read whatever has already arrived without waiting, where the platform supports it.
+_MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
 
 class SocketStreamReader(StreamReader):
+    """Reads from a socket with recv_into using a preallocated ring buffer.
+
+    Each call to read() receives directly into the next free region of the ring and returns a memoryview of
+    that region, so no intermediate chunks are allocated or copied. The returned view is only valid until the
+    ring wraps back around to it, so a MessageStreamReader must copy out anything it wants to keep before the
+    ring has been fully reused. Reads that are larger than the ring get their own buffer.
+
+    Reads wait indefinitely for the connection and for data. When called from an AbortableThread, aborting the thread
+    wakes the read up with ThreadStopped, shutting the socket down wakes it up with ConnectionAbortedError.
+    """
+
+    SOCKET_READ_BUFFER_SIZE = 'socket_read_buffer_size'
+    SOCKET_READ_BUFFER_SIZE_DEFAULT = 65536
+    SOCKET_READ_CHUNK_SIZE = 'socket_read_chunk_size'
+    SOCKET_READ_CHUNK_SIZE_DEFAULT = 8192
+
     def __init__(self, config: dict = {}):
         self._sock = None
-        self._read_timeout = config.get(
-            AbortableThread.THREAD_BLOCKING_TIMEOUT,
-            AbortableThread.THREAD_BLOCKING_TIMEOUT_DEFAULT,
+        # None waits indefinitely.
+        self._read_timeout = None
+        self._read_chunk_size = int(
+            config.get(
+                SocketStreamReader.SOCKET_READ_CHUNK_SIZE,
+                SocketStreamReader.SOCKET_READ_CHUNK_SIZE_DEFAULT,
+            )
         )
-        self._connected_event = threading.Event()
+        self._buffer = bytearray(
+            int(
+                config.get(
+                    SocketStreamReader.SOCKET_READ_BUFFER_SIZE,
+                    SocketStreamReader.SOCKET_READ_BUFFER_SIZE_DEFAULT,
+                )
+            )
+        )
+        self._buffer_view = memoryview(self._buffer)
+        self._buffer_offset = 0
+        self._is_connected = False
+        self._connected_condition = threading.Condition()
 
     @property
     def socket(self):
@@ -34,29 +76,67 @@ class SocketStreamReader(StreamReader):
     @socket.setter
     def socket(self, sock: socket):
         self._sock = sock
-        self._connected = bool(sock is not None)
+        self._buffer_offset = 0
+
+    def _reserve(self, size: int) -> memoryview:
+        """Return a writable view of the next size bytes in the ring buffer."""
+
+        if size > len(self._buffer):
+            # Too big for the ring, use a dedicated buffer so the ring contents are left alone.
+            return memoryview(bytearray(size))
 
-    def read(self, msglen: int) -> bytes:
+        if self._buffer_offset + size > len(self._buffer):
+            self._buffer_offset = 0
+
+        start = self._buffer_offset
+        self._buffer_offset += size
+        return self._buffer_view[start : self._buffer_offset]
+
+    def _wait_readable(self, sock):
+        stop_token = current_stop_token()
+        if stop_token is not None:
+            ready = stop_token.wait_socket(sock, timeout=self._read_timeout)
+        else:
+            ready = select.select([sock], [], [], self._read_timeout)[0]
+        if not ready:
+            raise TimeoutError()
+
+    def read(self, msglen: int) -> memoryview:
 
         try:
             # Wait for the connection to be established.
-            if not self._connected_event.wait(self._read_timeout):
-                raise TimeoutError()
+            with self._connected_condition:
+                if not wait_for(
+                    self._connected_condition,
+                    lambda: self._is_connected,
+                    self._read_timeout,
+                ):
+                    raise TimeoutError()
+                sock = self._sock
 
             res = None
 
             if msglen:
-                chunks = []
+                view = self._reserve(msglen)
                 bytes_recd = 0
                 while bytes_recd < msglen:
-                    chunk = self._sock.recv(min(msglen - bytes_recd, 2048))
-                    if chunk == b'':
+                    if not _MSG_DONTWAIT:
+                        self._wait_readable(sock)
+                    try:
+                        # Data that has already arrived is read without waiting, only an empty socket is waited on.
+                        nbytes = sock.recv_into(
+                            view[bytes_recd:],
+                            min(msglen - bytes_recd, self._read_chunk_size),
+                            _MSG_DONTWAIT,
+                        )
+                    except BlockingIOError:
+                        self._wait_readable(sock)
+                        continue
+                    if nbytes == 0:
                         raise ConnectionAbortedError('socket connection broken')
-                    chunks.extend(chunk)
-                    chunk_len = len(chunk)
-                    bytes_recd = bytes_recd + chunk_len
+                    bytes_recd += nbytes
 
-                res = bytearray(chunks)
+                res = view
 
             return res
 
@@ -81,13 +161,16 @@ class SocketStreamReader(StreamReader):
 
     @_connected.setter
     def _connected(self, is_connected: bool):
-        if is_connected:
-            self._connected_event.set()
-        else:
-            self._connected_event.clear()
+        with self._connected_condition:
+            self._is_connected = is_connected
+            self._connected_condition.notify_all()
 
 
 class SocketStreamWriter(StreamWriter):
+
+    # Gathered writes are split so a single sendmsg call never exceeds the usual IOV_MAX.
+    _max_iov = 1024
+
     def __init__(self, config: dict = {}):
         self._sock = None
 
@@ -106,6 +189,26 @@ class SocketStreamWriter(StreamWriter):
             _logger.exception(None)
             raise
 
+    def write_many(self, buffers: list):
+        """Write all the buffers with gathered sendmsg calls instead of one send per buffer."""
+        if not hasattr(self._sock, 'sendmsg'):
+            # No sendmsg on this platform.
+            return self.write(b''.join(buffers))
+
+        try:
+            views = [memoryview(buffer).cast('B') for buffer in buffers]
+            while views:
+                sent = self._sock.sendmsg(views[: self._max_iov])
+                # Drop what was sent, a partial send leaves the unsent tail of a buffer at the front.
+                while views and sent >= views[0].nbytes:
+                    sent -= views[0].nbytes
+                    del views[0]
+                if sent:
+                    views[0] = views[0][sent:]
+        except Exception:
+            _logger.exception(None)
+            raise
+
 
 class TcpipTransport(TransportStream):
     """ Tcpip transport base"""
@@ -121,6 +224,11 @@ class TcpipTransport(TransportStream):
         super().__init__(connection_name, url, message_reader, message_writer, config)
         self._stream_reader = SocketStreamReader(config)
         self._stream_writer = SocketStreamWriter(config)
+        # Reads block until the connection is established.
+        self.subscribe(self._update_stream_reader)
+
+    def _update_stream_reader(self, old_state: TransportState, state: TransportState):
+        self._stream_reader._connected = state == TransportState.CONNECTED
 
 
 class TcpipClientTransportConnectionWorker(AbortableThread):
@@ -130,6 +238,8 @@ class TcpipClientTransportConnectionWorker(AbortableThread):
         url: str,
         socket_stream_reader: SocketStreamReader,
         socket_stream_writer: SocketStreamWriter,
+        state_machine: TransportStateMachine,
+        reconnect_policy: ReconnectPolicy,
         config: dict = {},
     ):
         super().__init__(
@@ -140,56 +250,39 @@ class TcpipClientTransportConnectionWorker(AbortableThread):
         self._url = url
         self._config = config
         self._stream_reader = socket_stream_reader
-        self._stream_reader._read_timeout = self._get_blocking_timeout()
         self._stream_writer = socket_stream_writer
-        self._state = TransportState.DISCONNECTED
-        self._desired_state = TransportState.DISCONNECTED
-        self._state_change_event = threading.Event()
+        self._state_machine = state_machine
+        self._reconnect_policy = reconnect_policy
 
     def connect(self):
-        self._set_desired_state(TransportState.CONNECTED)
+        self._state_machine.request(TransportState.CONNECTED)
 
     def reconnect(self):
         self._stream_reader._connected = False
-        self._set_desired_state(TransportState.RECONNECTED)
+        self._state_machine.request(TransportState.RECONNECTED)
 
     def disconnect(self):
         self._stream_reader._connected = False
-        self._set_desired_state(TransportState.DISCONNECTED)
-
-    def _set_desired_state(self, state: TransportState):
-        if self._desired_state != state:
-            self._desired_state = state
-            self._state_change_event.set()
+        self._state_machine.request(TransportState.DISCONNECTED)
 
     def run(self):
 
-        # This loop does three things.
-        # 1. Monitor the desired state and compare it to the actual state. If it's different call the
-        # appropriate method to modify the state.
-        # 2. Pop out of any blocking calls to test for a SystemExit exception so the thread can be
-        # shutdown cleanly.
-        # 3. Possibly send a heartbeat or keepalive to the server.
+        # Wait for the desired state to change, then call the appropriate method to bring the actual state in line
+        # with it. Aborting the thread wakes the wait up with ThreadStopped.
 
         try:
             while True:
                 try:
-                    if not self._state_change_event.wait(self._get_blocking_timeout()):
-                        # Can't wait forever in blocking call, need to enter loop to check for control messages, specifically SystemExit.
-                        raise TimeoutError
+                    desired_state = self._state_machine.wait_for_request()
 
-                    if self._desired_state == TransportState.CONNECTED:
+                    if desired_state == TransportState.CONNECTED:
                         self._connect()
-                    elif self._desired_state == TransportState.DISCONNECTED:
+                    elif desired_state == TransportState.DISCONNECTED:
+                        self._reconnect_policy.reset()
                         self._disconnect()
-                    elif self._desired_state == TransportState.RECONNECTED:
+                    elif desired_state == TransportState.RECONNECTED:
                         self._reconnect()
 
-                    self._state_change_event.clear()
-
-                except TimeoutError:
-                    # This is normal and allows for handling the SystemExit exception.
-                    pass
                 except Exception:
                     # Send all other exceptions to the log so we can analyse them to determine if
                     # they need special handling or possibly ignoring them.
@@ -200,81 +293,110 @@ class TcpipClientTransportConnectionWorker(AbortableThread):
             _logger.info(f'Shutdown signal received, exiting {self.name}')
         finally:
             try:
+                # Shutting the socket down also wakes up a write that is blocked on a full socket.
+                self._state_machine.desired_state = TransportState.DISCONNECTED
                 self._disconnect()
             except Exception:
                 pass
 
     @property
     def state(self):
-        return self._state
+        return self._state_machine.state
 
     def _get_url(self):
         return self._url
 
+    def _connect_socket(self, sock: socket.socket, address: tuple, timeout: float):
+        """sock.connect() that is woken up by aborting the thread, leaves the socket in blocking mode."""
+
+        sock.setblocking(False)
+        err = sock.connect_ex(address)
+        if err in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            if not self.stop_token.wait_socket(sock, write=True, timeout=timeout):
+                raise socket.timeout('timed out')
+            err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err == errno.ECONNREFUSED:
+            raise ConnectionRefusedError(err, os.strerror(err))
+        if err:
+            raise OSError(err, os.strerror(err))
+        sock.setblocking(True)
+
     def _set_state(self, state: TransportState):
-        self._state = state
-        _logger.info(f'Connection state: {state}, url: {self._get_url()}')
-        if state in (TransportState.CONNECTED, TransportState.DISCONNECTED):
-            # TODO[Giles]: Add ConnectionConnectedMessage or ConnectionDisconnectedMessage to the queue.
-            pass
+        # Subscribers, e.g. the connection that queues ConnectionConnectedMessage and ConnectionDisconnectedMessage,
+        # are notified by the state machine.
+        self._state_machine.set_state(state)
 
     def _connect(self):
 
-        if self._desired_state == TransportState.CONNECTED:
+        if self._state_machine.desired_state == TransportState.CONNECTED:
 
             if self.state == TransportState.DISCONNECTED:
 
                 socket_timeout = self._get_blocking_timeout()
                 connect_timeout = self._config.get('connect_timeout', None)
-                connect_retry_delay = self._config.get('connect_retry_delay', 10)
                 url = self._get_url()
                 uparts = urlparse(url)
 
-                sock = None
-
                 self._set_state(TransportState.CONNECTING)
 
                 end_time = time.time() + float(connect_timeout or 0.0)
-                end_delay_time = time.time()
 
-                while self._desired_state == TransportState.CONNECTED and (
-                    connect_timeout is None or time.time() < end_time
-                ):
-                    try:
-                        if time.time() >= end_delay_time:
-                            sock = socket.socket()
+                try:
+                    while (
+                        self._state_machine.desired_state == TransportState.CONNECTED
+                        and (connect_timeout is None or time.time() < end_time)
+                    ):
+                        sock = socket.socket()
+                        try:
                             sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-                            sock.settimeout(socket_timeout)
-                            sock.connect((uparts.hostname, uparts.port))
-                            self._stream_reader.socket = sock
-                            self._stream_writer.socket = sock
-                            self._set_state(TransportState.CONNECTED)
-                            break
-                        else:
-                            time.sleep(socket_timeout)
-
-                    except socket.timeout:
-                        if self._desired_state == TransportState.CONNECTED:
-                            _logger.info(
-                                f'Connection timeout: cannot connect to {url}, trying again in {connect_retry_delay} seconds'
+                            self._connect_socket(
+                                sock, (uparts.hostname, uparts.port), socket_timeout
                             )
-                            end_delay_time = time.time() + connect_retry_delay
-                    except ConnectionRefusedError:
-                        if self._desired_state == TransportState.CONNECTED:
-                            _logger.info(
-                                f'Connection refused: cannot connect to {url}, trying again in {connect_retry_delay} seconds'
-                            )
-                            end_delay_time = time.time() + connect_retry_delay
-                    except Exception:
-                        _logger.exception(None)
+                        except OSError as e:
+                            # Close the failed socket so its file descriptor isn't leaked.
+                            sock.close()
+                            if isinstance(e, socket.timeout):
+                                reason = 'Connection timeout'
+                            elif isinstance(e, ConnectionRefusedError):
+                                reason = 'Connection refused'
+                            else:
+                                reason = f'Connection error {e}'
+                            self._wait_to_retry(reason, url, connect_timeout, end_time)
+                            continue
+                        except BaseException:
+                            sock.close()
+                            raise
+
+                        self._reconnect_policy.connected()
+                        self._stream_reader.socket = sock
+                        self._stream_writer.socket = sock
+                        self._set_state(TransportState.CONNECTED)
+                        break
+                finally:
+                    # Gave up, e.g. the connect timeout expired or the desired state changed.
+                    if self.state == TransportState.CONNECTING:
                         self._set_state(TransportState.DISCONNECTED)
-                        raise
             else:
                 _logger.debug('Already connected, ignoring connection request')
 
+    def _wait_to_retry(self, reason: str, url: str, connect_timeout, end_time: float):
+        """Wait for the reconnect policy's delay, returns early if the desired state changes."""
+
+        if self._state_machine.desired_state != TransportState.CONNECTED:
+            return
+
+        delay = self._reconnect_policy.failed()
+        if connect_timeout is not None:
+            delay = min(delay, max(0.0, end_time - time.time()))
+        _logger.info(
+            f'{reason}: cannot connect to {url}, trying again in {delay:.1f} seconds'
+        )
+        if delay:
+            self._state_machine.wait_while_desired(TransportState.CONNECTED, delay)
+
     def _disconnect(self):
 
-        if self._desired_state == TransportState.DISCONNECTED:
+        if self._state_machine.desired_state == TransportState.DISCONNECTED:
             # Only disconnect if we are connected
             if self.state == TransportState.CONNECTED:
                 self._set_state(TransportState.DISCONNECTING)
@@ -307,17 +429,26 @@ class TcpipClientTransportConnectionWorker(AbortableThread):
 
     def _reconnect(self):
 
-        if self._desired_state == TransportState.RECONNECTED:
-            self._desired_state = TransportState.DISCONNECTED
-            self._state = TransportState.CONNECTED
+        if self._state_machine.desired_state == TransportState.RECONNECTED:
+            self._state_machine.desired_state = TransportState.DISCONNECTED
             self._disconnect()
-            time.sleep(self._get_blocking_timeout())
-            self._desired_state = TransportState.CONNECTED
+            self._state_machine.desired_state = TransportState.CONNECTED
+
+            # The first reconnect is immediate, a connection that keeps dropping backs off.
+            delay = self._reconnect_policy.failed()
+            if delay:
+                _logger.info(
+                    f'Reconnecting to {self._get_url()} in {delay:.1f} seconds'
+                )
+                if self._state_machine.wait_while_desired(
+                    TransportState.CONNECTED, delay
+                ):
+                    return
             self._connect()
 
 
 class TcpipClientTransport(TcpipTransport):
-    """ Tcpip client transport """
+    """Tcpip client transport"""
 
     def __init__(
         self,
@@ -329,7 +460,13 @@ class TcpipClientTransport(TcpipTransport):
     ):
         super().__init__(connection_name, url, message_reader, message_writer, config)
         self._connection_worker = TcpipClientTransportConnectionWorker(
-            connection_name, url, self._stream_reader, self._stream_writer, config
+            connection_name,
+            url,
+            self._stream_reader,
+            self._stream_writer,
+            self._state_machine,
+            self._reconnect_policy,
+            config,
         )
 
     def connect(self):
@@ -349,3 +486,229 @@ class TcpipClientTransport(TcpipTransport):
 
     def wait(self):
         self._connection_worker.join()
+
+
+class ProtocolStreamWriter(StreamWriter):
+    """Stream writer that writes to an asyncio transport."""
+
+    def __init__(self):
+        self._transport = None
+
+    @property
+    def transport(self):
+        return self._transport
+
+    @transport.setter
+    def transport(self, transport: asyncio.Transport):
+        self._transport = transport
+
+    def write(self, buffer: bytes):
+        if self._transport is None or self._transport.is_closing():
+            raise ConnectionAbortedError('transport connection broken')
+        self._transport.write(buffer)
+
+    def write_many(self, buffers: list):
+        if self._transport is None or self._transport.is_closing():
+            raise ConnectionAbortedError('transport connection broken')
+        self._transport.writelines(buffers)
+
+
+class TcpipClientProtocol(asyncio.Protocol):
+    """Forwards asyncio protocol events to an AsyncTcpipClientTransport."""
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def connection_made(self, transport: asyncio.Transport):
+        self._owner._connection_made(transport)
+
+    def data_received(self, data: bytes):
+        self._owner._data_received(data)
+
+    def connection_lost(self, exc):
+        self._owner._connection_lost(exc)
+
+
+class AsyncTcpipClientTransport(AsyncTransport):
+    """Tcpip client transport for the asyncio execution mode.
+
+    Connects with the event loop and frames incoming data with the same MessageStreamReader/Writer
+    implementations as the threaded TcpipClientTransport, so no worker threads are needed.
+    """
+
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        message_reader: MessageStreamReader,
+        message_writer: MessageStreamWriter,
+        loop: asyncio.AbstractEventLoop,
+        config: dict = {},
+    ):
+        super().__init__(connection_name, url, loop, config)
+        self._message_reader = message_reader
+        self._message_writer = message_writer
+        self._stream_reader = BufferStreamReader()
+        self._stream_writer = ProtocolStreamWriter()
+        self._transport = None
+        self._connect_task = None
+        self._reading_paused = False
+
+    def _connect(self, delay: float = 0.0):
+        self._desired_state = TransportState.CONNECTED
+        if self.state == TransportState.DISCONNECTED and self._connect_task is None:
+            self._connect_task = self._loop.create_task(self._connect_async(delay))
+        else:
+            _logger.debug('Already connected, ignoring connection request')
+
+    async def _connect_async(self, delay: float):
+
+        socket_timeout = self._config.get(
+            AbortableThread.THREAD_BLOCKING_TIMEOUT,
+            AbortableThread.THREAD_BLOCKING_TIMEOUT_DEFAULT,
+        )
+        connect_timeout = self._config.get('connect_timeout', None)
+        uparts = urlparse(self._url)
+
+        self._set_state(TransportState.CONNECTING)
+        end_time = time.time() + float(connect_timeout or 0.0)
+
+        try:
+            if delay:
+                _logger.info(f'Reconnecting to {self._url} in {delay:.1f} seconds')
+                await asyncio.sleep(delay)
+
+            while self._desired_state == TransportState.CONNECTED and (
+                connect_timeout is None or time.time() < end_time
+            ):
+                try:
+                    await asyncio.wait_for(
+                        self._loop.create_connection(
+                            lambda: TcpipClientProtocol(self),
+                            uparts.hostname,
+                            uparts.port,
+                        ),
+                        socket_timeout,
+                    )
+                    return
+                except asyncio.TimeoutError:
+                    reason = 'Connection timeout'
+                except ConnectionRefusedError:
+                    reason = 'Connection refused'
+                except OSError as e:
+                    reason = f'Connection error {e}'
+
+                delay = self._reconnect_policy.failed()
+                if connect_timeout is not None:
+                    delay = min(delay, max(0.0, end_time - time.time()))
+                _logger.info(
+                    f'{reason}: cannot connect to {self._url}, trying again in {delay:.1f} seconds'
+                )
+                await asyncio.sleep(delay)
+        finally:
+            if self._connect_task is asyncio.current_task():
+                self._connect_task = None
+                if self.state == TransportState.CONNECTING:
+                    self._set_state(TransportState.DISCONNECTED)
+
+    def _connection_made(self, transport: asyncio.Transport):
+        self._transport = transport
+        self._stream_reader.clear()
+        self._stream_writer.transport = transport
+        self._reconnect_policy.connected()
+        if self._reading_paused:
+            transport.pause_reading()
+        self._set_state(TransportState.CONNECTED)
+        if self._desired_state != TransportState.CONNECTED:
+            transport.close()
+
+    def pause_reading(self):
+        self._reading_paused = True
+        if self._transport:
+            self._transport.pause_reading()
+
+    def resume_reading(self):
+        self._reading_paused = False
+        if self._transport:
+            self._transport.resume_reading()
+            # Pass on the messages that were already buffered when reading was paused.
+            self._data_received(b'')
+
+    def _data_received(self, data: bytes):
+        reader = self._stream_reader
+        reader.feed(data)
+        # Messages left in the buffer while reading is paused are read when it resumes.
+        while not self._reading_paused:
+            reader.mark()
+            try:
+                raw_msg = self._message_reader.read_msg(reader)
+            except asyncio.IncompleteReadError:
+                # Wait for the rest of the message to arrive.
+                reader.rewind()
+                break
+            except Exception:
+                # Can't resynchronize the stream after a framing error so drop the connection and start over.
+                _logger.exception(None)
+                self._reconnect()
+                break
+            self._received(raw_msg)
+        reader.compact()
+
+    def _connection_lost(self, exc):
+        self._transport = None
+        self._stream_writer.transport = None
+        self._stream_reader.clear()
+        self._set_state(TransportState.DISCONNECTED)
+        if self._desired_state == TransportState.CONNECTED:
+            _logger.warning('Connection lost, attempting to reconnect')
+            # The first reconnect is immediate, a connection that keeps dropping backs off.
+            self._connect(self._reconnect_policy.failed())
+
+    def _disconnect(self):
+        self._desired_state = TransportState.DISCONNECTED
+        self._reconnect_policy.reset()
+        if self._connect_task:
+            self._connect_task.cancel()
+            self._connect_task = None
+            if self.state == TransportState.CONNECTING:
+                self._set_state(TransportState.DISCONNECTED)
+        if self._transport:
+            self._set_state(TransportState.DISCONNECTING)
+            self._transport.close()
+        elif self.state == TransportState.DISCONNECTED:
+            _logger.debug('Not connected, ignoring disconnect request')
+
+    def _reconnect(self):
+        self._desired_state = TransportState.CONNECTED
+        if self._transport:
+            # Reconnect once connection_lost is called.
+            self._transport.close()
+        else:
+            self._connect()
+
+    def send(self, msg: bytes):
+        if self.state != TransportState.CONNECTED:
+            _logger.warning(f'Send failed, not connected {msg}')
+            return
+
+        try:
+            self._message_writer.write_msg(self._stream_writer, msg)
+        except ConnectionAbortedError:
+            _logger.warning('Connection lost, attempting to reconnect')
+            self._reconnect()
+
+    def send_many(self, msgs: list):
+        if self.state != TransportState.CONNECTED:
+            _logger.warning(
+                f'Send failed, not connected, dropping {len(msgs)} messages'
+            )
+            return
+
+        batch_writer = BatchStreamWriter()
+        for msg in msgs:
+            self._message_writer.write_msg(batch_writer, msg)
+        try:
+            self._stream_writer.write_many(batch_writer.buffers)
+        except ConnectionAbortedError:
+            _logger.warning('Connection lost, attempting to reconnect')
+            self._reconnect()
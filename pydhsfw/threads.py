@@ -1,12 +1,176 @@
 # -*- coding: utf-8 -*-
 import logging
+import selectors
+import socket
 import threading
-import ctypes
+import weakref
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 _logger = logging.getLogger(__name__)
 
 
+if hasattr(selectors, 'PollSelector'):
+    _Selector = selectors.PollSelector
+else:
+    _Selector = selectors.SelectSelector
+
+
+class ThreadStopped(SystemExit):
+    """Raised by blocking calls in a thread whose StopToken has been stopped.
+
+    Derives from SystemExit so a thread's run loop can handle it the same way as any other request to exit.
+    """
+
+    pass
+
+
+class StopToken:
+    """Cooperative request for a thread to stop.
+
+    Stopping the token wakes up blocking calls that wait with it, they then raise ThreadStopped in the thread that
+    made them. Conditions are woken with wait_for(), sockets with wait_socket() which selects on the socket and a
+    socket pair that stop() writes to, and anything else by registering a callback with add_callback().
+    """
+
+    def __init__(self):
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._conditions = set()
+        self._sleep_condition = threading.Condition()
+        self._wakeup_reader = None
+        self._wakeup_writer = None
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped
+
+    def stop(self):
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            callbacks = list(self._callbacks)
+            conditions = list(self._conditions)
+            if self._wakeup_writer:
+                try:
+                    self._wakeup_writer.send(b'\0')
+                except OSError:
+                    pass
+
+        for condition in conditions:
+            with condition:
+                condition.notify_all()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                _logger.exception(None)
+
+    def check(self):
+        """Raise ThreadStopped if the token has been stopped."""
+        if self._stopped:
+            raise ThreadStopped
+
+    def add_callback(self, callback):
+        """Call callback() when the token is stopped, straight away if it already has been."""
+        with self._lock:
+            if not self._stopped:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def wait(self, timeout: float = None):
+        """Sleep for up to timeout seconds, raises ThreadStopped if the token is stopped first."""
+
+        with self._sleep_condition:
+            self.wait_for(self._sleep_condition, lambda: False, timeout)
+
+    def wait_for(
+        self, condition: threading.Condition, predicate, timeout: float = None
+    ):
+        """Same as condition.wait_for() but raises ThreadStopped if the token is stopped while waiting.
+
+        Must be called with the condition's lock held.
+        """
+
+        with self._lock:
+            if not self._stopped:
+                self._conditions.add(condition)
+        result = condition.wait_for(lambda: self._stopped or predicate(), timeout)
+        self.check()
+        return result
+
+    def wait_socket(self, sock, write: bool = False, timeout: float = None) -> bool:
+        """Wait until the socket is readable, or writable, for up to timeout seconds.
+
+        Returns False if the timeout expires first and raises ThreadStopped if the token is stopped first.
+        """
+
+        with self._lock:
+            self.check()
+            if self._wakeup_reader is None:
+                self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+                self._wakeup_reader.setblocking(False)
+                self._wakeup_writer.setblocking(False)
+
+        with _Selector() as selector:
+            selector.register(
+                sock, selectors.EVENT_WRITE if write else selectors.EVENT_READ
+            )
+            selector.register(self._wakeup_reader, selectors.EVENT_READ)
+            ready = selector.select(timeout)
+
+        self.check()
+        return bool(ready)
+
+    def close(self):
+        """Release the socket pair used by wait_socket()."""
+        with self._lock:
+            for sock in (self._wakeup_reader, self._wakeup_writer):
+                if sock:
+                    sock.close()
+            self._wakeup_reader = self._wakeup_writer = None
+
+
+def current_stop_token() -> StopToken:
+    """The StopToken of the calling thread, None if it isn't an AbortableThread."""
+    return getattr(threading.current_thread(), '_stop_token', None)
+
+
+def wait_for(condition: threading.Condition, predicate, timeout: float = None):
+    """condition.wait_for() that can be woken up by aborting the calling thread.
+
+    When called from an AbortableThread that is aborted while waiting, raises ThreadStopped. Must be called with the
+    condition's lock held.
+    """
+
+    result = predicate()
+    if result:
+        return result
+
+    stop_token = current_stop_token()
+    if stop_token is None:
+        return condition.wait_for(predicate, timeout)
+    return stop_token.wait_for(condition, predicate, timeout)
+
+
 class AbortableThread(threading.Thread):
+    """Thread that can be asked to stop with abort().
+
+    abort() stops the thread's StopToken. The queues and transports in this package wait with the token of the
+    thread that calls them, so a blocked call returns straight away by raising ThreadStopped, a SystemExit, in the
+    thread. Derived classes that wait on anything else should wait with stop_token, or poll stopped.
+
+    The thread_blocking_timeout config value is used by transports as their socket and request timeout, the thread
+    itself doesn't need to wake up periodically to notice abort().
+    """
 
     THREAD_BLOCKING_TIMEOUT = 'thread_blocking_timeout'
     THREAD_BLOCKING_TIMEOUT_DEFAULT = 5.0
@@ -27,28 +191,118 @@ class AbortableThread(threading.Thread):
             AbortableThread.THREAD_BLOCKING_TIMEOUT,
             AbortableThread.THREAD_BLOCKING_TIMEOUT_DEFAULT,
         )
+        self._stop_token = StopToken()
 
     def _get_blocking_timeout(self):
         return self._thread_blocking_timeout
 
-    def _get_id(self):
+    @property
+    def stop_token(self) -> StopToken:
+        return self._stop_token
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop_token.stopped
 
-        # returns id of the respective thread
-        for id, thread in threading._active.items():
-            if thread is self:
-                return id
+    def sleep(self, seconds: float):
+        """time.sleep() that raises ThreadStopped when the thread is aborted, call it from this thread."""
+        self._stop_token.wait(seconds)
 
     def abort(self):
-        thread_id = self._get_id()
+        if not self._stop_token.stopped:
+            _logger.info(f'Stopping: {self.name}')
+            self._stop_token.stop()
 
-        thread = threading._active.get(thread_id)
-        if thread:
-            _logger.info(f'Sending SystemExit exceptions to: {thread.name}')
-            res = ctypes.pythonapi.PyThreadState_SetAsyncExc(
-                ctypes.c_ulong(thread_id), ctypes.py_object(SystemExit)
-            )
-            if res > 1:
-                ctypes.pythonapi.PyThreadState_SetAsyncExc(
-                    ctypes.c_ulong(thread_id), None
+    def join(self, timeout=None):
+        super().join(timeout)
+        if not self.is_alive():
+            self._stop_token.close()
+
+
+class CancellableThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that can cancel the work that hasn't started yet.
+
+    shutdown_now() does what shutdown(wait=False, cancel_futures=True) does from Python 3.9 on, work that is already
+    running is left to finish.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._futures = weakref.WeakSet()
+        self._futures_lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        future = super().submit(fn, *args, **kwargs)
+        with self._futures_lock:
+            self._futures.add(future)
+        return future
+
+    def cancel_pending(self):
+        """Cancel the work that hasn't started yet."""
+        with self._futures_lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+
+    def shutdown_now(self):
+        """Shut down without waiting and cancel the work that hasn't started yet."""
+        self.shutdown(wait=False)
+        self.cancel_pending()
+
+
+class EventLoopWorker(AbortableThread):
+    """Runs an asyncio event loop in its own thread.
+
+    In the asyncio execution mode all connections and the message dispatcher share this loop so a DHS
+    runs on a single thread no matter how many connections it has. Aborting the worker stops the loop
+    from within instead of injecting an exception into the thread.
+    """
+
+    def __init__(self, name: str, loop: asyncio.AbstractEventLoop, config: dict = {}):
+        super().__init__(name=f'{name} event loop worker', config=config)
+        self._loop = loop
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_forever()
+        finally:
+            try:
+                tasks = asyncio.all_tasks(self._loop)
+                for task in tasks:
+                    task.cancel()
+                self._loop.run_until_complete(
+                    asyncio.gather(*tasks, return_exceptions=True)
                 )
-                print('Exception raise failure')
+                self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            finally:
+                self._loop.close()
+                _logger.info(f'Event loop stopped, exiting {self.name}')
+
+    def abort(self):
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def running_on(loop: asyncio.AbstractEventLoop) -> bool:
+    """True when called from the thread that is running the loop."""
+
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+def call_soon(loop: asyncio.AbstractEventLoop, callback, *args):
+    """Schedule a callback on the loop from any thread.
+
+    Uses the cheaper call_soon when already running on the loop's thread and call_soon_threadsafe otherwise.
+    """
+
+    if running_on(loop):
+        return loop.call_soon(callback, *args)
+    return loop.call_soon_threadsafe(callback, *args)
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
+import random
+import threading
+import time
 from enum import Enum
+from pydhsfw.threads import call_soon, wait_for
 
 _logger = logging.getLogger(__name__)
 
@@ -14,13 +19,240 @@ class TransportState(Enum):
     RECONNECTING = 6
 
 
+class TransportStateMachine:
+    """Connection state of a transport, shared by the transport, its workers and its users.
+
+    state is the actual state of the connection, it is only changed by the code that maintains the connection, which
+    publishes every transition to the subscribers. desired_state is what users have asked for with request(), the
+    code maintaining the connection waits for requests with wait_for_request() instead of polling.
+
+    All waits wake up when the calling AbortableThread is aborted, see pydhsfw.threads.
+    """
+
+    def __init__(self, connection_name: str, url: str):
+        self._connection_name = connection_name
+        self._url = url
+        self._state = TransportState.DISCONNECTED
+        self._desired_state = TransportState.DISCONNECTED
+        self._request_pending = False
+        self._condition = threading.Condition()
+        self._subscribers = []
+
+    @property
+    def state(self) -> TransportState:
+        return self._state
+
+    @property
+    def desired_state(self) -> TransportState:
+        return self._desired_state
+
+    @desired_state.setter
+    def desired_state(self, state: TransportState):
+        """Change the desired state without waking up wait_for_request(), for use while maintaining the connection."""
+        self._desired_state = state
+
+    def subscribe(self, callback):
+        """Call callback(old_state, new_state) after every state transition, on the thread that made it."""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def set_state(self, state: TransportState):
+        with self._condition:
+            old_state = self._state
+            if old_state == state:
+                return
+            self._state = state
+            self._condition.notify_all()
+
+        _logger.info(f'Connection state: {state}, url: {self._url}')
+        for callback in list(self._subscribers):
+            try:
+                callback(old_state, state)
+            except Exception:
+                _logger.exception(None)
+
+    def request(self, state: TransportState):
+        """Ask for the desired state, wakes up wait_for_request() if it's a change."""
+        with self._condition:
+            if self._desired_state != state:
+                self._desired_state = state
+                self._request_pending = True
+                self._condition.notify_all()
+
+    def wait_for_request(self, timeout: float = None) -> TransportState:
+        """Wait for request() to change the desired state and return it, None if the timeout expires first."""
+        with self._condition:
+            if not wait_for(self._condition, lambda: self._request_pending, timeout):
+                return None
+            self._request_pending = False
+            return self._desired_state
+
+    def wait_while_desired(self, state: TransportState, timeout: float = None) -> bool:
+        """Wait until the desired state is no longer state, returns False if the timeout expires first."""
+        with self._condition:
+            return bool(
+                wait_for(self._condition, lambda: self._desired_state != state, timeout)
+            )
+
+    def wait_for_state(self, states: tuple, timeout: float = None) -> bool:
+        """Wait until the state is one of states, returns False if the timeout expires first."""
+        with self._condition:
+            return bool(
+                wait_for(self._condition, lambda: self._state in states, timeout)
+            )
+
+
+class ReconnectPolicy:
+    """Decides how long to wait before the next attempt to connect.
+
+    The first retry after a failed attempt or a lost connection is immediate. After that the delay starts at
+    reconnect_initial_delay and is multiplied by reconnect_backoff_multiplier for every failure, up to
+    reconnect_max_delay. Up to reconnect_jitter of each delay is taken off at random so a group of DHSs that lost the
+    same server don't all retry in lockstep.
+
+    After reconnect_circuit_threshold failures in a row the circuit opens and attempts are only made every
+    reconnect_circuit_open_delay seconds until one succeeds. Set reconnect_circuit_threshold to 0 to keep retrying
+    at reconnect_max_delay.
+
+    A connection that stays up for reconnect_max_delay seconds resets the backoff, one that drops sooner counts as
+    another failure so a server that accepts connections and then drops them isn't hammered.
+
+    reconnect_max_delay defaults to connect_retry_delay, the fixed retry delay used before the backoff was added.
+    """
+
+    CONNECT_RETRY_DELAY = 'connect_retry_delay'
+    CONNECT_RETRY_DELAY_DEFAULT = 10.0
+    RECONNECT_INITIAL_DELAY = 'reconnect_initial_delay'
+    RECONNECT_INITIAL_DELAY_DEFAULT = 0.5
+    RECONNECT_MAX_DELAY = 'reconnect_max_delay'
+    RECONNECT_BACKOFF_MULTIPLIER = 'reconnect_backoff_multiplier'
+    RECONNECT_BACKOFF_MULTIPLIER_DEFAULT = 2.0
+    RECONNECT_JITTER = 'reconnect_jitter'
+    RECONNECT_JITTER_DEFAULT = 0.5
+    RECONNECT_CIRCUIT_THRESHOLD = 'reconnect_circuit_threshold'
+    RECONNECT_CIRCUIT_THRESHOLD_DEFAULT = 10
+    RECONNECT_CIRCUIT_OPEN_DELAY = 'reconnect_circuit_open_delay'
+    RECONNECT_CIRCUIT_OPEN_DELAY_DEFAULT = 60.0
+
+    def __init__(self, url: str, config: dict = {}):
+        self._url = url
+        self._initial_delay = float(
+            config.get(
+                self.RECONNECT_INITIAL_DELAY, self.RECONNECT_INITIAL_DELAY_DEFAULT
+            )
+        )
+        self._max_delay = float(
+            config.get(
+                self.RECONNECT_MAX_DELAY,
+                config.get(self.CONNECT_RETRY_DELAY, self.CONNECT_RETRY_DELAY_DEFAULT),
+            )
+        )
+        self._multiplier = float(
+            config.get(
+                self.RECONNECT_BACKOFF_MULTIPLIER,
+                self.RECONNECT_BACKOFF_MULTIPLIER_DEFAULT,
+            )
+        )
+        self._jitter = min(
+            1.0,
+            max(
+                0.0,
+                float(config.get(self.RECONNECT_JITTER, self.RECONNECT_JITTER_DEFAULT)),
+            ),
+        )
+        self._circuit_threshold = int(
+            config.get(
+                self.RECONNECT_CIRCUIT_THRESHOLD,
+                self.RECONNECT_CIRCUIT_THRESHOLD_DEFAULT,
+            )
+        )
+        self._circuit_open_delay = float(
+            config.get(
+                self.RECONNECT_CIRCUIT_OPEN_DELAY,
+                self.RECONNECT_CIRCUIT_OPEN_DELAY_DEFAULT,
+            )
+        )
+        self._failures = 0
+        self._connected_time = None
+
+    @property
+    def failures(self) -> int:
+        """Number of failures since the last stable connection."""
+        return self._failures
+
+    @property
+    def circuit_open(self) -> bool:
+        return 0 < self._circuit_threshold <= self._failures
+
+    def reset(self):
+        """Start over, e.g. after the user disconnects. The next failure is retried immediately."""
+        self._failures = 0
+        self._connected_time = None
+
+    def connected(self):
+        """Call when a connection attempt succeeds."""
+        if self.circuit_open:
+            _logger.info(f'Connected to {self._url} again, closing the circuit')
+        self._connected_time = time.monotonic()
+
+    def failed(self) -> float:
+        """Call when a connection attempt fails or the connection is lost, returns the seconds to wait before retrying."""
+
+        if (
+            self._connected_time is not None
+            and time.monotonic() - self._connected_time >= self._max_delay
+        ):
+            self._failures = 0
+        self._connected_time = None
+        self._failures += 1
+
+        if self._failures == 1:
+            return 0.0
+
+        if self.circuit_open:
+            if self._failures == self._circuit_threshold:
+                _logger.warning(
+                    f'{self._failures} attempts to connect to {self._url} failed, opening the circuit and trying '
+                    f'again every {self._circuit_open_delay} seconds'
+                )
+            delay = self._circuit_open_delay
+        else:
+            # Cap the exponent, the delay is capped at max delay long before it would overflow.
+            delay = min(
+                self._max_delay,
+                self._initial_delay * self._multiplier ** min(self._failures - 2, 64),
+            )
+
+        return delay * (1.0 - self._jitter * random.random())
+
+
 class Transport:
-    """ Underlying bass class that all transports must derive from. """
+    """Underlying bass class that all transports must derive from.
+
+    Each transport has a TransportStateMachine, subscribe() to be notified of connection state changes, and a
+    ReconnectPolicy for the code that maintains the connection.
+    """
 
     def __init__(self, connection_name: str, url: str, config: dict = {}):
         self._connection_name = connection_name
         self._url = url
         self._config = config
+        self._state_machine = TransportStateMachine(connection_name, url)
+        self._reconnect_policy = ReconnectPolicy(url, config)
+
+    @property
+    def state(self) -> TransportState:
+        return self._state_machine.state
+
+    def subscribe(self, callback):
+        """Call callback(old_state, new_state) after every connection state transition.
+
+        The callback is called on whichever thread made the transition, the event loop thread for an AsyncTransport.
+        """
+        self._state_machine.subscribe(callback)
 
     def connect(self):
         """ Connects to the specified resource and maintains a persistent connection. """
@@ -43,14 +275,22 @@ class Transport:
         """Send the raw bytes of an entire message."""
         pass
 
+    def send_many(self, msgs: list):
+        """Send the raw bytes of several entire messages, in order.
+
+        Transports that can write several messages at once override this, the default sends them one at a time.
+        """
+        for msg in msgs:
+            self.send(msg)
+
     def receive(self) -> bytes:
         """Receive the raw bytes of an entire message.
 
-        This is a blocking call and will wait for a message to arrive or until the timeout duration is reached.
+        This is a blocking call and will wait for a message to arrive. Implementations may return None, or raise
+        TimeoutError, when they stop waiting without a message, callers should just call receive() again.
 
-        Raises TimeoutError if there are no messages to read but the timeout duration has been reached.
-        Note: Most implementations can only set the timeout during initialization of the Transport object
-        so this is will be a requirement for all implementations.
+        When called from an AbortableThread, aborting the thread wakes the call up by raising ThreadStopped, so
+        implementations must wait with the thread's StopToken, see pydhsfw.threads.
 
         """
         pass
@@ -91,6 +331,9 @@ class StreamReader:
 
         This is a blocking call and the wait timeout is determine by the implementation and generally by the stream it wraps.
 
+        Implementations may return a bytes-like object such as a memoryview into a reused buffer rather than bytes. Callers
+        should copy out anything they need to keep before the buffer is reused by subsequent reads.
+
         Raises a TimeoutError if the is nothing to read from the stream and the timeout has been reached.
         Raises a ConnectionAbortedError if the stream has been unusually aborted or disconnected.
         """
@@ -114,6 +357,66 @@ class StreamReader:
         raise NotImplementedError
 
 
+class BufferStreamReader(StreamReader):
+    """Stream reader over an in memory buffer that is fed by an asyncio Protocol.
+
+    This lets the existing MessageStreamReader implementations decode messages from data that is pushed to
+    a protocol instead of pulled from a blocking stream. read() raises asyncio.IncompleteReadError when the
+    buffer does not hold enough bytes yet. The caller should mark() the start of each message and rewind()
+    to it on an incomplete read, then try again when more data has been fed.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._pos = 0
+        self._mark = 0
+
+    def feed(self, data: bytes):
+        self._buffer.extend(data)
+
+    def mark(self):
+        self._mark = self._pos
+
+    def rewind(self):
+        self._pos = self._mark
+
+    def compact(self):
+        """Discard everything that has been read."""
+        del self._buffer[: self._pos]
+        self._pos = 0
+        self._mark = 0
+
+    def clear(self):
+        self._buffer.clear()
+        self._pos = 0
+        self._mark = 0
+
+    def read(self, msglen: int) -> bytes:
+        res = None
+
+        if msglen:
+            end = self._pos + msglen
+            if end > len(self._buffer):
+                raise asyncio.IncompleteReadError(
+                    bytes(self._buffer[self._pos :]), msglen
+                )
+
+            with memoryview(self._buffer) as view:
+                res = view[self._pos : end].tobytes()
+            self._pos = end
+
+        return res
+
+    @property
+    def _connected(self):
+        raise NotImplementedError
+
+    @_connected.setter
+    def _connected(self, is_connected: bool):
+        if not is_connected:
+            self.clear()
+
+
 class StreamWriter:
     def __init__(self):
         pass
@@ -125,6 +428,31 @@ class StreamWriter:
         """
         pass
 
+    def write_many(self, buffers: list):
+        """Writes several chunks of bytes to the stream, in order.
+
+        Stream writers that support gathered writes override this, the default writes the chunks one at a time.
+        """
+        for buffer in buffers:
+            self.write(buffer)
+
+
+class BatchStreamWriter(StreamWriter):
+    """Stream writer that collects the chunks written to it instead of writing them.
+
+    Used to frame a batch of messages with a MessageStreamWriter so the whole batch can be written to the real
+    stream with a single write_many call.
+    """
+
+    def __init__(self):
+        self.buffers = []
+
+    def write(self, buffer: bytes):
+        self.buffers.append(buffer)
+
+    def clear(self):
+        self.buffers = []
+
 
 class MessageStreamReader:
     def __init__(self):
@@ -184,6 +512,19 @@ class TransportStream(Transport):
             _logger.warning('Connection lost, attempting to reconnect')
             self.reconnect()
 
+    def send_many(self, msgs: list):
+        # Frame every message first, then hand all the frames to the stream writer at once.
+        batch_writer = BatchStreamWriter()
+        for msg in msgs:
+            self._message_writer.write_msg(batch_writer, msg)
+        try:
+            self._stream_writer.write_many(batch_writer.buffers)
+        except ConnectionAbortedError:
+            # Connection is lost because the socket was closed, probably from the other side.
+            # Block the socket event and queue a reconnect message.
+            _logger.warning('Connection lost, attempting to reconnect')
+            self.reconnect()
+
     def receive(self):
         try:
             return self._message_reader.read_msg(self._stream_reader)
@@ -195,3 +536,80 @@ class TransportStream(Transport):
             # Block the socket event and queue a reconnect message.
             _logger.warning('Connection lost, attempting to reconnect')
             self.reconnect()
+
+
+class AsyncTransport(Transport):
+    """Abstract class for transports that run on an asyncio event loop instead of worker threads.
+
+    Rather than having a read worker block in receive(), the transport pushes each raw message to the callback
+    set with set_receive_callback(). The callback and send() are always called on the event loop thread.
+    connect(), disconnect() and reconnect() may be called from any thread, they are forwarded to the loop
+    where derived classes implement them in _connect(), _disconnect() and _reconnect().
+    """
+
+    def __init__(
+        self,
+        connection_name: str,
+        url: str,
+        loop: asyncio.AbstractEventLoop,
+        config: dict = {},
+    ):
+        super().__init__(connection_name, url, config)
+        self._loop = loop
+        self._receive_callback = None
+
+    def set_receive_callback(self, callback):
+        """Set the function that is called with each raw message received by the transport."""
+        self._receive_callback = callback
+
+    def _received(self, raw_msg):
+        if raw_msg and self._receive_callback:
+            self._receive_callback(raw_msg)
+
+    @property
+    def _desired_state(self) -> TransportState:
+        return self._state_machine.desired_state
+
+    @_desired_state.setter
+    def _desired_state(self, state: TransportState):
+        # Only the event loop thread changes the desired state so there is nothing to wake up.
+        self._state_machine.desired_state = state
+
+    def _set_state(self, state: TransportState):
+        self._state_machine.set_state(state)
+
+    def connect(self):
+        call_soon(self._loop, self._connect)
+
+    def disconnect(self):
+        call_soon(self._loop, self._disconnect)
+
+    def reconnect(self):
+        call_soon(self._loop, self._reconnect)
+
+    def receive(self):
+        raise NotImplementedError
+
+    def pause_reading(self):
+        """Stop passing raw messages to the receive callback until resume_reading() is called.
+
+        Called on the event loop thread when the incoming message queue is full. Transports that read from a peer stop
+        reading from it so the peer is held back by TCP flow control, others may keep calling the callback.
+        """
+        pass
+
+    def resume_reading(self):
+        pass
+
+    def shutdown(self):
+        if not self._loop.is_closed():
+            self.disconnect()
+
+    def _connect(self):
+        pass
+
+    def _disconnect(self):
+        pass
+
+    def _reconnect(self):
+        pass
@@ -17,7 +17,7 @@ setup(
     url='https://github.com/tetrahedron-technologies/pydhsfw',
     license=license,
     packages=find_packages(exclude=('tests', 'docs')),
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: MIT License',
@@ -25,12 +25,15 @@ setup(
     ],
     install_requires=[
         'PyYAML',
-        'dotty-dict',
         'coloredlogs',
         'verboselogs',
         'requests',
+        'numpy',
         'opencv-python-headless',
         'matplotlib',
         'scipy',
     ],
+    extras_require={
+        'orjson': ['orjson'],
+    },
 )
@@ -13,7 +13,8 @@ class TestThread(AbortableThread):
         try:
             while True:
                 print('running ' + self.name)
-                time.sleep(0.25)
+                # Aborting the thread wakes the sleep up with ThreadStopped, a SystemExit.
+                self.sleep(0.25)
         except SystemExit:
             print('exception')
         finally:
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+from urllib.parse import urljoin
+from requests import Response
+from pydhsfw.automl import (
+    AutoMLInferenceCache,
+    AutoMLMessageFactory,
+    AutoMLPredictRequest,
+    AutoMLPredictResponse,
+    AutoMLRequestWriter,
+    AutoMLResponseReader,
+)
+from pydhsfw.http import GetRequestMessage, Headers, parse_json
+
+
+def write(msgs: list, max_batch_size: int) -> list:
+    writer = AutoMLRequestWriter({'automl_max_batch_size': max_batch_size})
+    return writer.write_requests([msg.write() for msg in msgs])
+
+
+def request_ids(request) -> str:
+    return request.headers[Headers.DHS_REQUEST_ID.value]
+
+
+def sent_json(request) -> dict:
+    return json.loads(bytes(request.data))
+
+
+def server_response(request, predictions: list) -> Response:
+    """The server's response to request, which is prepared the way the transport sends it."""
+
+    request.url = urljoin('http://automl', request.url)
+    response = Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(json.dumps({'predictions': predictions}).encode())
+    response.request = request.prepare()
+    return response
+
+
+def test_default_sends_a_request_per_image():
+    msgs = [AutoMLPredictRequest(key, key.encode()) for key in 'abc']
+    requests = write(msgs, 1)
+    assert [request_ids(r) for r in requests] == [str(m.request_id) for m in msgs]
+
+
+def test_requests_are_combined_up_to_the_max_batch_size():
+    msgs = [AutoMLPredictRequest(key, key.encode()) for key in 'abcde']
+    requests = write(msgs, 2)
+    assert len(requests) == 3
+
+    assert request_ids(requests[0]) == f'{msgs[0].request_id},{msgs[1].request_id}'
+    assert request_ids(requests[2]) == str(msgs[4].request_id)
+    assert [i['key'] for i in sent_json(requests[1])['instances']] == ['c', 'd']
+    assert sent_json(requests[0])['params'] == [{'max_bounding_box_count': '10'}]
+    assert requests[0].headers[Headers.DHS_RESPONSE_TYPE_ID.value] == (
+        'automl_predict_response'
+    )
+
+
+def test_only_requests_with_the_same_params_are_combined():
+    msgs = [AutoMLPredictRequest(key, key.encode()) for key in 'abc']
+    msgs[1].body._params_json = b'[{"max_bounding_box_count": "1"}]'
+    get = GetRequestMessage('/v1/models/default')
+    requests = write(msgs[:2] + [get] + msgs[2:], 10)
+
+    assert [request_ids(r) for r in requests] == [
+        f'{msgs[0].request_id},{msgs[2].request_id}',
+        str(msgs[1].request_id),
+        str(get.request_id),
+    ]
+
+
+def test_combined_response_is_split_per_image():
+    msgs = [AutoMLPredictRequest(key, key.encode()) for key in 'ab']
+    (request,) = write(msgs, 2)
+    predictions = [
+        {'key': 'a', 'detection_scores': [0.1]},
+        {'key': 'b', 'detection_scores': [0.2]},
+    ]
+    parts = AutoMLResponseReader().read_responses(server_response(request, predictions))
+
+    factory = AutoMLMessageFactory()
+    responses = [factory.create_message(part) for part in parts]
+    assert all(isinstance(r, AutoMLPredictResponse) for r in responses)
+    assert [r.request_id for r in responses] == [m.request_id for m in msgs]
+    assert [r.image_key for r in responses] == ['a', 'b']
+    assert [r.get_score(0) for r in responses] == [0.1, 0.2]
+    assert parse_json(parts[1]) == {'predictions': [predictions[1]]}
+    assert parts[0].status_code == 200
+
+
+def test_single_image_response_is_passed_on():
+    msg = AutoMLPredictRequest('a', b'a')
+    (request,) = write([msg], 2)
+    response = server_response(request, [{'key': 'a'}])
+    assert AutoMLResponseReader().read_responses(response) == [response]
+
+
+def split(msgs: list, predictions: list) -> tuple:
+    """Sends msgs in one request, returns the parts of the server's response and the messages made from them."""
+
+    (request,) = write(msgs, len(msgs))
+    parts = AutoMLResponseReader().read_responses(server_response(request, predictions))
+    factory = AutoMLMessageFactory()
+    assert [request_ids(p.request) for p in parts] == [str(m.request_id) for m in msgs]
+    return parts, [factory.create_message(part) for part in parts]
+
+
+def test_missing_predictions_are_answered_with_an_error():
+    msgs = [AutoMLPredictRequest(key, key.encode()) for key in 'abc']
+    parts, responses = split(msgs, [{'key': 'a'}, {'key': 'c'}])
+    assert [r.image_key for r in responses] == ['a', 'b', 'c']
+    assert [p.status_code for p in parts] == [200, 502, 200]
+    assert [r.error for r in responses] == [
+        None,
+        'The response has no prediction for the image',
+        None,
+    ]
+    # The error response has no detections, like a prediction with nothing found.
+    assert len(responses[1].detection_scores) == 0
+
+
+def test_predictions_are_matched_by_key():
+    msgs = [AutoMLPredictRequest(key, key.encode()) for key in 'abca']
+    predictions = [
+        {'key': 'c', 'detection_scores': [0.3]},
+        {'key': 'x', 'detection_scores': [0.9]},
+        {'key': 'a', 'detection_scores': [0.1]},
+        {'key': 'a', 'detection_scores': [0.4]},
+    ]
+    parts, responses = split(msgs, predictions)
+    assert [r.image_key for r in responses] == ['a', 'b', 'c', 'a']
+    assert [len(r.detection_scores) and r.get_score(0) for r in responses] == [
+        0.1,
+        0,
+        0.3,
+        0.4,
+    ]
+    assert [p.status_code for p in parts] == [200, 502, 200, 200]
+
+
+def test_response_that_is_not_json_is_answered_with_errors():
+    msgs = [AutoMLPredictRequest(key, key.encode()) for key in 'ab']
+    (request,) = write(msgs, 2)
+    for body in (b'<html>Bad Gateway</html>', b'[]', b'{"predictions": "none"}'):
+        response = server_response(request, [])
+        response.raw = io.BytesIO(body)
+        parts = AutoMLResponseReader().read_responses(response)
+        responses = [AutoMLMessageFactory().create_message(p) for p in parts]
+        assert [r.request_id for r in responses] == [m.request_id for m in msgs]
+        assert [r.image_key for r in responses] == ['a', 'b']
+        assert [r.error for r in responses] == ['The response has no predictions'] * 2
+        assert [p.status_code for p in parts] == [502, 502]
+
+
+def test_split_responses_are_cached():
+    cache = AutoMLInferenceCache({'automl_cache_size': 10})
+    msgs = [AutoMLPredictRequest(key, key.encode()) for key in 'ab']
+    requests = write(msgs, 2)
+    # The transport looks every image up before the requests are combined.
+    for msg in msgs:
+        assert cache.get(msg.write()) is None
+    AutoMLResponseReader(cache).read_responses(
+        server_response(requests[0], [{'key': 'a'}, {'key': 'b'}])
+    )
+    assert len(cache) == 2
+
+
+def test_errors_are_not_cached():
+    cache = AutoMLInferenceCache({'automl_cache_size': 10})
+    msgs = [AutoMLPredictRequest(key, key.encode()) for key in 'ab']
+    requests = write(msgs, 2)
+    for msg in msgs:
+        assert cache.get(msg.write()) is None
+    AutoMLResponseReader(cache).read_responses(
+        server_response(requests[0], [{'key': 'a'}])
+    )
+    assert len(cache) == 1
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import base64
+import json
+from concurrent.futures import Future
+import numpy as np
+from pydhsfw.automl import AutoMLPredictBody, AutoMLPredictRequest
+
+PARAMS = [{'max_bounding_box_count': '10'}]
+
+
+def expected_json(instances: list, params=PARAMS) -> dict:
+    """The json of a predict request as it was built before the body was streamed."""
+
+    return {
+        'instances': [
+            {
+                'image_bytes': {'b64': base64.b64encode(bytes(image)).decode()},
+                'key': key,
+            }
+            for key, image in instances
+        ],
+        'params': params,
+    }
+
+
+def test_body_is_the_predict_json():
+    # Every length of the last base64 group, with and without padding.
+    for size in (0, 1, 2, 3, 4, 1000):
+        instances = [('image', (bytes(range(256)) * 4)[:size])]
+        body = AutoMLPredictBody(instances, PARAMS)
+        assert json.loads(bytes(body)) == expected_json(instances)
+        assert len(body) == len(bytes(body))
+
+
+def test_multiple_instances():
+    instances = [('a', b'first'), ('é "quoted"', b'second image'), ('c', b'')]
+    body = AutoMLPredictBody(instances, {'threshold': 0.5})
+    assert json.loads(bytes(body)) == expected_json(instances, {'threshold': 0.5})
+    assert len(body) == len(bytes(body))
+
+
+def test_large_images_are_encoded_a_chunk_at_a_time():
+    image = np.random.default_rng(1).integers(0, 256, 1000000, np.uint8).tobytes()
+    body = AutoMLPredictBody([('a', image), ('b', image[:10])], PARAMS)
+    chunks = list(body)
+    # The chunks of the first image, one for the small second image and the closing json.
+    assert len(chunks) == -(-len(image) // AutoMLPredictBody.CHUNK_SIZE) + 2
+    assert (
+        max(len(chunk) for chunk in chunks) < AutoMLPredictBody.CHUNK_SIZE * 4 // 3 + 64
+    )
+    assert json.loads(b''.join(chunks)) == expected_json(
+        [('a', image), ('b', image[:10])]
+    )
+    assert len(body) == sum(len(chunk) for chunk in chunks)
+    # The body can be sent again, e.g. when the request is retried.
+    assert list(body) == chunks
+
+
+def test_bytes_like_images():
+    image = bytes(range(100))
+    instances = [
+        ('bytearray', bytearray(image)),
+        ('memoryview', memoryview(image)[10:50]),
+        ('array', np.frombuffer(image, np.uint16)),
+    ]
+    body = AutoMLPredictBody(instances, PARAMS)
+    assert json.loads(bytes(body)) == expected_json(
+        [
+            ('bytearray', image),
+            ('memoryview', image[10:50]),
+            ('array', image),
+        ]
+    )
+    assert len(body) == len(bytes(body))
+
+
+def test_images_are_not_copied_when_the_body_is_created():
+    image = bytearray(b'before')
+    body = AutoMLPredictBody([('a', image)], PARAMS)
+    image[:] = b'after!'
+    assert json.loads(bytes(body)) == expected_json([('a', b'after!')])
+
+
+def test_preprocessed_images_are_waited_for():
+    future = Future()
+    body = AutoMLPredictBody([('a', b'x'), ('b', future)], PARAMS)
+    future.set_result(b'processed')
+    assert json.loads(bytes(body)) == expected_json([('a', b'x'), ('b', b'processed')])
+    assert body.instances == [('a', b'x'), ('b', b'processed')]
+
+
+def test_combine():
+    bodies = [AutoMLPredictBody([(key, key.encode())], PARAMS) for key in 'ab']
+    body = AutoMLPredictBody.combine(bodies)
+    assert body.instances == [('a', b'a'), ('b', b'b')]
+    assert body.params_json == bodies[0].params_json
+
+
+def test_predict_request_streams_the_body():
+    msg = AutoMLPredictRequest('a', b'image')
+    request = msg.write()
+    assert request.data is msg.body
+    assert request.headers['Content-Type'] == 'application/json'
+
+    request.url = 'http://automl' + request.url
+    prepared = request.prepare()
+    # The body is sent as it is iterated, with a Content-Length instead of chunked.
+    assert prepared.body is msg.body
+    assert prepared.headers['Content-Length'] == str(len(msg.body))
+    assert 'Transfer-Encoding' not in prepared.headers
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+from types import SimpleNamespace
+import pytest
+from requests import Response
+from pydhsfw import automl
+from pydhsfw.automl import (
+    AutoMLClientTransport,
+    AutoMLInferenceCache,
+    AutoMLPredictRequest,
+    AutoMLPredictResponse,
+)
+from pydhsfw.http import MessageRequestWriter, parse_json
+from pydhsfw.metrics import Metrics
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(automl, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def predict(key: str, image: bytes):
+    """Returns a predict request message and the request the connection writes for it."""
+
+    msg = AutoMLPredictRequest(key, image)
+    return msg, msg.write()
+
+
+def server_response(request, prediction: dict) -> Response:
+    response = Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(json.dumps({'predictions': [prediction]}).encode())
+    response.request = MessageRequestWriter().write_request(request)
+    return response
+
+
+def cache_prediction(cache: AutoMLInferenceCache, key: str, image: bytes, score=0.9):
+    _, request = predict(key, image)
+    assert cache.get(request) is None
+    cache.put(server_response(request, {'key': key, 'detection_scores': [score]}))
+
+
+def cached(cache: AutoMLInferenceCache, image: bytes) -> bool:
+    return cache.get(predict('lookup', image)[1]) is not None
+
+
+def test_disabled_by_default():
+    cache = AutoMLInferenceCache()
+    assert not cache.enabled
+    requests = [predict('a', b'image')[1]]
+    assert cache.respond(requests, lambda response: pytest.fail()) is requests
+
+
+def test_hit_is_relabelled_for_the_new_request():
+    cache = AutoMLInferenceCache({'automl_cache_size': 2})
+    cache_prediction(cache, 'first', b'image', 0.75)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    msg, request = predict('second', b'image')
+    response = cache.get(request)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # The cached prediction answers the new request, with its own request id and image key.
+    assert parse_json(response)['predictions'][0] == {
+        'key': 'second',
+        'detection_scores': [0.75],
+    }
+    predict_response = AutoMLPredictResponse.parse(response)
+    assert predict_response.request_id == msg.request_id
+    assert predict_response.image_key == 'second'
+    assert predict_response.get_score(0) == 0.75
+
+
+def test_different_image_or_params_miss():
+    cache = AutoMLInferenceCache({'automl_cache_size': 2})
+    cache_prediction(cache, 'a', b'image')
+
+    assert not cached(cache, b'other image')
+    _, request = predict('a', b'image')
+    request.data._params_json = b'[{"max_bounding_box_count": "1"}]'
+    assert cache.get(request) is None
+    assert (cache.hits, cache.misses) == (0, 3)
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = AutoMLInferenceCache({'automl_cache_size': 2, 'automl_cache_ttl': 10})
+    cache_prediction(cache, 'a', b'image')
+
+    clock.now += 10
+    assert cached(cache, b'image')
+    clock.now += 0.1
+    assert not cached(cache, b'image')
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AutoMLInferenceCache({'automl_cache_size': 2})
+    cache_prediction(cache, 'a', b'image a')
+    cache_prediction(cache, 'b', b'image b')
+
+    # Using a makes b the least recently used.
+    assert cached(cache, b'image a')
+    cache_prediction(cache, 'c', b'image c')
+
+    assert len(cache) == 2
+    assert cached(cache, b'image a')
+    assert cached(cache, b'image c')
+    assert not cached(cache, b'image b')
+
+
+def test_pending_requests_are_capped(monkeypatch):
+    monkeypatch.setattr(AutoMLInferenceCache, '_MAX_PENDING', 2)
+    cache = AutoMLInferenceCache({'automl_cache_size': 10})
+    requests = [predict(key, key.encode())[1] for key in ('a', 'b', 'c')]
+    for request in requests:
+        assert cache.get(request) is None
+
+    # The oldest request was forgotten, its response isn't cached.
+    cache.put(server_response(requests[0], {'key': 'a'}))
+    assert len(cache) == 0
+    cache.put(server_response(requests[2], {'key': 'c'}))
+    assert len(cache) == 1
+    assert cached(cache, b'c')
+
+
+def test_multi_image_requests_are_not_cached():
+    cache = AutoMLInferenceCache({'automl_cache_size': 2})
+    _, request = predict('a', b'image a')
+    request.data._instances.append(('b', b'image b'))
+    assert cache.get(request) is None
+    assert cache.misses == 0
+
+
+def test_respond_counts_hits_and_misses():
+    metrics = Metrics({'metrics_enabled': True})
+    cache = AutoMLInferenceCache({'automl_cache_size': 2})
+    cache.metrics = metrics
+    cache_prediction(cache, 'a', b'image')
+    hit = predict('b', b'image')[1]
+    miss = predict('c', b'other image')[1]
+
+    answered = []
+    assert cache.respond([hit, miss], lambda r: answered.append(r) or True) == [miss]
+    assert len(answered) == 1
+    assert metrics.get_counter(AutoMLInferenceCache.CACHE_HITS) == 1
+    assert metrics.get_counter(AutoMLInferenceCache.CACHE_MISSES) == 1
+
+    # A hit that can't be queued is sent instead.
+    assert cache.respond([hit], lambda r: False) == [hit]
+
+
+def test_transport_queues_hits_without_blocking():
+    cache = AutoMLInferenceCache({'automl_cache_size': 2})
+    cache_prediction(cache, 'a', b'image')
+    transport = AutoMLClientTransport(
+        'test',
+        'http://localhost:1',
+        {'response_queue_maxsize': 1},
+        cache,
+    )
+
+    msg, request = predict('b', b'image')
+    transport.send_many([request])
+    response = transport.receive()
+    assert AutoMLPredictResponse.parse(response).request_id == msg.request_id
+
+    # With the response queue full the hit isn't queued, the request is sent (and dropped, not connected) instead.
+    transport._response_queue.queue('full')
+    transport.send_many([predict('c', b'image')[1]])
+    assert transport._response_queue.fetch_many(10) == ['full']
+    assert cache.hits == 2
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import base64
+import io
+import json
+from concurrent.futures import Future
+import cv2
+import numpy as np
+import pytest
+from requests import Response
+from pydhsfw.automl import (
+    AutoMLImagePreprocessor,
+    AutoMLInferenceCache,
+    AutoMLPredictRequest,
+    _answer_and_preprocess,
+)
+from pydhsfw.http import GetRequestMessage, MessageRequestWriter
+
+
+def jpeg(width: int, height: int) -> bytes:
+    image = np.random.default_rng(1).integers(0, 256, (height, width, 3), np.uint8)
+    ok, encoded = cv2.imencode('.jpg', image)
+    assert ok
+    return encoded.tobytes()
+
+
+def decoded_size(image) -> tuple:
+    height, width = cv2.imdecode(
+        np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR
+    ).shape[:2]
+    return width, height
+
+
+@pytest.fixture
+def preprocessor():
+    preprocessor = AutoMLImagePreprocessor(
+        'test', {'automl_image_size': [320, 320], 'automl_image_quality': 80}
+    )
+    yield preprocessor
+    preprocessor.shutdown()
+
+
+def test_disabled_by_default():
+    preprocessor = AutoMLImagePreprocessor('test')
+    assert not preprocessor.enabled
+    request = AutoMLPredictRequest('a', b'image').write()
+    preprocessor.preprocess(request)
+    assert request.data.instances == [('a', b'image')]
+
+
+def test_single_size_is_square():
+    assert AutoMLImagePreprocessor('test', {'automl_image_size': 224})._size == (
+        224,
+        224,
+    )
+
+
+def test_image_is_shrunk_keeping_its_aspect_ratio(preprocessor):
+    image = jpeg(640, 480)
+    processed = preprocessor.process(image)
+    assert decoded_size(processed) == (320, 240)
+    assert len(processed) < len(image)
+
+
+def test_image_that_fits_is_sent_as_it_is(preprocessor):
+    image = jpeg(320, 100)
+    assert preprocessor.process(image) is image
+
+
+def test_undecodable_image_is_sent_as_it_is(preprocessor):
+    image = b'not an image'
+    assert preprocessor.process(image) is image
+
+
+def test_predict_request_images_are_preprocessed_in_the_pool(preprocessor):
+    image = jpeg(1280, 640)
+    request = AutoMLPredictRequest('a', image).write()
+    preprocessor.preprocess(request)
+    ((key, future),) = request.data._instances
+    assert key == 'a' and isinstance(future, Future)
+
+    sent = json.loads(bytes(request.data))
+    b64 = sent['instances'][0]['image_bytes']['b64']
+    assert decoded_size(base64.b64decode(b64)) == (320, 160)
+    assert sent['instances'][0]['key'] == 'a'
+
+
+def test_other_requests_are_left_alone(preprocessor):
+    request = GetRequestMessage('/v1/models/default').write()
+    data = request.data
+    preprocessor.preprocess(request)
+    assert request.data is data
+
+
+def test_cache_hits_are_not_preprocessed(preprocessor):
+    cache = AutoMLInferenceCache({'automl_cache_size': 2})
+    image = jpeg(640, 640)
+    first = AutoMLPredictRequest('a', image).write()
+    assert cache.get(first) is None
+    response = Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(json.dumps({'predictions': [{'key': 'a'}]}).encode())
+    response.request = MessageRequestWriter().write_request(first)
+    cache.put(response)
+
+    hit = AutoMLPredictRequest('b', image).write()
+    miss = AutoMLPredictRequest('c', jpeg(640, 480)).write()
+    answered = []
+    assert _answer_and_preprocess(
+        [hit, miss], cache, preprocessor, lambda r: answered.append(r) or True
+    ) == [miss]
+    assert len(answered) == 1
+    # The cache is keyed by the original image, only the image that is sent is preprocessed.
+    assert hit.data._instances == [('b', image)]
+    assert isinstance(miss.data._instances[0][1], Future)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import numpy as np
+import pytest
+from requests import Request, Response
+from pydhsfw.automl import AutoMLPredictResponse, boxes_to_pixels
+
+PREDICTION = {
+    'key': 'image-1',
+    'detection_scores': [0.5, 0.9, 0.7, 0.8],
+    'detection_boxes': [
+        [0.1, 0.2, 0.3, 0.4],
+        [0.5, 0.5, 0.6, 0.75],
+        [0.0, 0.0, 1.0, 1.0],
+        [0.25, 0.1, 0.75, 0.2],
+    ],
+    'detection_classes': [2, 1, 2, 3],
+    'detection_classes_as_text': ['pin', 'loop', 'pin', 'mitegen'],
+}
+
+
+def predict_response(prediction: dict = PREDICTION) -> AutoMLPredictResponse:
+    response = Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(json.dumps({'predictions': [prediction]}).encode())
+    response.request = Request('POST', '/v1/models/default:predict')
+    return AutoMLPredictResponse(response)
+
+
+def test_detections_keep_the_response_order():
+    msg = predict_response()
+    assert msg.detection_scores.tolist() == PREDICTION['detection_scores']
+    assert msg.detection_boxes.shape == (4, 4)
+    assert msg.detection_classes.tolist() == [2, 1, 2, 3]
+    assert msg.detection_classes_as_text.tolist() == ['pin', 'loop', 'pin', 'mitegen']
+    assert msg.image_key == 'image-1'
+
+
+def test_arrays_are_read_only():
+    msg = predict_response()
+    for array in (
+        msg.detection_scores,
+        msg.detection_boxes,
+        msg.detection_classes,
+        msg.detection_classes_as_text,
+    ):
+        with pytest.raises(ValueError):
+            array[0] = array[1]
+    # The arrays are parsed once and shared.
+    assert msg.detection_scores is msg.detection_scores
+
+
+def test_top_k():
+    msg = predict_response()
+    assert msg.top_k(2).tolist() == [1, 3]
+    assert msg.top_k(10).tolist() == [1, 3, 2, 0]
+    assert msg.top_k(2, 'pin').tolist() == [2, 0]
+    assert msg.top_k(2, 3).tolist() == [3]
+    assert msg.top_k(1, 'unknown').tolist() == []
+
+
+def test_top():
+    msg = predict_response()
+    assert msg.top() == 1
+    assert msg.top('pin') == 2
+    assert msg.top(3) == 3
+    assert msg.top('unknown') is None
+
+
+def test_empty_prediction():
+    msg = predict_response({'key': 'image-1'})
+    assert msg.detection_boxes.shape == (0, 4)
+    assert msg.top() is None
+
+
+def test_boxes_to_pixels():
+    msg = predict_response()
+    # minY, minX, maxY, maxX scale by height, width, height, width.
+    assert boxes_to_pixels([0.5, 0.25, 1.0, 0.75], 400, 200).tolist() == [
+        100,
+        100,
+        200,
+        300,
+    ]
+    assert msg.boxes_to_pixels(400, 200, 1).tolist() == [100, 200, 120, 300]
+    pixels = msg.boxes_to_pixels(400, 200)
+    assert pixels.shape == (4, 4)
+    assert np.allclose(pixels[2], [0, 0, 200, 400])
+    assert msg.boxes_to_pixels(400, 200, msg.top_k(2)).tolist() == [
+        [100, 200, 120, 300],
+        [50, 40, 150, 80],
+    ]
+
+
+def test_legacy_loop_and_pin_properties():
+    msg = predict_response()
+    msg.loop_num = msg.top('loop')
+    msg.pin_num = msg.top('pin')
+
+    assert msg.loop_top_score == 0.9
+    assert msg.loop_top_classification == 'loop'
+    assert msg.loop_top_bb == [0.5, 0.5, 0.6, 0.75]
+    assert (msg.loop_bb_minY, msg.loop_bb_minX, msg.loop_bb_maxY, msg.loop_bb_maxX) == (
+        0.5,
+        0.5,
+        0.6,
+        0.75,
+    )
+    assert (msg.pin_bb_minY, msg.pin_bb_minX, msg.pin_bb_maxY, msg.pin_bb_maxX) == (
+        0.0,
+        0.0,
+        1.0,
+        1.0,
+    )
+    assert msg.pin_base_x == 1.0
+    assert isinstance(msg.loop_bb_minY, float)
+    assert msg.get_score(3) == 0.8
+    assert msg.get_detection_class_as_text(3) == 'mitegen'
+    assert msg.get_detection_class_as_int(3) == 3
+
+
+def test_legacy_properties_need_a_detection_index():
+    msg = predict_response()
+    with pytest.raises(ValueError):
+        msg.loop_top_bb
+    with pytest.raises(ValueError):
+        msg.pin_bb_minX
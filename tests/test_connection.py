@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import socket
+import threading
+import time
+from pydhsfw.connection import (
+    AsyncConnectionBase,
+    Connection,
+    ConnectionConnectedMessage,
+    ConnectionDisconnectedMessage,
+)
+from pydhsfw.dcss import (
+    DcssActiveOperations,
+    DcssDhsV2MessageReaderWriter,
+    DcssHtoSLog,
+    DcssHtoSUpdateMotorPosition,
+    DcssMessageFactory,
+    DcssOutgoingMessageQueue,
+    DcssPackedMessage,
+)
+from pydhsfw.messages import AsyncIncomingMessageQueue, IncomingMessageQueue
+from pydhsfw.tcpip import TcpipClientTransport
+from pydhsfw.transport import AsyncTransport, Transport, TransportState
+
+
+class RecordingTransport(AsyncTransport):
+    """Records what the connection writes and when."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        super().__init__('test', 'test://', loop)
+        self.sent = []
+        self.paused = False
+
+    def start(self):
+        pass
+
+    def send(self, msg):
+        self.sent.append((time.monotonic(), msg))
+
+    def send_many(self, msgs: list):
+        for msg in msgs:
+            self.send(msg)
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+
+def run_for(loop: asyncio.AbstractEventLoop, seconds: float):
+    loop.run_until_complete(asyncio.sleep(seconds))
+
+
+def test_message_not_delayed_by_held_motor_update():
+    loop = asyncio.new_event_loop()
+    try:
+        transport = RecordingTransport(loop)
+        connection = AsyncConnectionBase(
+            'test',
+            'test://',
+            transport,
+            IncomingMessageQueue(),
+            DcssOutgoingMessageQueue(DcssActiveOperations(), motor_update_max_rate=1),
+            DcssMessageFactory(),
+            loop,
+        )
+
+        connection.send(DcssHtoSUpdateMotorPosition('m1', 1.0, 'moving'))
+        run_for(loop, 0.05)
+        # Rate limited to one update a second, this one is held back.
+        connection.send(DcssHtoSUpdateMotorPosition('m1', 2.5, 'moving'))
+        run_for(loop, 0.05)
+        assert len(transport.sent) == 1
+
+        log_time = time.monotonic()
+        connection.send(DcssHtoSLog('not held back'))
+        run_for(loop, 0.05)
+        assert len(transport.sent) == 2
+        sent_time, buffer = transport.sent[1]
+        assert b'not held back' in buffer
+        assert sent_time - log_time < 0.5
+
+        # The held update is still sent once the motor's interval has passed.
+        run_for(loop, 1.0)
+        assert len(transport.sent) == 3
+        assert b'm1 2.5' in transport.sent[2][1]
+    finally:
+        loop.close()
+
+
+def async_connection(
+    loop: asyncio.AbstractEventLoop,
+    incoming_message_queue: IncomingMessageQueue,
+    outgoing_maxsize: int = 0,
+) -> AsyncConnectionBase:
+    return AsyncConnectionBase(
+        'test',
+        'test://',
+        RecordingTransport(loop),
+        incoming_message_queue,
+        DcssOutgoingMessageQueue(DcssActiveOperations(), outgoing_maxsize),
+        DcssMessageFactory(),
+        loop,
+    )
+
+
+def test_queueing_to_a_full_queue_on_the_loop_does_not_block():
+    loop = asyncio.new_event_loop()
+    try:
+        queue = AsyncIncomingMessageQueue(loop, 1)
+        results = []
+
+        async def produce():
+            for n in range(3):
+                try:
+                    queue.queue(n)
+                    results.append(n)
+                except TimeoutError:
+                    results.append('full')
+
+        loop.run_until_complete(asyncio.wait_for(produce(), 5))
+        assert results == [0, 'full', 'full']
+        assert queue.fetch_many(10, 0) == [0]
+    finally:
+        loop.close()
+
+
+def test_producer_on_another_thread_waits_for_the_loop_to_make_room():
+    loop = asyncio.new_event_loop()
+    try:
+        queue = AsyncIncomingMessageQueue(loop, 1)
+        producer = threading.Thread(
+            target=lambda: [queue.queue(n, 5) for n in range(3)]
+        )
+        producer.start()
+
+        async def consume():
+            items = []
+            while len(items) < 3:
+                items += await queue.fetch_many_async(10)
+            return items
+
+        assert loop.run_until_complete(asyncio.wait_for(consume(), 5)) == [0, 1, 2]
+        producer.join(5)
+        assert not producer.is_alive()
+    finally:
+        loop.close()
+
+
+def test_full_incoming_queue_pauses_reading():
+    loop = asyncio.new_event_loop()
+    try:
+        queue = AsyncIncomingMessageQueue(loop, 2)
+        connection = async_connection(loop, queue)
+        transport = connection._transport
+        raw_msgs = [b'stoh_start_motor_move m%d 1.5' % n for n in range(5)]
+
+        async def receive():
+            for raw_msg in raw_msgs:
+                transport._received(raw_msg)
+
+        loop.run_until_complete(receive())
+        assert transport.paused
+        assert queue.qsize() == 2
+
+        async def consume():
+            names = []
+            while len(names) < len(raw_msgs):
+                for msg in await queue.fetch_many_async(1):
+                    names.append(msg.motor_name)
+                await asyncio.sleep(0)
+            return names
+
+        names = loop.run_until_complete(asyncio.wait_for(consume(), 5))
+        assert names == [f'm{n}' for n in range(5)]
+        run_for(loop, 0.01)
+        assert not transport.paused
+    finally:
+        loop.close()
+
+
+def test_send_on_the_loop_with_a_full_outgoing_queue():
+    loop = asyncio.new_event_loop()
+    try:
+        connection = async_connection(loop, IncomingMessageQueue(), outgoing_maxsize=1)
+
+        async def send():
+            for n in range(3):
+                connection.send(DcssHtoSLog(f'log {n}'))
+
+        loop.run_until_complete(asyncio.wait_for(send(), 5))
+        run_for(loop, 0.01)
+        sent = [buffer for _, buffer in connection._transport.sent]
+        assert len(sent) == 3
+        assert all(b'log %d' % n in buffer for n, buffer in enumerate(sent))
+    finally:
+        loop.close()
+
+
+def connection_messages(queue: IncomingMessageQueue) -> list:
+    try:
+        return [(type(msg), msg.connection_name) for msg in queue.fetch_many(100, 0)]
+    except TimeoutError:
+        return []
+
+
+def test_state_transitions_queue_connection_messages():
+    transport = Transport('test', 'test://')
+    queue = IncomingMessageQueue()
+    Connection('test', 'test://')._queue_state_messages(transport, queue)
+
+    for state in (TransportState.CONNECTING, TransportState.CONNECTED):
+        transport._state_machine.set_state(state)
+    assert connection_messages(queue) == [(ConnectionConnectedMessage, 'test')]
+
+    # Setting the same state again isn't a transition.
+    transport._state_machine.set_state(TransportState.CONNECTED)
+    for state in (TransportState.DISCONNECTING, TransportState.DISCONNECTED):
+        transport._state_machine.set_state(state)
+    assert connection_messages(queue) == [(ConnectionDisconnectedMessage, 'test')]
+
+    # A connection attempt that fails was never connected, so there is nothing to report.
+    for state in (TransportState.CONNECTING, TransportState.DISCONNECTED):
+        transport._state_machine.set_state(state)
+    assert connection_messages(queue) == []
+
+
+def wait_for_messages(queue: IncomingMessageQueue, count: int) -> list:
+    messages = []
+    end_time = time.monotonic() + 5
+    while len(messages) < count and time.monotonic() < end_time:
+        messages += connection_messages(queue)
+        time.sleep(0.01)
+    return [msg_type for msg_type, _ in messages]
+
+
+def test_tcpip_transport_connect_reconnect_and_disconnect():
+    server = socket.create_server(('127.0.0.1', 0))
+    transport = TcpipClientTransport(
+        'test',
+        f'dcss://127.0.0.1:{server.getsockname()[1]}',
+        DcssDhsV2MessageReaderWriter(),
+        DcssDhsV2MessageReaderWriter(),
+    )
+    queue = IncomingMessageQueue()
+    Connection('test', 'test://')._queue_state_messages(transport, queue)
+    received = []
+    # The read waits for the connection, without timing out while the transport is disconnected.
+    reader = threading.Thread(
+        target=lambda: received.append(transport.receive()), daemon=True
+    )
+    reader.start()
+    accepted = []
+    transport.start()
+    try:
+        transport.connect()
+        assert wait_for_messages(queue, 1) == [ConnectionConnectedMessage]
+        accepted.append(server.accept()[0])
+
+        accepted[0].sendall(bytes(DcssPackedMessage.from_text(b'stoh_abort_all soft')))
+        reader.join(5)
+        assert received[0].rstrip(b' ') == b'stoh_abort_all soft'
+
+        transport.reconnect()
+        assert wait_for_messages(queue, 2) == [
+            ConnectionDisconnectedMessage,
+            ConnectionConnectedMessage,
+        ]
+        accepted.append(server.accept()[0])
+
+        transport.disconnect()
+        assert wait_for_messages(queue, 1) == [ConnectionDisconnectedMessage]
+        assert transport.state == TransportState.DISCONNECTED
+    finally:
+        transport.shutdown()
+        transport.wait()
+        for sock in accepted + [server]:
+            sock.close()
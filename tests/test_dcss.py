@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+import threading
+from pydhsfw.dcss import (
+    DcssActiveOperation,
+    DcssActiveOperations,
+    DcssHtoSClientIsHardware,
+    DcssHtoSMotorMoveCompleted,
+    DcssHtoSOperationCompleted,
+    DcssHtoSUpdateMotorPosition,
+    DcssMessageFactory,
+    DcssMessageIn,
+    DcssOutgoingMessageQueue,
+    DcssStoHConfigureRealMotor,
+    DcssStoHRegisterPseudoMotor,
+    DcssStoHSetMotorChildren,
+    DcssStoHStartOperation,
+)
+
+CONFIGURE_REAL_MOTOR = (
+    b'stoh_configure_real_motor gonio_phi 12.5 360 -360 1000.0 2000 0.2 50 1 0 1 0 1'
+)
+
+
+def create_message(raw_msg: bytes):
+    return DcssMessageFactory().create_message(raw_msg)
+
+
+def count_splits(monkeypatch) -> list:
+    calls = []
+    split = DcssMessageIn._split
+
+    def counting_split(buffer):
+        calls.append(buffer)
+        return split(buffer)
+
+    monkeypatch.setattr(DcssMessageIn, '_split', staticmethod(counting_split))
+    return calls
+
+
+def test_message_is_split_once(monkeypatch):
+    calls = count_splits(monkeypatch)
+    msg = create_message(CONFIGURE_REAL_MOTOR)
+    assert isinstance(msg, DcssStoHConfigureRealMotor)
+    assert msg.motor_position == 12.5
+    assert msg.motor_backlashOn is False
+    assert len(calls) == 1
+
+
+def test_unknown_message_is_not_split(monkeypatch):
+    calls = count_splits(monkeypatch)
+    assert create_message(b'stog_unknown_command a b c') is None
+    assert calls == []
+
+
+def test_unknown_messages_are_counted_by_command():
+    factory = DcssMessageFactory()
+    for raw_msg in (
+        b'stog_unknown_command a b c',
+        memoryview(b'stog_unknown_command d'),
+        b'stog_other',
+    ):
+        assert factory.create_message(raw_msg) is None
+    assert factory.create_message(CONFIGURE_REAL_MOTOR) is not None
+    assert factory.unknown_type_ids == {b'stog_unknown_command': 2, b'stog_other': 1}
+    assert factory.unknown_message_count == 3
+
+
+def test_long_unknown_commands_are_not_scanned_in_full():
+    factory = DcssMessageFactory()
+    scan_len = factory._max_key_len + 1
+    assert factory.create_message(b'x' * 1000 + b' arg') is None
+    # The command is only read up to one byte past the longest registered command.
+    assert factory.unknown_type_ids == {b'x' * scan_len: 1}
+
+
+def test_message_from_memoryview():
+    msg = create_message(memoryview(CONFIGURE_REAL_MOTOR))
+    assert msg.motor_name == 'gonio_phi'
+
+
+def test_typed_arguments():
+    msg = create_message(CONFIGURE_REAL_MOTOR)
+    assert msg.motor_name == 'gonio_phi'
+    assert (msg.motor_position, msg.motor_upperLimit, msg.motor_lowerLimit) == (
+        12.5,
+        360.0,
+        -360.0,
+    )
+    assert isinstance(msg.motor_upperLimit, float)
+    assert msg.motor_scaleFactor == 1000.0
+    assert msg.motor_speed == 2000.0
+    assert msg.motor_acceleration == 0.2
+    assert msg.motor_backlash == 50.0
+    assert msg.motor_lowerLimitOn is True
+    assert msg.motor_upperLimitOn is False
+    assert msg.motor_motorLockOn is True
+    assert msg.motor_backlashOn is False
+    assert msg.motor_reverseOn is True
+
+
+def test_arguments_are_converted_once():
+    msg = create_message(CONFIGURE_REAL_MOTOR)
+    position = msg.motor_position
+    assert msg.__dict__['motor_position'] is position
+    assert msg.motor_position is position
+
+
+def test_rest_arguments():
+    msg = create_message(b'stoh_set_motor_children table table_vert table_horz')
+    assert isinstance(msg, DcssStoHSetMotorChildren)
+    assert msg.motor_children == ('table_vert', 'table_horz')
+
+    msg = create_message(b'stoh_start_operation getLoopTip 1.23 0 1.5')
+    assert isinstance(msg, DcssStoHStartOperation)
+    assert msg.operation_handle == '1.23'
+    assert msg.operation_args == ('0', '1.5')
+
+    msg = create_message(b'stoh_start_operation getLoopTip 1.24')
+    assert msg.operation_args == ()
+
+
+def test_register_pseudo_motor():
+    msg = create_message(b'stoh_register_pseudo_motor energy energy_hw')
+    assert isinstance(msg, DcssStoHRegisterPseudoMotor)
+    assert msg.pseudo_motor_name == 'energy'
+    assert msg.pseudo_motor_hardwareName == 'energy_hw'
+    assert DcssStoHRegisterPseudoMotor.pseudo_motor_name.__doc__
+
+
+def test_packed_message_bytes():
+    msg = DcssHtoSMotorMoveCompleted('gonio_phi', 0.1 + 0.2, 'normal')
+    text = b'htos_motor_move_completed gonio_phi 0.3 normal \x00'
+    # The header is the text length of 48 in 12 characters, the binary length of 0 in 13 and a space.
+    assert msg.write() == b'          48            0 ' + text
+    assert bytes(msg.write().text) == text[:-2]
+
+
+def test_float_arguments():
+    def written(position) -> bytes:
+        return bytes(DcssHtoSUpdateMotorPosition('m1', position, 'normal').write().text)
+
+    assert written(0.1 + 0.2) == b'htos_update_motor_position m1 0.3 normal'
+    assert written(-12.5) == b'htos_update_motor_position m1 -12.5 normal'
+    assert written(2.0) == b'htos_update_motor_position m1 2 normal'
+    assert written(1e-05) == b'htos_update_motor_position m1 1e-05 normal'
+    assert written(1234567890123456789.0) == (
+        b'htos_update_motor_position m1 1.23456789e+18 normal'
+    )
+    assert written(3) == b'htos_update_motor_position m1 3 normal'
+    assert str(DcssHtoSUpdateMotorPosition('m1', 0.1 + 0.2, 'normal')) == (
+        'htos_update_motor_position m1 0.3 normal'
+    )
+
+
+def test_float_precision_is_configurable(monkeypatch):
+    msg = DcssHtoSUpdateMotorPosition('m1', 1 / 3, 'normal')
+    assert b' 0.3333333333 ' in msg.write()
+    monkeypatch.setattr(DcssHtoSUpdateMotorPosition, 'float_precision', 3)
+    assert b' 0.333 ' in msg.write()
+    # Other messages keep the default.
+    assert (
+        b' 0.3333333333 ' in DcssHtoSMotorMoveCompleted('m1', 1 / 3, 'normal').write()
+    )
+
+
+def test_bool_arguments():
+    msg = DcssHtoSClientIsHardware('dhs')
+    msg._split_msg = ['htos_test', True, False]
+    assert bytes(msg.write().text) == b'htos_test 1 0'
+
+
+def operation(name: str, handle: str) -> DcssActiveOperation:
+    return DcssActiveOperation(name, handle, None)
+
+
+def handles(operations: list) -> list:
+    return sorted(op.operation_handle for op in operations)
+
+
+def active_operations(*operations) -> DcssActiveOperations:
+    store = DcssActiveOperations()
+    for op in operations:
+        store.add_operation(op)
+    return store
+
+
+def test_active_operations_lookup():
+    store = active_operations(
+        operation('moveSample', '1.1'),
+        operation('moveSample', '1.2'),
+        operation('getLoopTip', '1.3'),
+    )
+    assert len(store) == 3
+    assert handles(store.get_operations()) == ['1.1', '1.2', '1.3']
+    assert handles(store.get_operations('moveSample')) == ['1.1', '1.2']
+    assert handles(store.get_operations(operation_handle='1.3')) == ['1.3']
+    assert handles(store.get_operations('moveSample', '1.2')) == ['1.2']
+    assert store.get_operations('moveSample', '1.3') == []
+    assert store.get_operations('unknown') == []
+    assert store.get_operations(operation_handle='9.9') == []
+
+
+def test_adding_an_operation_again_replaces_it():
+    first = operation('moveSample', '1.1')
+    second = operation('moveSample', '1.1')
+    store = active_operations(first, second)
+    assert len(store) == 1
+    assert store.get_operations('moveSample')[0] is second
+    assert store.get_operations(operation_handle='1.1')[0] is second
+
+
+def test_removed_operations_leave_no_index_entries():
+    ops = [operation('moveSample', '1.1'), operation('getLoopTip', '1.1')]
+    store = active_operations(*ops, operation('moveSample', '1.2'))
+
+    store.remove_operation(ops[0])
+    assert handles(store.get_operations('moveSample')) == ['1.2']
+    assert [
+        op.operation_name for op in store.get_operations(operation_handle='1.1')
+    ] == ['getLoopTip']
+
+    store.remove_operations(store.get_operations())
+    assert len(store) == 0
+    assert (store._by_name, store._by_handle) == ({}, {})
+    # Removing an operation that isn't active is a no-op.
+    store.remove_operation(ops[1])
+
+
+def test_operation_completed_removes_the_active_operation():
+    store = active_operations(
+        operation('moveSample', '1.1'), operation('moveSample', '1.2')
+    )
+    queue = DcssOutgoingMessageQueue(store)
+    queue.queue(DcssHtoSOperationCompleted('moveSample', '1.1', 'normal', ''))
+    assert handles(store.get_operations()) == ['1.2']
+
+
+def test_active_operations_are_thread_safe():
+    store = DcssActiveOperations()
+
+    def add_and_remove(n: int):
+        for i in range(500):
+            op = operation(f'op{n}', f'{n}.{i}')
+            store.add_operation(op)
+            store.get_operations(f'op{n}')
+            store.remove_operation(op)
+
+    threads = [threading.Thread(target=add_and_remove, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(store) == 0
+    assert (store._by_name, store._by_handle) == ({}, {})
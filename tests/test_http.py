@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+from pydhsfw.connection import ConnectionWriteWorker
+from pydhsfw.http import (
+    GetRequestMessage,
+    HttpClientTransport,
+    MessageRequestWriter,
+    MessageResponseReader,
+    PooledSession,
+)
+from pydhsfw.messages import OutgoingMessageQueue, register_message
+from pydhsfw.transport import TransportState
+
+
+def test_session_timeout_defaults():
+    assert PooledSession().timeout is None
+    assert PooledSession({}, 3).timeout == 3
+
+
+def test_configured_timeout_phase_keeps_the_default_for_the_other():
+    assert PooledSession({'http_connect_timeout': 1}, 3).timeout == (1.0, 3.0)
+    assert PooledSession({'http_read_timeout': 2}, (4, 5)).timeout == (4.0, 2.0)
+    assert PooledSession(
+        {'http_connect_timeout': 1, 'http_read_timeout': 2}
+    ).timeout == (1.0, 2.0)
+    # Without a default the phase that isn't configured still gets a timeout.
+    connect_timeout, read_timeout = PooledSession({'http_connect_timeout': 1}).timeout
+    assert connect_timeout == 1.0 and read_timeout > 0
+
+
+def test_transport_requests_have_a_timeout():
+    def session_timeout(config):
+        transport = HttpClientTransport(
+            'test',
+            'http://localhost:1',
+            MessageResponseReader(),
+            MessageRequestWriter(),
+            config,
+        )
+        return transport._session.timeout
+
+    assert session_timeout({}) == 5.0
+    assert session_timeout({'thread_blocking_timeout': 2}) == 2
+    assert session_timeout({'http_read_timeout': 30}) == (5.0, 30.0)
+
+
+@register_message('hung_get_request')
+class HungGetRequest(GetRequestMessage):
+    def __init__(self):
+        super().__init__('/hung')
+
+
+def test_abort_wakes_write_worker_blocked_by_a_hung_server():
+    server = socket.create_server(('127.0.0.1', 0))
+    accepted = []
+    threading.Thread(target=lambda: accepted.append(server.accept()[0])).start()
+    transport = HttpClientTransport(
+        'test',
+        f'http://127.0.0.1:{server.getsockname()[1]}',
+        MessageResponseReader(),
+        MessageRequestWriter(),
+        {'thread_blocking_timeout': 30},
+    )
+    transport._state_machine.set_state(TransportState.CONNECTED)
+    outgoing_queue = OutgoingMessageQueue()
+    worker = ConnectionWriteWorker('test', transport, outgoing_queue)
+    try:
+        # The server never answers, the second request waits for the first.
+        outgoing_queue.queue(HungGetRequest())
+        outgoing_queue.queue(HungGetRequest())
+        worker.start()
+        end_time = time.monotonic() + 5
+        while not accepted and time.monotonic() < end_time:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        assert accepted and worker.is_alive()
+
+        start = time.monotonic()
+        worker.abort()
+        worker.join(1)
+        assert not worker.is_alive()
+        assert time.monotonic() - start < 1
+    finally:
+        worker.abort()
+        transport.shutdown()
+        for sock in accepted + [server]:
+            sock.close()
+        transport._request_executor.shutdown()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import socket
+import threading
+import time
+from functools import partial
+import pytest
+from pydhsfw.http import RequestQueue
+from pydhsfw.jpeg_receiver import (
+    AsyncJpegReceiverServerTransport,
+    HttpAbortableServer,
+    JpegReceiverMessageRequestReader,
+    JpegReceiverRequestHandler,
+)
+
+SHORT_POST = (
+    b'POST /image HTTP/1.1\r\nContent-Type: image/jpeg\r\nContent-Length: 100\r\n\r\n'
+    + b'\xff\xd8' * 10
+)
+
+
+BAD_LENGTH_POSTS = [
+    b'POST /image HTTP/1.1\r\nContent-Type: image/jpeg\r\nContent-Length: '
+    + length
+    + b'\r\n\r\n\xff\xd8'
+    for length in (b'abc', b'-2', b'1.5', b'\xd9\xa2')
+]
+
+
+def post(port: int, raw_request: bytes) -> bytes:
+    """Send a raw request, stop sending and return the response."""
+
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+        sock.sendall(raw_request)
+        sock.shutdown(socket.SHUT_WR)
+        response = b''
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                return response
+            response += data
+
+
+def test_bind_failure_raises_os_error():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1)
+        port = sock.getsockname()[1]
+
+        # The bind error, not an AttributeError from server_close() cleaning up after it.
+        with pytest.raises(OSError):
+            HttpAbortableServer(('127.0.0.1', port), JpegReceiverRequestHandler)
+
+
+def post_threaded(raw_request: bytes) -> tuple:
+    """Post to a threaded server, returns the response and what the server queued."""
+
+    request_queue = RequestQueue()
+    server = HttpAbortableServer(
+        ('127.0.0.1', 0), partial(JpegReceiverRequestHandler, request_queue, 1024)
+    )
+    thread = threading.Thread(target=server.serve_forever, args=(None,))
+    thread.start()
+    try:
+        response = post(server.server_address[1], raw_request)
+    finally:
+        server.shutdown()
+        thread.join(5)
+        server.server_close()
+
+    received = []
+    while request_queue.qsize():
+        received.append(request_queue.fetch())
+    return response, received
+
+
+def post_asyncio(raw_request: bytes) -> tuple:
+    """Post to an asyncio server, returns the response and what the server received."""
+
+    loop = asyncio.new_event_loop()
+    try:
+        transport = AsyncJpegReceiverServerTransport(
+            'test', 'http://127.0.0.1:0', JpegReceiverMessageRequestReader(), loop
+        )
+        received = []
+        transport.set_receive_callback(received.append)
+        transport._connect()
+        loop.run_until_complete(asyncio.sleep(0.1))
+        # Port 0 picks a free port for each interface, use the IPv4 one.
+        port = next(
+            sock.getsockname()[1]
+            for sock in transport._server.sockets
+            if sock.family == socket.AF_INET
+        )
+
+        response = loop.run_until_complete(
+            loop.run_in_executor(None, post, port, raw_request)
+        )
+        transport._disconnect()
+        loop.run_until_complete(asyncio.sleep(0.1))
+    finally:
+        loop.close()
+
+    return response, received
+
+
+@pytest.mark.parametrize('post_to_server', [post_threaded, post_asyncio])
+def test_short_body_is_rejected(post_to_server):
+    response, received = post_to_server(SHORT_POST)
+    assert response.startswith(b'HTTP/1.1 400')
+    assert received == []
+
+
+@pytest.mark.parametrize('post_to_server', [post_threaded, post_asyncio])
+@pytest.mark.parametrize('raw_request', BAD_LENGTH_POSTS)
+def test_invalid_content_length_is_rejected(post_to_server, raw_request):
+    response, received = post_to_server(raw_request)
+    assert response.startswith(b'HTTP/1.1 400')
+    assert received == []
+
+
+@pytest.mark.parametrize('post_to_server', [post_threaded, post_asyncio])
+def test_body_is_received(post_to_server):
+    body = bytes(range(256)) * 2
+    response, received = post_to_server(
+        b'POST /image HTTP/1.1\r\nContent-Type: image/jpeg\r\nContent-Length: 512\r\n'
+        b'Connection: close\r\n\r\n' + body
+    )
+    assert response.startswith(b'HTTP/1.1 200')
+    assert len(received) == 1
+    assert bytes(received[0].data) == body
+    assert received[0].path == '/image'
+
+
+KEEP_ALIVE_POST = (
+    b'POST /image HTTP/1.1\r\nContent-Type: image/jpeg\r\nContent-Length: 2\r\n\r\n'
+    + b'\xff\xd8'
+)
+
+
+def start_server(max_workers: int) -> tuple:
+    request_queue = RequestQueue()
+    server = HttpAbortableServer(
+        ('127.0.0.1', 0),
+        partial(JpegReceiverRequestHandler, request_queue, 1024),
+        max_workers=max_workers,
+    )
+    thread = threading.Thread(target=server.serve_forever, args=(None,))
+    thread.start()
+    return server, thread, request_queue
+
+
+def stop_server(server: HttpAbortableServer, thread: threading.Thread):
+    server.shutdown()
+    thread.join(5)
+    server.server_close()
+
+
+def read_response(sock: socket.socket) -> bytes:
+    """Read the head of a response, the connection stays open."""
+
+    response = b''
+    while b'\r\n\r\n' not in response:
+        data = sock.recv(4096)
+        if not data:
+            break
+        response += data
+    return response
+
+
+def test_connections_beyond_max_workers_wait_for_a_worker():
+    server, thread, request_queue = start_server(1)
+    port = server.server_address[1]
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=5) as first:
+            first.sendall(KEEP_ALIVE_POST)
+            assert read_response(first).startswith(b'HTTP/1.1 200')
+
+            # The idle keep-alive connection holds the only worker, the second connection waits for it.
+            with socket.create_connection(('127.0.0.1', port), timeout=5) as second:
+                second.sendall(KEEP_ALIVE_POST)
+                second.settimeout(0.3)
+                with pytest.raises(socket.timeout):
+                    second.recv(4096)
+
+                first.close()
+                second.settimeout(5)
+                assert read_response(second).startswith(b'HTTP/1.1 200')
+    finally:
+        stop_server(server, thread)
+
+    assert request_queue.fetch(5) and request_queue.fetch(5)
+
+
+def test_server_close_returns_with_an_idle_keep_alive_connection():
+    server, thread, request_queue = start_server(2)
+    with socket.create_connection(('127.0.0.1', server.server_address[1])) as sock:
+        sock.settimeout(5)
+        sock.sendall(KEEP_ALIVE_POST)
+        assert read_response(sock).startswith(b'HTTP/1.1 200')
+        assert request_queue.fetch(5).data == b'\xff\xd8'
+
+        start = time.monotonic()
+        stop_server(server, thread)
+        assert not thread.is_alive()
+        # The idle connection is closed instead of being left open until the handler times out.
+        assert sock.recv(4096) == b''
+        assert time.monotonic() - start < 1
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+import pytest
+from pydhsfw.messages import (
+    AsyncIncomingMessageQueue,
+    BlockingQueue,
+    MessageCodec,
+    MessageFactory,
+    MessageIn,
+    QueueFullError,
+    QueueFullPolicy,
+    register_message,
+)
+
+
+def full_queue(policy: QueueFullPolicy) -> BlockingQueue:
+    queue = BlockingQueue(2, policy)
+    queue.queue(1)
+    queue.queue(2)
+    return queue
+
+
+def test_drop_oldest_when_full():
+    queue = full_queue(QueueFullPolicy.DROP_OLDEST)
+    queue.queue(3)
+    assert queue.fetch_many(10) == [2, 3]
+
+
+def test_drop_newest_when_full():
+    queue = full_queue(QueueFullPolicy.DROP_NEWEST)
+    queue.queue(3)
+    assert queue.fetch_many(10) == [1, 2]
+
+
+def test_raise_when_full():
+    queue = full_queue(QueueFullPolicy.RAISE)
+    with pytest.raises(QueueFullError):
+        queue.queue(3)
+    assert queue.fetch_many(10) == [1, 2]
+
+
+def test_block_when_full_times_out():
+    queue = full_queue(QueueFullPolicy.BLOCK)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        queue.queue(3, 0.1)
+    assert time.monotonic() - start >= 0.1
+    assert queue.qsize() == 2
+
+
+def test_block_when_full_waits_for_room():
+    queue = full_queue(QueueFullPolicy.BLOCK)
+    producer = threading.Thread(target=queue.queue, args=(3, 5))
+    producer.start()
+    time.sleep(0.1)
+    # The producer is still waiting for room.
+    assert producer.is_alive()
+
+    assert queue.fetch(1) == 1
+    producer.join(5)
+    assert not producer.is_alive()
+    assert queue.fetch_many(10) == [2, 3]
+
+
+def test_policy_from_config_string():
+    queue = BlockingQueue(1, 'drop_newest')
+    queue.queue(1)
+    queue.queue(2)
+    assert queue.fetch() == 1
+
+
+def test_fetch_times_out_when_empty():
+    queue = BlockingQueue()
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        queue.fetch(0.1)
+    with pytest.raises(TimeoutError):
+        queue.fetch_many(10, 0)
+    assert time.monotonic() - start >= 0.1
+
+
+def test_fetch_wakes_up_when_item_queued():
+    queue = BlockingQueue()
+    threading.Timer(0.05, queue.queue, args=('item',)).start()
+    assert queue.fetch(5) == 'item'
+
+
+def test_fetch_many_returns_items_in_order():
+    queue = BlockingQueue()
+    for i in range(5):
+        queue.queue(i)
+    assert queue.fetch_many(3) == [0, 1, 2]
+    assert queue.fetch_many(3) == [3, 4]
+    assert queue.qsize() == 0
+
+
+def test_no_items_lost_with_several_producers_and_consumers():
+    producers, consumers, count = 4, 4, 2000
+    queue = BlockingQueue(16)
+    fetched = []
+    fetched_lock = threading.Lock()
+
+    def produce(producer):
+        for i in range(count):
+            queue.queue((producer, i), 5)
+
+    def consume(batch):
+        while True:
+            items = queue.fetch_many(batch, 5) if batch else [queue.fetch(5)]
+            stops = items.count(None)
+            with fetched_lock:
+                fetched.extend(item for item in items if item is not None)
+            if stops:
+                # A batch can take another consumer's stop marker, hand it back.
+                for _ in range(stops - 1):
+                    queue.queue(None, 5)
+                return
+
+    consumer_threads = [
+        threading.Thread(target=consume, args=(i % 2 * 8,)) for i in range(consumers)
+    ]
+    producer_threads = [
+        threading.Thread(target=produce, args=(i,)) for i in range(producers)
+    ]
+    for thread in consumer_threads + producer_threads:
+        thread.start()
+    for thread in producer_threads:
+        thread.join(30)
+    for _ in consumer_threads:
+        queue.queue(None, 5)
+    for thread in consumer_threads:
+        thread.join(30)
+
+    assert not any(t.is_alive() for t in consumer_threads + producer_threads)
+    assert sorted(fetched) == [(p, i) for p in range(producers) for i in range(count)]
+    assert queue.qsize() == 0
+
+
+@register_message('test_messages_hello', 'test_messages')
+class Hello(MessageIn):
+    def __init__(self, text):
+        self.text = text
+
+    @classmethod
+    def parse(cls, buffer):
+        return cls(buffer)
+
+
+class WordCodec(MessageCodec):
+    """Type id is the first word of a str message."""
+
+    def __init__(self):
+        self.decoded = []
+
+    def read_key(self, raw_msg: str, max_key_len: int) -> str:
+        return raw_msg.split(' ', 1)[0]
+
+    def decode(self, msg_cls, raw_msg: str):
+        self.decoded.append(raw_msg)
+        return super().decode(msg_cls, raw_msg)
+
+
+class WordFactory(MessageFactory):
+    def __init__(self):
+        super().__init__('test_messages')
+
+    def _parse_type_id(self, raw_msg: str) -> str:
+        return raw_msg.split(' ', 1)[0]
+
+
+def test_factory_counts_unknown_type_ids():
+    factory = WordFactory()
+    assert isinstance(factory.create_message('test_messages_hello world'), Hello)
+    assert factory.create_message('goodbye world') is None
+    assert factory.create_message('goodbye again') is None
+    assert factory.create_message('other') is None
+    assert factory.unknown_type_ids == {'goodbye': 2, 'other': 1}
+    assert factory.unknown_message_count == 3
+
+
+def test_codec_only_decodes_known_messages():
+    codec = WordCodec()
+    factory = MessageFactory('test_messages', codec)
+    msg = factory.create_message('test_messages_hello world')
+    assert msg.text == 'test_messages_hello world'
+    assert factory.create_message('goodbye world') is None
+    assert codec.decoded == ['test_messages_hello world']
+    assert factory.unknown_type_ids == {'goodbye': 1}
+
+
+def test_unknown_type_ids_is_a_copy():
+    factory = WordFactory()
+    factory.create_message('goodbye')
+    factory.unknown_type_ids.clear()
+    assert factory.unknown_message_count == 1
+
+
+def fetch_async(loop, queue: AsyncIncomingMessageQueue, max_items=10) -> list:
+    return loop.run_until_complete(
+        asyncio.wait_for(queue.fetch_many_async(max_items), 5)
+    )
+
+
+def test_fetch_many_async_returns_queued_items():
+    loop = asyncio.new_event_loop()
+    try:
+        queue = AsyncIncomingMessageQueue(loop)
+        queue.queue(1)
+        queue.queue(2)
+        queue.queue(3)
+        assert fetch_async(loop, queue, 2) == [1, 2]
+        assert fetch_async(loop, queue) == [3]
+    finally:
+        loop.close()
+
+
+def test_fetch_many_async_wakes_up_when_queued_from_another_thread():
+    loop = asyncio.new_event_loop()
+    try:
+        queue = AsyncIncomingMessageQueue(loop)
+        threading.Timer(0.05, queue.queue, args=('threaded',)).start()
+        assert fetch_async(loop, queue) == ['threaded']
+        # A second wait isn't woken by the first wakeup.
+        threading.Timer(0.05, queue.queue, args=('again',)).start()
+        assert fetch_async(loop, queue) == ['again']
+    finally:
+        loop.close()
+
+
+def test_fetch_many_async_wakes_up_when_queued_on_the_loop():
+    loop = asyncio.new_event_loop()
+    try:
+        queue = AsyncIncomingMessageQueue(loop)
+        loop.call_later(0.05, queue.queue, 'looped')
+        assert fetch_async(loop, queue) == ['looped']
+    finally:
+        loop.close()
+
+
+def test_wait_not_full_async_wakes_up_when_fetched_from_another_thread():
+    loop = asyncio.new_event_loop()
+    try:
+        queue = AsyncIncomingMessageQueue(loop, 1)
+        queue.queue(1)
+        threading.Timer(0.05, queue.fetch).start()
+        loop.run_until_complete(asyncio.wait_for(queue.wait_not_full_async(), 5))
+        assert queue.qsize() == 0
+    finally:
+        loop.close()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import json
+from pydhsfw.messages import MessageIn
+from pydhsfw.metrics import Histogram, Metrics, stamp_message, take_message_stamp
+
+
+class Message(MessageIn):
+    _type_id = 'test_metrics_message'
+
+
+def histogram(*values) -> Histogram:
+    histogram = Histogram()
+    for value in values:
+        histogram.observe(value)
+    return histogram
+
+
+def test_buckets():
+    assert Histogram.BUCKETS[0] == 1e-6
+    assert Histogram.BUCKETS[-1] == 10
+    assert len(Histogram.BUCKETS) == 22
+    assert list(Histogram.BUCKETS) == sorted(Histogram.BUCKETS)
+
+
+def test_empty_histogram():
+    h = Histogram()
+    assert h.percentile(0.5) is None
+    assert h.mean is None
+    assert h.to_dict()['buckets'] == {}
+
+
+def test_percentile_is_the_upper_bound_of_its_bucket():
+    # 90 fast values in the 1ms bucket and 10 slow ones in the 50ms bucket.
+    h = histogram(*([0.0008] * 90 + [0.03] * 10))
+    assert h.percentile(0.5) == 0.001
+    assert h.percentile(0.9) == 0.001
+    assert h.percentile(0.91) == 0.03
+    assert h.percentile(0.99) == 0.03
+    assert (h.count, h.min, h.max) == (100, 0.0008, 0.03)
+    assert abs(h.mean - (0.0008 * 90 + 0.03 * 10) / 100) < 1e-12
+
+
+def test_percentile_is_capped_at_the_largest_value():
+    h = histogram(0.0011, 0.0012)
+    # Both values fall in the 2ms bucket.
+    assert h.percentile(0.5) == 0.0012
+    assert h.percentile(1) == 0.0012
+
+
+def test_values_on_a_bucket_bound_are_in_that_bucket():
+    h = histogram(0.001)
+    assert h.to_dict()['buckets'] == {'0.001': 1}
+
+
+def test_values_larger_than_the_last_bucket():
+    h = histogram(1.0, 60.0)
+    assert h.percentile(0.5) == 1.0
+    assert h.percentile(0.99) == 60.0
+    assert h.to_dict()['buckets'] == {'1.0': 1, 'inf': 1}
+
+
+def test_disabled_by_default():
+    assert not Metrics().enabled
+    metrics = Metrics({'metrics_enabled': True, 'handler_deadline': 0.5})
+    assert metrics.enabled
+    assert metrics.handler_deadline == 0.5
+
+
+def test_counters():
+    metrics = Metrics()
+    metrics.increment('sent')
+    metrics.increment('sent', count=2)
+    metrics.increment('sent', 'a')
+    assert metrics.get_counter('sent') == 3
+    assert metrics.get_counter('sent', 'a') == 1
+    assert metrics.get_counter('sent', 'b') == 0
+    assert metrics.get_counter('unknown') == 0
+
+
+def test_observe_keeps_a_histogram_per_stage_and_type_id():
+    metrics = Metrics()
+    metrics.observe(Metrics.HANDLER, 'a', 0.1)
+    metrics.observe(Metrics.HANDLER, 'a', 0.3)
+    metrics.observe(Metrics.HANDLER, 'b', 0.2)
+    assert metrics.get_histogram(Metrics.HANDLER, 'a').count == 2
+    assert metrics.get_histogram(Metrics.HANDLER, 'b').count == 1
+    assert metrics.get_histogram(Metrics.TRANSPORT_READ, 'a') is None
+
+
+def test_message_pipeline_hooks():
+    metrics = Metrics({'metrics_enabled': True, 'handler_deadline': 0})
+    msg = Message()
+    metrics.message_received(msg, 1.0, 1.5)
+    metrics.message_received(None, None, 2.0)
+    start = metrics.handler_started(msg)
+    assert metrics.handler_finished(msg, start) >= 0
+    metrics.handler_finished(msg, metrics.handler_started(msg), failed=True)
+
+    type_id = Message.get_type_id()
+    assert metrics.get_histogram(Metrics.TRANSPORT_READ, type_id).total == 0.5
+    assert metrics.get_histogram(Metrics.FACTORY_CREATE, type_id).count == 1
+    # Only the first handler sees the queue stamp.
+    assert metrics.get_histogram(Metrics.INCOMING_QUEUE_WAIT, type_id).count == 1
+    assert metrics.get_histogram(Metrics.HANDLER, type_id).count == 2
+    assert metrics.get_counter(Metrics.MESSAGES_RECEIVED, type_id) == 1
+    assert metrics.get_counter(Metrics.MESSAGES_UNKNOWN) == 1
+    assert metrics.get_counter(Metrics.MESSAGES_HANDLED, type_id) == 1
+    assert metrics.get_counter(Metrics.HANDLER_ERRORS, type_id) == 1
+    assert metrics.get_counter(Metrics.HANDLER_DEADLINE_EXCEEDED, type_id) == 2
+
+
+def test_messages_sent_share_the_write_time():
+    metrics = Metrics()
+    msgs = [Message(), Message()]
+    for msg in msgs:
+        stamp_message(msg, 0.0)
+    metrics.messages_sent(msgs, 1.0)
+
+    type_id = Message.get_type_id()
+    assert metrics.get_histogram(Metrics.OUTGOING_QUEUE_WAIT, type_id).total == 2.0
+    write = metrics.get_histogram(Metrics.TRANSPORT_WRITE, type_id)
+    assert write.count == 2
+    assert write.max == write.min
+    assert metrics.get_counter(Metrics.MESSAGES_SENT, type_id) == 2
+
+
+def test_message_stamps():
+    msg = Message()
+    assert take_message_stamp(msg) is None
+    stamp_message(msg, 5.0)
+    assert take_message_stamp(msg) == 5.0
+    assert take_message_stamp(msg) is None
+
+    class Slotted:
+        __slots__ = ()
+
+    stamp_message(Slotted())
+    assert take_message_stamp(Slotted()) is None
+
+
+def test_snapshot():
+    metrics = Metrics({'metrics_enabled': True})
+    metrics.observe(Metrics.HANDLER, 'a', 0.004)
+    metrics.increment(Metrics.MESSAGES_SENT, 'a', 2)
+    metrics.increment(Metrics.MESSAGES_UNKNOWN)
+    metrics.register_gauge('depth', lambda: 7)
+    metrics.register_gauge('broken', lambda: 1 / 0)
+
+    snapshot = json.loads(metrics.to_json())
+    assert snapshot['enabled'] is True
+    handler = snapshot['stages'][Metrics.HANDLER]['a']
+    assert (handler['count'], handler['p50'], handler['max']) == (1, 0.004, 0.004)
+    assert snapshot['counters'] == {
+        Metrics.MESSAGES_SENT: {'a': 2},
+        Metrics.MESSAGES_UNKNOWN: {'total': 1},
+    }
+    # A gauge that fails is left out.
+    assert snapshot['gauges'] == {'depth': 7}
+
+    text = metrics.to_text()
+    assert 'handler' in text and 'gauge depth' in text
+
+    metrics.unregister_gauge('depth')
+    metrics.reset()
+    assert metrics.snapshot()['stages'] == {}
+    assert metrics.snapshot()['counters'] == {}
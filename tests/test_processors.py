@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import queue
+import threading
+from functools import partial
+import pytest
+from pydhsfw.dcss import (
+    DcssActiveOperations,
+    DcssContext,
+    DcssOperationHandlerRegistry,
+    DcssMessageFactory,
+    DcssMessageQueueDispatcher,
+    DcssStoHStartOperation,
+    dcss_message_key,
+    register_dcss_start_operation_handler,
+)
+from pydhsfw.messages import (
+    AsyncIncomingMessageQueue,
+    IncomingMessageQueue,
+    MessageIn,
+    register_message,
+)
+from pydhsfw.processors import (
+    Context,
+    DispatcherRegistry,
+    MessageHandlerRegistry,
+    MessageQueueDispatcher,
+    register_dispatcher,
+    register_message_handler,
+)
+from pydhsfw.threads import EventLoopWorker
+
+
+@register_message('test_processors_ping', 'test_processors')
+class Ping(MessageIn):
+    def __init__(self, value=None):
+        self.value = value
+
+
+@register_message('test_processors_pong', 'test_processors')
+class Pong(MessageIn):
+    pass
+
+
+@register_message('test_processors_late')
+class Late(MessageIn):
+    """Not registered with a factory, so it isn't in the dispatch table compiled at start."""
+
+
+@pytest.fixture(autouse=True)
+def registries(monkeypatch):
+    """Keeps the handlers and dispatchers the tests register out of the global registries."""
+
+    monkeypatch.setattr(MessageHandlerRegistry, '_registry', {})
+    monkeypatch.setattr(DcssOperationHandlerRegistry, '_registry', {})
+    monkeypatch.setattr(DispatcherRegistry, '_registry', {})
+
+
+def dispatcher(name: str, **kwargs) -> MessageQueueDispatcher:
+    dispatcher = MessageQueueDispatcher(
+        name, IncomingMessageQueue(), Context(), **kwargs
+    )
+    dispatcher._compile_dispatch_table()
+    return dispatcher
+
+
+def test_every_handler_is_called_in_registration_order():
+    calls = []
+
+    @register_message_handler('test_processors_ping', 'fan_out')
+    def first(message: Ping, context: Context):
+        calls.append(('first', message.value))
+
+    @register_message_handler('test_processors_ping', 'fan_out')
+    def second(message: Ping, context: Context):
+        calls.append(('second', message.value))
+
+    dispatcher('fan_out').process_message(Ping(1))
+    assert calls == [('first', 1), ('second', 1)]
+
+
+def test_bound_methods_and_partials_are_handlers():
+    calls = []
+
+    class Handler:
+        def on_ping(self, message: Ping, context: Context):
+            calls.append(('method', context))
+
+    def on_ping(tag, message: Ping, context: Context):
+        calls.append((tag, context))
+
+    register_message_handler('test_processors_ping', 'callables')(Handler().on_ping)
+    register_message_handler('test_processors_ping', 'callables')(
+        partial(on_ping, 'partial')
+    )
+
+    disp = dispatcher('callables')
+    disp.process_message(Ping())
+    assert calls == [('method', disp._context), ('partial', disp._context)]
+
+
+def test_handler_signature_is_checked():
+    def no_context(message: Ping):
+        pass
+
+    def wrong_message_type(message: int, context: Context):
+        pass
+
+    for handler in (no_context, wrong_message_type, 'not callable'):
+        with pytest.raises(TypeError):
+            register_message_handler('test_processors_ping', 'bad_signature')(handler)
+
+
+def test_dispatch_table_is_compiled_at_start():
+    @register_message_handler('test_processors_ping', 'compiled')
+    def on_ping(message: Ping, context: Context):
+        pass
+
+    disp = dispatcher('compiled')
+    assert len(disp._dispatch_table[Ping]) == 1
+    # Messages without handlers get an empty entry, so they cost a single lookup as well.
+    assert disp._dispatch_table[Pong] == ()
+
+
+def test_unknown_message_class_is_compiled_when_first_seen():
+    calls = []
+
+    @register_message_handler('test_processors_late', 'late')
+    def on_late(message: Late, context: Context):
+        calls.append(message)
+
+    disp = dispatcher('late')
+    assert Late not in disp._dispatch_table
+    msg = Late()
+    disp.process_message(msg)
+    disp.process_message(msg)
+    assert Late in disp._dispatch_table
+    assert calls == [msg, msg]
+
+
+def test_coroutine_handler_runs_to_completion_in_threaded_mode():
+    calls = []
+
+    @register_message_handler('test_processors_ping', 'coroutines')
+    async def on_ping(message: Ping, context: Context):
+        await asyncio.sleep(0)
+        calls.append(message.value)
+
+    dispatcher('coroutines').process_message(Ping(2))
+    assert calls == [2]
+
+
+def test_failing_coroutine_handler_is_raised_in_threaded_mode():
+    @register_message_handler('test_processors_ping', 'failing_coroutine')
+    async def on_ping(message: Ping, context: Context):
+        raise ValueError(message.value)
+
+    with pytest.raises(ValueError):
+        dispatcher('failing_coroutine').process_message(Ping(3))
+
+
+@pytest.fixture
+def loop():
+    """An event loop running on its own thread, as the dhs runs it in the asyncio execution mode."""
+
+    loop = asyncio.new_event_loop()
+    worker = EventLoopWorker('test processors loop', loop)
+    worker.start()
+    yield loop
+    worker.abort()
+    worker.join(5)
+    assert not worker.is_alive()
+
+
+def async_dispatcher(name: str, loop) -> MessageQueueDispatcher:
+    disp = MessageQueueDispatcher(
+        name, AsyncIncomingMessageQueue(loop), Context(), loop=loop
+    )
+    disp.start_async()
+    return disp
+
+
+def test_coroutine_handlers_run_concurrently_in_asyncio_mode(loop):
+    handled = queue.Queue()
+    release = asyncio.Event()
+
+    @register_message_handler('test_processors_ping', 'async')
+    async def on_ping(message: Ping, context: Context):
+        if message.value == 0:
+            await release.wait()
+        handled.put((message.value, asyncio.get_running_loop() is loop))
+
+    @register_message_handler('test_processors_pong', 'async')
+    def on_pong(message: Pong, context: Context):
+        release.set()
+
+    disp = async_dispatcher('async', loop)
+    disp.queue(Ping(0))
+    disp.queue(Ping(1))
+    # The first handler is still waiting, the second one runs as its own task.
+    assert handled.get(timeout=5) == (1, True)
+    disp.queue(Pong())
+    assert handled.get(timeout=5) == (0, True)
+
+
+def test_failing_coroutine_handler_is_logged_in_asyncio_mode(loop, caplog):
+    handled = queue.Queue()
+
+    @register_message_handler('test_processors_ping', 'async_failing')
+    async def on_ping(message: Ping, context: Context):
+        if message.value == 'fail':
+            raise ValueError('handler failed')
+        handled.put(message.value)
+
+    @register_message_handler('test_processors_pong', 'async_failing')
+    def on_pong(message: Pong, context: Context):
+        raise ValueError('sync handler failed')
+
+    disp = async_dispatcher('async_failing', loop)
+    disp.queue(Ping('fail'))
+    disp.queue(Pong())
+    disp.queue(Ping('next'))
+    # The dispatcher keeps going after a handler fails on the loop.
+    assert handled.get(timeout=5) == 'next'
+    # Let the done callback of the failed task run.
+    asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop).result(5)
+    messages = [r.getMessage() for r in caplog.records]
+    assert 'Message handler failed' in messages
+    assert any(
+        r.exc_info and str(r.exc_info[1]) == 'sync handler failed'
+        for r in caplog.records
+    )
+
+
+def test_routed_messages_are_queued_for_the_other_dispatcher():
+    @register_message_handler('test_processors_pong', 'routed')
+    def on_pong(message: Pong, context: Context):
+        pass
+
+    routed = dispatcher('routed')
+    disp = MessageQueueDispatcher('routing', IncomingMessageQueue(), Context())
+    disp.add_route(routed)
+    disp._compile_dispatch_table()
+
+    pong = Pong()
+    disp.process_message(pong)
+    disp.process_message(Ping())
+    assert routed._msg_queue.fetch_many(10, 0) == [pong]
+
+
+def start_operation(text: bytes) -> DcssStoHStartOperation:
+    return DcssMessageFactory().create_message(text)
+
+
+def test_start_operations_are_dispatched_by_operation_name():
+    calls = []
+
+    @register_dcss_start_operation_handler('testOperation', 'operations')
+    def on_operation(message: DcssStoHStartOperation, context: DcssContext):
+        calls.append(message.operation_handle)
+
+    @register_dcss_start_operation_handler('testOperation', 'operations')
+    def also_on_operation(message: DcssStoHStartOperation, context: DcssContext):
+        calls.append('also ' + message.operation_handle)
+
+    active_operations = DcssActiveOperations()
+    disp = DcssMessageQueueDispatcher(
+        'operations',
+        IncomingMessageQueue(),
+        DcssContext(active_operations),
+        active_operations,
+    )
+    disp._compile_dispatch_table()
+
+    disp.process_message(start_operation(b'stoh_start_operation testOperation 1.1 a'))
+    disp.process_message(start_operation(b'stoh_start_operation otherOperation 1.2'))
+    assert calls == ['1.1', 'also 1.1']
+    # Only operations that have a handler become active.
+    assert [op.operation_handle for op in active_operations.get_operations()] == ['1.1']
+
+
+@pytest.fixture
+def started():
+    """Starts dispatchers and stops them again after the test."""
+
+    dispatchers = []
+
+    def start(disp: MessageQueueDispatcher) -> MessageQueueDispatcher:
+        dispatchers.append(disp)
+        disp.start()
+        return disp
+
+    yield start
+    for disp in dispatchers:
+        disp.abort()
+        disp.join(5)
+        assert not disp.is_alive()
+
+
+def test_register_dispatcher_settings():
+    register_dispatcher('configured', workers=2, priority_type_ids=['stoh_abort_all'])
+    assert DispatcherRegistry._get_dispatcher_names() == {'configured'}
+    assert DispatcherRegistry._get_dispatcher_settings('configured') == {
+        'workers': 2,
+        'key': None,
+        'priority_type_ids': ('stoh_abort_all',),
+    }
+    assert DispatcherRegistry._get_dispatcher_settings('not configured') == {}
+
+
+def test_messages_with_the_same_key_are_handled_in_order_on_one_worker(started):
+    handled = []
+    done = threading.Event()
+
+    @register_message_handler('test_processors_ping', 'keyed')
+    def on_ping(message: Ping, context: Context):
+        key, n = message.value
+        handled.append((key, n, threading.current_thread().name))
+        if len(handled) == 30:
+            done.set()
+
+    disp = started(
+        MessageQueueDispatcher(
+            'keyed',
+            IncomingMessageQueue(),
+            Context(),
+            workers=3,
+            key=lambda message: message.value[0],
+        )
+    )
+    for n in range(10):
+        for key in ('a', 'b', 'c'):
+            disp.queue(Ping((key, n)))
+
+    assert done.wait(5)
+    for key in ('a', 'b', 'c'):
+        key_handled = [(n, thread) for k, n, thread in handled if k == key]
+        assert [n for n, _ in key_handled] == list(range(10))
+        assert len({thread for _, thread in key_handled}) == 1
+        assert key_handled[0][1] != disp.name
+
+
+def test_slow_handler_only_blocks_its_own_key(started):
+    release = threading.Event()
+    handled = queue.Queue()
+
+    @register_message_handler('test_processors_ping', 'slow')
+    def on_ping(message: Ping, context: Context):
+        if message.value == 0:
+            release.wait(5)
+        handled.put(message.value)
+
+    # Integer keys hash to themselves, 0 and 1 go to different workers.
+    disp = started(
+        MessageQueueDispatcher(
+            'slow',
+            IncomingMessageQueue(),
+            Context(),
+            workers=2,
+            key=lambda message: message.value,
+        )
+    )
+    disp.queue(Ping(0))
+    disp.queue(Ping(1))
+    assert handled.get(timeout=5) == 1
+    release.set()
+    assert handled.get(timeout=5) == 0
+
+
+def test_pool_worker_keeps_running_when_a_handler_raises(started, caplog):
+    handled = queue.Queue()
+
+    @register_message_handler('test_processors_ping', 'failing_pool')
+    def on_ping(message: Ping, context: Context):
+        if message.value == 'fail':
+            raise ValueError('handler failed')
+        handled.put((message.value, threading.current_thread().name))
+
+    @register_message_handler('test_processors_ping', 'failing_pool')
+    def also_on_ping(message: Ping, context: Context):
+        handled.put(('also ' + message.value, threading.current_thread().name))
+
+    disp = started(
+        MessageQueueDispatcher(
+            'failing_pool',
+            IncomingMessageQueue(),
+            Context(),
+            workers=2,
+            key=lambda message: 'same key',
+        )
+    )
+    disp.queue(Ping('fail'))
+    disp.queue(Ping('next'))
+    # The other handlers still see the failed message, and later messages with the same key are still handled.
+    value, worker = handled.get(timeout=5)
+    assert value == 'also fail'
+    assert handled.get(timeout=5) == ('next', worker)
+    assert handled.get(timeout=5) == ('also next', worker)
+    assert any(
+        r.exc_info and str(r.exc_info[1]) == 'handler failed' for r in caplog.records
+    )
+    assert all(w.is_alive() for w in disp._pool)
+
+
+def test_priority_messages_bypass_the_worker_pool(started):
+    release = threading.Event()
+    handled = queue.Queue()
+
+    @register_message_handler('test_processors_ping', 'priority')
+    def on_ping(message: Ping, context: Context):
+        release.wait(5)
+        handled.put(('ping', threading.current_thread().name))
+
+    @register_message_handler('test_processors_pong', 'priority')
+    def on_pong(message: Pong, context: Context):
+        handled.put(('pong', threading.current_thread().name))
+
+    disp = started(
+        MessageQueueDispatcher(
+            'priority',
+            IncomingMessageQueue(),
+            Context(),
+            workers=1,
+            priority_type_ids=('test_processors_pong',),
+        )
+    )
+    disp.queue(Ping())
+    disp.queue(Ping())
+    disp.queue(Pong())
+    # The pong is handled on the dispatcher's own thread while the only worker is stuck on the first ping.
+    assert handled.get(timeout=5) == ('pong', disp.name)
+    release.set()
+    assert handled.get(timeout=5)[0] == 'ping'
+    assert handled.get(timeout=5)[0] == 'ping'
+
+
+def test_dcss_message_key():
+    assert (
+        dcss_message_key(start_operation(b'stoh_start_operation testOperation 1.3'))
+        == '1.3'
+    )
+    assert (
+        dcss_message_key(
+            DcssMessageFactory().create_message(b'stoh_start_motor_move m1 2.5')
+        )
+        == 'm1'
+    )
+    assert dcss_message_key(Ping()) is None
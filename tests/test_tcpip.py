@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import socket
+import threading
+import pytest
+from pydhsfw.dcss import DcssDhsV2MessageReaderWriter, DcssPackedMessage
+from pydhsfw.tcpip import (
+    AsyncTcpipClientTransport,
+    SocketStreamReader,
+    SocketStreamWriter,
+)
+from pydhsfw.transport import BatchStreamWriter, BufferStreamReader, TransportState
+
+
+@pytest.fixture
+def socket_pair():
+    local, remote = socket.socketpair()
+    yield local, remote
+    local.close()
+    remote.close()
+
+
+def connected_reader(sock: socket.socket, **config) -> SocketStreamReader:
+    reader = SocketStreamReader(config)
+    reader.socket = sock
+    reader._connected = True
+    return reader
+
+
+def test_read_returns_views_into_the_ring(socket_pair):
+    local, remote = socket_pair
+    reader = connected_reader(local, socket_read_buffer_size=16)
+    remote.sendall(b'aaaaaabbbbbbcccccc')
+
+    first = reader.read(6)
+    second = reader.read(6)
+    assert (bytes(first), bytes(second)) == (b'aaaaaa', b'bbbbbb')
+    assert first.obj is reader._buffer and second.obj is reader._buffer
+
+    # The third read doesn't fit in what is left of the ring, it wraps around over the first one.
+    third = reader.read(6)
+    assert bytes(third) == b'cccccc'
+    assert bytes(first) == b'cccccc'
+    assert bytes(second) == b'bbbbbb'
+
+
+def test_read_larger_than_the_ring_leaves_it_alone(socket_pair):
+    local, remote = socket_pair
+    reader = connected_reader(local, socket_read_buffer_size=8)
+    remote.sendall(b'12345678' + b'x' * 20)
+
+    first = reader.read(8)
+    large = reader.read(20)
+    assert bytes(large) == b'x' * 20
+    assert large.obj is not reader._buffer
+    assert bytes(first) == b'12345678'
+
+
+def test_read_waits_for_the_rest_of_the_message(socket_pair):
+    local, remote = socket_pair
+    reader = connected_reader(local, socket_read_chunk_size=4)
+    remote.sendall(b'0123456')
+    threading.Timer(0.1, remote.sendall, (b'789',)).start()
+    assert bytes(reader.read(10)) == b'0123456789'
+
+
+def test_read_raises_when_the_peer_closes(socket_pair):
+    local, remote = socket_pair
+    reader = connected_reader(local)
+    remote.sendall(b'abc')
+    remote.close()
+    with pytest.raises(ConnectionAbortedError):
+        reader.read(4)
+
+
+def test_read_zero_bytes():
+    reader = connected_reader(None)
+    assert reader.read(0) is None
+
+
+def test_messages_are_copied_out_of_the_ring(socket_pair):
+    local, remote = socket_pair
+    # A small ring that every message wraps around.
+    reader = connected_reader(local, socket_read_buffer_size=64)
+    message_reader = DcssDhsV2MessageReaderWriter()
+    texts = [b'stoh_start_motor_move motor_%d %d.5' % (i, i) for i in range(20)]
+    remote.sendall(b''.join(bytes(DcssPackedMessage.from_text(t)) for t in texts))
+
+    received = [message_reader.read_msg(reader) for _ in texts]
+    # Trailing ' \0' terminators are DCSS framing, the messages keep their text.
+    assert [r.rstrip(b' ') for r in received] == texts
+    assert all(isinstance(r, bytes) for r in received)
+
+
+class PartialSendSocket:
+    """Socket that sends at most max_send bytes per sendmsg call, like a socket with a full send buffer."""
+
+    def __init__(self, max_send: int):
+        self.max_send = max_send
+        self.sent = bytearray()
+        self.calls = []
+
+    def sendmsg(self, buffers) -> int:
+        self.calls.append(len(buffers))
+        data = b''.join(buffers)[: self.max_send]
+        self.sent += data
+        return len(data)
+
+
+class NoSendmsgSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendall(self, buffer):
+        self.sent.append(bytes(buffer))
+
+
+def connected_writer(sock) -> SocketStreamWriter:
+    writer = SocketStreamWriter()
+    writer.socket = sock
+    return writer
+
+
+def test_write_many_resumes_partial_sends():
+    buffers = [b'abc', bytearray(b'defgh'), memoryview(b'ij'), b'', b'klmnop']
+    for max_send in (1, 2, 4, 7, 100):
+        sock = PartialSendSocket(max_send)
+        connected_writer(sock).write_many(buffers)
+        assert bytes(sock.sent) == b'abcdefghijklmnop'
+
+
+def test_write_many_splits_at_max_iov(monkeypatch):
+    monkeypatch.setattr(SocketStreamWriter, '_max_iov', 3)
+    sock = PartialSendSocket(100)
+    connected_writer(sock).write_many([b'%d' % i for i in range(8)])
+    assert bytes(sock.sent) == b'01234567'
+    assert sock.calls == [3, 3, 2]
+
+
+def test_write_many_without_sendmsg():
+    sock = NoSendmsgSocket()
+    connected_writer(sock).write_many([b'abc', b'def'])
+    assert sock.sent == [b'abcdef']
+
+
+def test_write_many_larger_than_the_socket_buffer(socket_pair):
+    local, remote = socket_pair
+    # More than fits in the socket buffers, so sendmsg returns partial sends while the other end drains.
+    buffers = [bytes([i]) * 100000 for i in range(20)]
+    received = bytearray()
+
+    def drain():
+        while len(received) < 2000000:
+            received.extend(remote.recv(65536))
+
+    drainer = threading.Thread(target=drain)
+    drainer.start()
+    connected_writer(local).write_many(buffers)
+    drainer.join(10)
+    assert bytes(received) == b''.join(buffers)
+
+
+def test_batched_messages_round_trip(socket_pair):
+    local, remote = socket_pair
+    message_writer = DcssDhsV2MessageReaderWriter()
+    texts = [
+        b'htos_motor_move_completed motor_%d %d.5 normal' % (i, i) for i in range(5)
+    ]
+    batch_writer = BatchStreamWriter()
+    for text in texts:
+        message_writer.write_msg(batch_writer, DcssPackedMessage.from_text(text))
+    connected_writer(local).write_many(batch_writer.buffers)
+
+    reader = connected_reader(remote)
+    received = [message_writer.read_msg(reader) for _ in texts]
+    assert [r.rstrip(b' ') for r in received] == texts
+
+
+def frames(*texts) -> bytes:
+    return b''.join(bytes(DcssPackedMessage.from_text(t)) for t in texts)
+
+
+def test_buffer_reader_rewinds_incomplete_reads():
+    reader = BufferStreamReader()
+    reader.feed(b'abcdef')
+    assert reader.read(2) == b'ab'
+    reader.mark()
+    assert reader.read(2) == b'cd'
+    with pytest.raises(asyncio.IncompleteReadError) as e:
+        reader.read(4)
+    assert e.value.partial == b'ef'
+
+    reader.rewind()
+    reader.compact()
+    # Only what was read before the mark is discarded.
+    assert bytes(reader._buffer) == b'cdef'
+    reader.feed(b'gh')
+    assert reader.read(6) == b'cdefgh'
+    assert reader.read(0) is None
+    reader.compact()
+    assert reader._buffer == bytearray()
+
+    reader.feed(b'left over')
+    reader.clear()
+    with pytest.raises(asyncio.IncompleteReadError):
+        reader.read(1)
+
+
+class FakeAsyncioTransport:
+    def __init__(self):
+        self.closed = False
+        self.paused = False
+
+    def close(self):
+        self.closed = True
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+
+@pytest.fixture
+def async_transport():
+    """An AsyncTcpipClientTransport with a fake connection, that records the raw messages it receives."""
+
+    loop = asyncio.new_event_loop()
+    reader_writer = DcssDhsV2MessageReaderWriter()
+    transport = AsyncTcpipClientTransport(
+        'test', 'dcss://127.0.0.1:1', reader_writer, reader_writer, loop
+    )
+    transport._transport = FakeAsyncioTransport()
+    transport.received = []
+    transport.set_receive_callback(
+        lambda raw_msg: transport.received.append(raw_msg.rstrip(b' '))
+    )
+    yield transport
+    loop.close()
+
+
+def test_frames_split_across_reads(async_transport):
+    texts = [b'stoh_abort_all soft', b'stoh_start_motor_move m1 2.5']
+    data = frames(*texts)
+    # Every split point, including inside the header.
+    for split in range(1, len(data)):
+        async_transport.received.clear()
+        async_transport._data_received(data[:split])
+        async_transport._data_received(data[split:])
+        assert async_transport.received == texts
+        assert async_transport._stream_reader._buffer == bytearray()
+
+
+def test_data_one_byte_at_a_time(async_transport):
+    texts = [b'stoh_abort_all soft'] * 3
+    for byte in frames(*texts):
+        async_transport._data_received(bytes([byte]))
+    assert async_transport.received == texts
+
+
+def test_framing_error_drops_the_connection(async_transport):
+    bad_header = b'%12d%13s ' % (5, b'x')
+    async_transport._data_received(
+        frames(b'stoh_abort_all soft') + bad_header + frames(b'stoh_abort_all hard')
+    )
+    assert async_transport.received == [b'stoh_abort_all soft']
+    assert async_transport._transport.closed
+
+
+def test_paused_reading_leaves_frames_buffered(async_transport):
+    texts = [b'stoh_start_motor_move m%d 1' % n for n in range(3)]
+
+    def receive(raw_msg):
+        async_transport.received.append(raw_msg.rstrip(b' '))
+        async_transport.pause_reading()
+
+    async_transport.set_receive_callback(receive)
+    async_transport._data_received(frames(*texts))
+    assert async_transport.received == texts[:1]
+    assert async_transport._transport.paused
+
+    async_transport.set_receive_callback(
+        lambda raw_msg: async_transport.received.append(raw_msg.rstrip(b' '))
+    )
+    async_transport.resume_reading()
+    assert async_transport.received == texts
+    assert not async_transport._transport.paused
+
+
+def test_async_transport_round_trip():
+    loop = asyncio.new_event_loop()
+    server = socket.create_server(('127.0.0.1', 0))
+    reader_writer = DcssDhsV2MessageReaderWriter()
+    transport = AsyncTcpipClientTransport(
+        'test',
+        f'dcss://127.0.0.1:{server.getsockname()[1]}',
+        reader_writer,
+        reader_writer,
+        loop,
+    )
+    received = []
+    transport.set_receive_callback(received.append)
+
+    async def until(predicate):
+        while not predicate():
+            await asyncio.sleep(0.01)
+
+    def run_until(predicate):
+        loop.run_until_complete(asyncio.wait_for(until(predicate), 5))
+
+    peer = None
+    try:
+        transport.connect()
+        run_until(lambda: transport.state == TransportState.CONNECTED)
+        peer = server.accept()[0]
+
+        peer.sendall(frames(b'stoh_abort_all soft', b'stoh_abort_all hard'))
+        run_until(lambda: len(received) == 2)
+        assert [r.rstrip(b' ') for r in received] == [
+            b'stoh_abort_all soft',
+            b'stoh_abort_all hard',
+        ]
+
+        transport.send(DcssPackedMessage.from_text(b'htos_log info dhs hello'))
+        reader = connected_reader(peer)
+        assert reader_writer.read_msg(reader).rstrip(b' ') == b'htos_log info dhs hello'
+
+        transport.disconnect()
+        run_until(lambda: transport.state == TransportState.DISCONNECTED)
+        assert peer.recv(1) == b''
+    finally:
+        for sock in (peer, server):
+            if sock is not None:
+                sock.close()
+        loop.close()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import socket
+import threading
+import time
+from pydhsfw.messages import BlockingQueue
+from pydhsfw.tcpip import SocketStreamReader
+from pydhsfw.threads import (
+    AbortableThread,
+    CancellableThreadPoolExecutor,
+    EventLoopWorker,
+    ThreadStopped,
+    call_soon,
+    current_stop_token,
+    running_on,
+)
+
+
+def test_shutdown_now_cancels_work_that_has_not_started():
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking():
+        started.set()
+        release.wait(5)
+        return 'done'
+
+    executor = CancellableThreadPoolExecutor(1)
+    running = executor.submit(blocking)
+    started.wait(5)
+    pending = [executor.submit(lambda: 'ran') for _ in range(5)]
+
+    executor.shutdown_now()
+    release.set()
+
+    assert running.result(5) == 'done'
+    assert all(future.cancelled() for future in pending)
+
+
+def abort_blocked(target) -> list:
+    """Run target in an AbortableThread, abort it once it's blocked and return what it raised."""
+
+    raised = []
+
+    def run():
+        try:
+            target()
+        except BaseException as e:
+            raised.append(e)
+
+    thread = AbortableThread(target=run)
+    thread.start()
+    time.sleep(0.1)
+    assert thread.is_alive()
+
+    start = time.monotonic()
+    thread.abort()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert time.monotonic() - start < 1
+    return raised
+
+
+def test_abort_wakes_queue_fetch():
+    queue = BlockingQueue()
+    raised = abort_blocked(queue.fetch)
+    assert len(raised) == 1 and isinstance(raised[0], ThreadStopped)
+
+
+def test_abort_wakes_stop_token_wait():
+    raised = abort_blocked(lambda: current_stop_token().wait())
+    assert len(raised) == 1 and isinstance(raised[0], ThreadStopped)
+
+
+def test_abort_wakes_socket_read():
+    reader = SocketStreamReader()
+    local, remote = socket.socketpair()
+    try:
+        reader.socket = local
+        reader._connected = True
+        # Nothing is ever sent, the read waits for data until it's aborted.
+        raised = abort_blocked(lambda: reader.read(4))
+    finally:
+        local.close()
+        remote.close()
+    assert len(raised) == 1 and isinstance(raised[0], ThreadStopped)
+
+
+def test_abort_wakes_socket_read_waiting_to_connect():
+    reader = SocketStreamReader()
+    raised = abort_blocked(lambda: reader.read(4))
+    assert len(raised) == 1 and isinstance(raised[0], ThreadStopped)
+
+
+def test_event_loop_worker_runs_the_loop_until_aborted():
+    loop = asyncio.new_event_loop()
+    worker = EventLoopWorker('test', loop)
+    worker.start()
+    cancelled = threading.Event()
+
+    async def on_loop():
+        return running_on(loop), threading.current_thread().name
+
+    async def forever():
+        try:
+            await asyncio.sleep(60)
+        finally:
+            cancelled.set()
+
+    try:
+        assert asyncio.run_coroutine_threadsafe(on_loop(), loop).result(5) == (
+            True,
+            worker.name,
+        )
+        asyncio.run_coroutine_threadsafe(forever(), loop)
+        called = threading.Event()
+        call_soon(loop, called.set)
+        assert called.wait(5)
+        assert not running_on(loop)
+    finally:
+        worker.abort()
+        worker.join(5)
+
+    assert not worker.is_alive()
+    # Tasks still running when the loop stops are cancelled and the loop is closed.
+    assert cancelled.is_set()
+    assert loop.is_closed()
+    # Aborting again once the loop is closed is harmless.
+    worker.abort()
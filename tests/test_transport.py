@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+from types import SimpleNamespace
+import pytest
+from pydhsfw import transport
+from pydhsfw.transport import ReconnectPolicy, TransportState, TransportStateMachine
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(transport, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+@pytest.fixture(autouse=True)
+def seeded_random(monkeypatch):
+    monkeypatch.setattr(transport, 'random', random.Random(1234))
+
+
+def policy(**config) -> ReconnectPolicy:
+    config.setdefault(ReconnectPolicy.RECONNECT_JITTER, 0)
+    return ReconnectPolicy('dcss://localhost:14242', config)
+
+
+def test_backoff_grows_to_max_delay():
+    p = policy(reconnect_circuit_threshold=0)
+    delays = [p.failed() for _ in range(9)]
+    assert delays == [0.0, 0.5, 1.0, 2.0, 4.0, 8.0, 10.0, 10.0, 10.0]
+    assert p.failures == 9
+    assert not p.circuit_open
+
+
+def test_backoff_config():
+    p = policy(
+        reconnect_initial_delay=1,
+        reconnect_backoff_multiplier=3,
+        reconnect_max_delay=20,
+        reconnect_circuit_threshold=0,
+    )
+    assert [p.failed() for _ in range(6)] == [0.0, 1.0, 3.0, 9.0, 20.0, 20.0]
+
+
+def test_max_delay_defaults_to_connect_retry_delay():
+    p = policy(connect_retry_delay=3, reconnect_circuit_threshold=0)
+    assert [p.failed() for _ in range(5)] == [0.0, 0.5, 1.0, 2.0, 3.0]
+
+
+def test_jitter_bounds():
+    p = policy(reconnect_jitter=0.5, reconnect_circuit_threshold=0)
+    p.failed()
+    delays = []
+    for _ in range(1000):
+        delays.append(p.failed())
+        p.reset()
+        p.failed()
+
+    # The second failure waits the initial delay less up to half of it.
+    assert all(0.25 <= delay <= 0.5 for delay in delays)
+    assert max(delays) - min(delays) > 0.2
+
+
+def test_jitter_is_clamped():
+    p = policy(reconnect_jitter=5, reconnect_circuit_threshold=0)
+    p.failed()
+    assert all(0.0 <= p.failed() <= 10.0 for _ in range(100))
+
+
+def test_circuit_opens_after_threshold_failures():
+    p = policy(reconnect_circuit_threshold=4, reconnect_circuit_open_delay=60)
+    delays = []
+    for _ in range(3):
+        delays.append(p.failed())
+        assert not p.circuit_open
+    assert delays == [0.0, 0.5, 1.0]
+
+    assert p.failed() == 60.0
+    assert p.circuit_open
+    assert p.failed() == 60.0
+
+
+def test_circuit_half_open_recovery(clock):
+    p = policy(reconnect_circuit_threshold=3, reconnect_circuit_open_delay=60)
+    for _ in range(3):
+        p.failed()
+    assert p.circuit_open
+
+    # A trial connection that drops before it's stable keeps the circuit open.
+    p.connected()
+    clock.advance(5)
+    assert p.failed() == 60.0
+    assert p.circuit_open
+
+    # One that stays up closes it, the next failure is retried immediately and backs off from the start.
+    p.connected()
+    clock.advance(10)
+    assert p.failed() == 0.0
+    assert not p.circuit_open
+    assert p.failures == 1
+    assert p.failed() == 0.5
+
+
+def test_stable_connection_resets_backoff(clock):
+    p = policy(reconnect_circuit_threshold=0)
+    for _ in range(4):
+        p.failed()
+
+    p.connected()
+    clock.advance(9.9)
+    assert p.failed() == 4.0
+
+    p.connected()
+    clock.advance(10)
+    assert p.failed() == 0.0
+
+
+def test_reset_retries_immediately():
+    p = policy(reconnect_circuit_threshold=2)
+    p.failed()
+    p.failed()
+    assert p.circuit_open
+
+    p.reset()
+    assert not p.circuit_open
+    assert p.failed() == 0.0
+
+
+def test_subscribers_notified_in_order():
+    state_machine = TransportStateMachine('test', 'dcss://localhost:14242')
+    calls = []
+
+    def failing(old_state, new_state):
+        calls.append(('failing', old_state, new_state))
+        raise RuntimeError
+
+    state_machine.subscribe(lambda o, n: calls.append(('first', o, n)))
+    state_machine.subscribe(failing)
+    state_machine.subscribe(lambda o, n: calls.append(('last', o, n)))
+
+    state_machine.set_state(TransportState.CONNECTING)
+    state_machine.set_state(TransportState.CONNECTING)
+    state_machine.set_state(TransportState.CONNECTED)
+
+    d, c, cd = (
+        TransportState.DISCONNECTED,
+        TransportState.CONNECTING,
+        TransportState.CONNECTED,
+    )
+    # Every transition reaches every subscriber in the order they subscribed, an error in one doesn't stop the
+    # others and setting the current state again isn't a transition.
+    assert calls == [
+        ('first', d, c),
+        ('failing', d, c),
+        ('last', d, c),
+        ('first', c, cd),
+        ('failing', c, cd),
+        ('last', c, cd),
+    ]
+    assert state_machine.state == TransportState.CONNECTED
+
+
+def test_unsubscribe():
+    state_machine = TransportStateMachine('test', 'dcss://localhost:14242')
+    calls = []
+
+    def callback(old_state, new_state):
+        calls.append(new_state)
+
+    state_machine.subscribe(callback)
+    state_machine.set_state(TransportState.CONNECTING)
+    state_machine.unsubscribe(callback)
+    state_machine.set_state(TransportState.CONNECTED)
+    assert calls == [TransportState.CONNECTING]
+
+
+def test_request_wakes_wait_for_request():
+    state_machine = TransportStateMachine('test', 'dcss://localhost:14242')
+    assert state_machine.wait_for_request(0) is None
+
+    threading.Timer(0.05, state_machine.request, (TransportState.CONNECTED,)).start()
+    assert state_machine.wait_for_request(5) == TransportState.CONNECTED
+    assert state_machine.desired_state == TransportState.CONNECTED
+
+    # Asking for the state that is already desired isn't a new request.
+    state_machine.request(TransportState.CONNECTED)
+    assert state_machine.wait_for_request(0) is None